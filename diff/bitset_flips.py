@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""Vectorized flip detection on bit-packed test outcomes.
+
+Instead of building four sets of test names for every pair of consecutive
+builds, the outcomes of a whole product history are stored as two bit
+matrices over a fixed test index, one row per build:
+
+    passed[b, t] is set if test t passed in build b
+    failed[b, t] is set if test t failed in build b
+
+A test is known in a build if it either passed or failed. The flips between
+every build and the next one are then computed at once as
+
+    ((next_pass & ~prev_pass) | (next_fail & ~prev_fail)) &
+        prev_known & next_known
+
+which is exactly what `difference_engine.flips` does with sets. When no test
+is both passed and failed in the same build this is the same thing as
+`(prev_fail ^ next_fail) & prev_known & next_known`.
+
+Each row is packed eight tests to a byte, so a product with 10^4 tests and
+10^5 builds needs about 125 MB per matrix.
+"""
+
+import numpy
+
+from diff.difference_engine import intern_build
+from diff.difference_engine import module_set
+from diff.difference_engine import rm_params_from_names
+from util import metrics
+from util.util import SymbolTable
+
+# Amount of builds unpacked from bits at a time when listing the flips
+UNPACK_ROWS = 4096
+
+
+def pack_rows(rows, width):
+    """Create a bit matrix from a list of index arrays.
+
+    Args:
+        rows (list): One numpy array of set column indices per row
+        width (int): Amount of columns
+
+    Returns:
+        (numpy.ndarray): uint8 matrix of shape (len(rows), ceil(width / 8)),
+        in the bit order used by `numpy.packbits`
+    """
+    bits = numpy.zeros((len(rows), (width + 7) // 8), dtype=numpy.uint8)
+    if not rows:
+        return bits
+    row_idx = numpy.repeat(numpy.arange(len(rows)), [len(row) for row in rows])
+    cols = numpy.concatenate(rows).astype(numpy.int64)
+    masks = (128 >> (cols & 7)).astype(numpy.uint8)
+    numpy.bitwise_or.at(bits, (row_idx, cols >> 3), masks)
+    return bits
+
+
+def flip_matrix(passed, failed):
+    """Compute the flips between all consecutive rows of the bit matrices
+    passed and failed, see the module documentation.
+
+    Returns:
+        (numpy.ndarray): A bit matrix with one row less than the input, where
+        row b holds the tests that flipped between build b and b + 1
+    """
+    known = passed | failed
+    return (((passed[1:] & ~passed[:-1]) | (failed[1:] & ~failed[:-1])) &
+            known[:-1] & known[1:])
+
+
+def unpack_rows(bits, width):
+    """Turn a bit matrix back into one list of set column indices per row"""
+    rows = []
+    for start in range(0, len(bits), UNPACK_ROWS):
+        chunk = numpy.unpackbits(bits[start:start + UNPACK_ROWS], axis=1,
+                                 count=width)
+        row_idx, cols = numpy.nonzero(chunk)
+        bounds = numpy.searchsorted(row_idx, numpy.arange(len(chunk) + 1))
+        cols = cols.tolist()
+        rows.extend(cols[bounds[row]:bounds[row + 1]]
+                    for row in range(len(chunk)))
+    return rows
+
+
+def product_flips(test_results):
+    """Find the flipped tests between each consecutive pair of builds.
+
+    Args:
+        test_results (list): The 'tests' entry of each build of a product, in
+            order, e.g: [{'pass': ['t1'], 'fail': ['t2']}, ...]. Test names
+            must already be normalized.
+
+    Returns:
+        (list): One list of flipped test names per build. The first build has
+        nothing to compare to and gets an empty list.
+    """
+    test_index = SymbolTable()
+    passed, failed = [], []
+    for tests in test_results:
+        for names, rows in ((tests['pass'], passed), (tests['fail'], failed)):
+            rows.append(numpy.fromiter(
+                (test_index.intern(name) for name in names),
+                dtype=numpy.int64, count=len(names)))
+
+    width = len(test_index)
+    flipped = flip_matrix(pack_rows(passed, width), pack_rows(failed, width))
+    names = test_index.names
+    return [[]] + [[names[col] for col in row]
+                   for row in unpack_rows(flipped, width)]
+
+
+def _normalized(build):
+    """Strip parameters from the test names in build"""
+    return {'modules': build['modules'],
+            'tests': {'pass': rm_params_from_names(build['tests']['pass']),
+                      'fail': rm_params_from_names(build['tests']['fail'])}}
+
+
+def _diff_product(builds, seed_build, sort_key):
+    """Diff one product's builds, optionally continuing from seed_build, the
+    last build that was seen of the product earlier in the stream"""
+    if seed_build is not None:
+        builds = [seed_build] + builds
+    test_flips = product_flips([build['tests'] for build in builds])
+    counting = metrics.enabled()
+    prev_modules = module_set(builds[0])
+    for index, current_build in enumerate(builds):
+        if seed_build is not None and index == 0:
+            continue
+        modules = module_set(current_build) if index else prev_modules
+        module_diff = [mod[0] for mod in modules - prev_modules]
+        if counting:
+            metrics.count('builds_diffed')
+            metrics.count('flips_found', len(test_flips[index]))
+        yield {'modules': sorted(module_diff, key=sort_key),
+               'tests': sorted(test_flips[index], key=sort_key)}
+        prev_modules = modules
+
+
+def diff_build_stream_bitset(builds, symbols=None):
+    """Bitset version of `difference_engine.diff_build_stream`.
+
+    The builds of each product are collected and their flips are computed
+    with one vectorized operation, so the memory needed is that of the
+    longest run of builds of a single product rather than two builds.
+
+    Args:
+        builds (iterable): (product, buildname, build) tuples, in order
+        symbols (SymbolTable): If set, intern names in symbols and yield ids
+
+    Yields:
+        (dict): The changed modules and flipped tests of each build, in the
+        same order and with the same contents as `diff_build_stream`
+    """
+    sort_key = symbols.name if symbols is not None else None
+    last_builds = {}
+    product, product_builds = None, []
+    for current_product, _, build in builds:
+        if current_product != product and product_builds:
+            for diff in _diff_product(product_builds, last_builds.get(product),
+                                      sort_key):
+                yield diff
+            last_builds[product] = product_builds[-1]
+            product_builds = []
+        product = current_product
+        if symbols is not None:
+            product_builds.append(intern_build(build, symbols))
+        else:
+            product_builds.append(_normalized(build))
+
+    if product_builds:
+        for diff in _diff_product(product_builds, last_builds.get(product),
+                                  sort_key):
+            yield diff
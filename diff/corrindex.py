@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""Compact binary index of correlation data.
+
+Parsing a big correlation json file just to look up the tests of a few
+modules costs far more than the lookup itself. The index stores the same data
+in a binary file that can be memory mapped, so that a query only touches the
+pages that belong to the modules it asks for.
+
+File layout, all integers little endian:
+
+    header          magic b'DEIX', version, nbr of modules, nbr of tests,
+                    nbr of entries  (struct '<4sIIIQ')
+    module table    one record per module, sorted by name:
+                    name offset, name length, first entry, nbr of entries
+                    (struct '<QIQI')
+    test table      one record per test, sorted by name, the index of a record
+                    is the test id: name offset, name length (struct '<QI')
+    test ids        one uint32 per entry, the entries of each module are
+                    stored together and sorted by test id
+    weights         one uint32 per entry, in the same order as the test ids
+    strings         all module and test names, utf-8 encoded
+
+A CorrelationIndex behaves like a read only version of the correlation dict,
+e.g. `index['mod1']` returns `{'testA': 2, 'testB': 1}`.
+"""
+
+import mmap
+import struct
+import sys
+from array import array
+
+MAGIC = b'DEIX'
+VERSION = 1
+
+HEADER = struct.Struct('<4sIIIQ')
+MODULE_RECORD = struct.Struct('<QIQI')
+TEST_RECORD = struct.Struct('<QI')
+ENTRY_SIZE = 4  # uint32 test ids and weights
+
+
+def is_index(filename):
+    """Returns True if filename is a correlation index"""
+    try:
+        with open(filename, 'rb') as fileh:
+            return fileh.read(len(MAGIC)) == MAGIC
+    except (OSError, IOError):
+        return False
+
+
+def _uint32_array(values):
+    """Create a little endian uint32 array"""
+    values = array('I', values)
+    if values.itemsize != ENTRY_SIZE:
+        raise TypeError("array('I') is not 32 bits on this platform")
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+def write_index(correlation, filename):
+    """Write correlation to filename as a binary index.
+
+    Args:
+        correlation (dict): Modules mapped to dicts of tests and weights, as
+            returned by `difference_engine.correlate`
+        filename (str): The file to write
+    """
+    modules = sorted(correlation)
+    tests = sorted({test for module in modules for test in correlation[module]})
+    test_ids = {test: index for index, test in enumerate(tests)}
+
+    strings = bytearray()
+    module_table = bytearray()
+    test_table = bytearray()
+    entry_tests, entry_weights = [], []
+    for module in modules:
+        name = module.encode('utf-8')
+        entries = sorted((test_ids[test], weight) for test, weight in
+                         correlation[module].items())
+        module_table += MODULE_RECORD.pack(len(strings), len(name),
+                                           len(entry_tests), len(entries))
+        strings += name
+        entry_tests.extend(entry[0] for entry in entries)
+        entry_weights.extend(entry[1] for entry in entries)
+    for test in tests:
+        name = test.encode('utf-8')
+        test_table += TEST_RECORD.pack(len(strings), len(name))
+        strings += name
+
+    with open(filename, 'wb') as fileh:
+        fileh.write(HEADER.pack(MAGIC, VERSION, len(modules), len(tests),
+                                len(entry_tests)))
+        fileh.write(module_table)
+        fileh.write(test_table)
+        fileh.write(_uint32_array(entry_tests).tobytes())
+        fileh.write(_uint32_array(entry_weights).tobytes())
+        fileh.write(strings)
+
+
+class CorrelationIndex(object):
+    """Read only, memory mapped access to a correlation index file"""
+
+    def __init__(self, filename):
+        with open(filename, 'rb') as fileh:
+            self._mmap = mmap.mmap(fileh.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self._nbr_modules, self._nbr_tests, nbr_entries = \
+            HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError("{} is not a version {} correlation index".format(
+                filename, VERSION))
+        self._modules_at = HEADER.size
+        self._tests_at = (self._modules_at +
+                          self._nbr_modules * MODULE_RECORD.size)
+        self._test_ids_at = self._tests_at + self._nbr_tests * TEST_RECORD.size
+        self._weights_at = self._test_ids_at + nbr_entries * ENTRY_SIZE
+        self._strings_at = self._weights_at + nbr_entries * ENTRY_SIZE
+        self._test_names = {}  # decoded test names, by id
+
+    def close(self):
+        """Unmap the index file"""
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _string(self, offset, length):
+        start = self._strings_at + offset
+        return self._mmap[start:start + length].decode('utf-8')
+
+    def _module(self, index):
+        """Return (name, first entry, nbr of entries) of module nbr index"""
+        offset, length, first, count = MODULE_RECORD.unpack_from(
+            self._mmap, self._modules_at + index * MODULE_RECORD.size)
+        return self._string(offset, length), first, count
+
+    def _test(self, test_id):
+        """Return the name of test_id"""
+        try:
+            return self._test_names[test_id]
+        except KeyError:
+            name = self._test_names[test_id] = self._string(
+                *TEST_RECORD.unpack_from(
+                    self._mmap, self._tests_at + test_id * TEST_RECORD.size))
+            return name
+
+    def _find(self, module):
+        """Binary search the module table for module. Returns the record of
+        the module, or None if it is not in the index."""
+        low, high = 0, self._nbr_modules
+        while low < high:
+            middle = (low + high) // 2
+            record = self._module(middle)
+            if record[0] < module:
+                low = middle + 1
+            elif record[0] > module:
+                high = middle
+            else:
+                return record
+        return None
+
+    def _entries(self, first, count):
+        """Return the test ids and weights of a range of entries"""
+        fmt = '<{}I'.format(count)
+        test_ids = struct.unpack_from(fmt, self._mmap,
+                                      self._test_ids_at + first * ENTRY_SIZE)
+        weights = struct.unpack_from(fmt, self._mmap,
+                                     self._weights_at + first * ENTRY_SIZE)
+        return test_ids, weights
+
+    def _tests(self, first, count):
+        """Return the tests and weights of a range of entries as a dict"""
+        test_ids, weights = self._entries(first, count)
+        return {self._test(test_id): weight
+                for test_id, weight in zip(test_ids, weights)}
+
+    def __getitem__(self, module):
+        record = self._find(module)
+        if record is None:
+            raise KeyError(module)
+        return self._tests(record[1], record[2])
+
+    def get(self, module, default=None):
+        """Return the tests of module, or default if it is not indexed"""
+        try:
+            return self[module]
+        except KeyError:
+            return default
+
+    def __contains__(self, module):
+        return self._find(module) is not None
+
+    def __iter__(self):
+        for index in range(self._nbr_modules):
+            yield self._module(index)[0]
+
+    def __len__(self):
+        return self._nbr_modules
+
+    def items(self):
+        """Iterate over (module, tests) pairs, in module name order"""
+        for index in range(self._nbr_modules):
+            module, first, count = self._module(index)
+            yield module, self._tests(first, count)
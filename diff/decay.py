@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""Time-decayed correlation weights.
+
+`difference_engine.correlate` gives every flip in the history the same weight,
+so module/test relationships that stopped mattering long ago never go away.
+Here the weight of a flip halves every `half_life` builds instead. A flip in
+the latest build weighs 1, one that is half_life builds old weighs 0.5, and so
+on. The age of a flip is counted in builds of its own product, so that a
+product is not aged by the builds of the products after it in the history.
+
+Decaying every weight for every new build would cost O(table) per build, so
+each count instead stores the build index of its product it was last updated
+at:
+
+    module -> test -> product -> [weight at that build, build index]
+
+A new flip only decays and increments its own count, which makes adding
+builds O(new module/test pairs). All other weights are decayed when they are
+read, see `DecayedCorrelation.correlation`, and the weights of the products
+of a pair are summed.
+
+Diffs do not say which product they belong to. Each build gives exactly one
+diff, in order, so the products are recorded from the build stream with
+`tag_products` and taken from the front as the diffs are added.
+"""
+
+from collections import OrderedDict
+
+# Decimals of the decayed weights in correlation output
+WEIGHT_DIGITS = 6
+# Weights below this round to 0 in correlation output
+MIN_WEIGHT = 0.5 * 10 ** -WEIGHT_DIGITS
+# Product of diffs that are added without one
+DEFAULT_PRODUCT = ''
+
+
+def tag_products(builds, products):
+    """Yield the items of a build stream unchanged, appending the product of
+    each to products.
+
+    Args:
+        builds (iterable): (product, buildname, build) tuples, in order
+        products (deque): Gets the product of each build
+    """
+    for item in builds:
+        products.append(item[0])
+        yield item
+
+
+class DecayedCorrelation(object):
+    """Correlation counts that decay with a half-life measured in builds"""
+
+    def __init__(self, half_life, builds=None, counts=None):
+        """Create an empty correlation, or continue from a saved one.
+
+        Args:
+            half_life (float): Amount of builds for a weight to halve
+            builds (dict): Amount of builds added so far, by product
+            counts (dict): module -> test -> product -> [weight, build
+                index], see the module documentation
+        """
+        if half_life <= 0:
+            raise ValueError("half_life must be positive, was {}".format(
+                half_life))
+        self.half_life = half_life
+        self.builds = builds if builds is not None else OrderedDict()
+        self.counts = counts if counts is not None else OrderedDict()
+
+    def _decay(self, age):
+        """Returns the factor a weight decays with in age builds"""
+        return 0.5 ** (age / float(self.half_life))
+
+    def _weight(self, product, count):
+        """Returns the weight of count of product as of the latest build of
+        product"""
+        weight, index = count
+        return weight * self._decay(self.builds[product] - 1 - index)
+
+    def add_diff(self, diff, product=DEFAULT_PRODUCT):
+        """Add the changed modules and flipped tests of the next build of
+        product"""
+        index = self.builds.get(product, 0)
+        self.builds[product] = index + 1
+        for module in diff['modules']:
+            try:
+                tests = self.counts[module]
+            except KeyError:
+                tests = self.counts[module] = OrderedDict()
+            for test in diff['tests']:
+                try:
+                    products = tests[test]
+                except KeyError:
+                    products = tests[test] = OrderedDict()
+                count = products.get(product)
+                if count is None:
+                    products[product] = [1.0, index]
+                else:
+                    count[0] = count[0] * self._decay(index - count[1]) + 1
+                    count[1] = index
+
+    def add(self, diff_list, products=None):
+        """Add the diffs of consecutive builds, see `add_diff`
+
+        Args:
+            diff_list (iterable): The diffs
+            products (deque): The product of each diff, taken from the front
+                as the diffs are added, see `tag_products`. All diffs belong
+                to DEFAULT_PRODUCT if not given.
+
+        Returns:
+            (DecayedCorrelation): self
+        """
+        for diff in diff_list:
+            self.add_diff(diff, products.popleft() if products is not None
+                          else DEFAULT_PRODUCT)
+        return self
+
+    def weight(self, module, test):
+        """Returns the weight of module and test as of the latest build of
+        each product"""
+        try:
+            products = self.counts[module][test]
+        except KeyError:
+            return 0.0
+        return sum(self._weight(product, count)
+                   for product, count in products.items())
+
+    def correlation(self, min_weight=0):
+        """Returns the weights as of the latest build of each product, as a
+        correlation like the one `difference_engine.correlate` returns.
+        Pairs whose weight rounds to 0 are always left out.
+
+        Args:
+            min_weight (float): Leave out the pairs that weigh less than this
+        """
+        correlation = OrderedDict()
+        for module, tests in self.counts.items():
+            weights = OrderedDict()
+            for test, products in tests.items():
+                weight = round(sum(self._weight(product, count)
+                                   for product, count in products.items()),
+                               WEIGHT_DIGITS)
+                if weight > 0 and weight >= min_weight:
+                    weights[test] = weight
+            if weights:
+                correlation[module] = weights
+        return correlation
+
+    def prune(self, min_weight=MIN_WEIGHT):
+        """Forget the counts that have decayed below min_weight, so that the
+        table does not keep growing with the history. By default the counts
+        that round to 0 in correlation output are forgotten. Costs O(table).
+        """
+        for module in list(self.counts):
+            tests = self.counts[module]
+            for test in list(tests):
+                products = tests[test]
+                for product in [product for product, count in products.items()
+                                if self._weight(product, count) < min_weight]:
+                    del products[product]
+                if not products:
+                    del tests[test]
+            if not tests:
+                del self.counts[module]
+        return self
+
+    def state(self):
+        """Returns the correlation as a json serializable dict"""
+        return OrderedDict([('half_life', self.half_life),
+                            ('builds', self.builds),
+                            ('counts', self.counts)])
+
+    @classmethod
+    def from_state(cls, state):
+        """Create a DecayedCorrelation from a dict returned by `state`
+
+        Raises:
+            ValueError: If state counts builds across all products, as states
+                written before builds were counted per product did
+        """
+        if not isinstance(state['builds'], dict):
+            raise ValueError("The decayed correlation counts builds across "
+                             "products, rebuild it to count them per product")
+        return cls(state['half_life'], builds=state['builds'],
+                   counts=state['counts'])
+
+
+def correlate_decayed(diff_list, half_life, products=None):
+    """Like `difference_engine.correlate`, but with weights that halve every
+    half_life builds of their product, see `DecayedCorrelation.add` for
+    products"""
+    return DecayedCorrelation(half_life).add(
+        diff_list, products).correlation()
@@ -3,16 +3,50 @@
 """Main module for running the Difference Engine"""
 # External imports
 import argparse
-import codecs
+from collections import deque
+import functools
 import logging
+import sys
 
 from diff.difference_engine import correlate
-from diff.difference_engine import parse_json
+from diff.difference_engine import diff_build_stream
 from diff.difference_engine import printable_analysis
+from diff.difference_engine import resolve_correlation
+from diff.difference_engine import resolve_diffs
+from diff.corrindex import write_index
+from diff.decay import DecayedCorrelation
+from diff.decay import correlate_decayed
+from diff.decay import tag_products
+from diff.window import correlate_window
+from diff.incremental import enable_decay
+from diff.incremental import load_state
+from diff.incremental import save_state
+from diff.incremental import update_state
+from diff.mapreduce import correlate_mapreduce
+from diff.parallel import correlate_parallel
+from diff.shards import DEFAULT_DEPTH
+from diff.shards import DEFAULT_SHARDS
+from diff.shards import SCHEMES as SHARD_SCHEMES
+from diff.shards import write_shards
+from diff.sqlstore import write_store
+from diff.normalize import get_normalizer
+from util import metrics
+from util.util import COMPRESSION_MODULES
+from util.util import NDJSON_EXTENSIONS
+from util.util import SymbolTable
+from util.util import iter_json_builds
+from util.util import iter_ndjson_builds
 from util.util import json_dumps
+from util.util import open_file
+from util.util import uncompressed_name
 
 NAME = __name__ if __name__ != '__main__' else "diffeng"
 DEBUG_CHOICES = ['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL']
+BACKEND_CHOICES = ['python', 'sparse']
+FLIPS_CHOICES = ['sets', 'bitset']
+FORMAT_CHOICES = ['json', 'ndjson']
+MISSING_EXTRA = ("{option} needs {module}, install it with "
+                 "pip install DifferenceEngine[{extra}]")
 
 
 def setup_logging(loglevel, logfile):
@@ -31,17 +65,37 @@ def setup_logging(loglevel, logfile):
                             datefmt=dateformat)
 
 
-
-def main():
-    """Main method to run Difference Engine™ standalone"""
+def parse_args(argv=None):
+    """Parse command line options. If the first argument is `update`, the
+    options for incrementally updating a state file are parsed instead."""
     default_cutoff = 0
     # default_outputfile = '/tmp/correlation.json'
     # default_diffdump = '/tmp/diffdump.json'
+    argv = sys.argv[1:] if argv is None else list(argv)
+    update = bool(argv) and argv[0] == 'update'
 
     parser = argparse.ArgumentParser(
         formatter_class=argparse.ArgumentDefaultsHelpFormatter)
-    parser.add_argument('filename', help="JSON file to analyze")
-    parser.add_argument('output', help='Output file for correlation json data')
+    if update:
+        argv = argv[1:]
+        parser.prog = '{} update'.format(parser.prog)
+        parser.description = ('Diff and correlate only the builds that are '
+                              'new since the last update, and add their '
+                              'correlations to a state file.')
+        parser.add_argument('state', help='state file with the correlations '
+                            'and the last seen builds. Created if missing.')
+    parser.add_argument('filename', help="JSON file to analyze. Files ending "
+                        "in {} are decompressed on the fly.".format(
+                            ', '.join(COMPRESSION_MODULES)))
+    parser.add_argument('--format', '-f', choices=FORMAT_CHOICES,
+                        default=None,
+                        help='format of the input file. ndjson has one build '
+                        'per line. Guessed from the file extension, before '
+                        'any compression extension, if not given, {} '
+                        'meaning ndjson'.format(
+                            ' and '.join(NDJSON_EXTENSIONS)))
+    parser.add_argument('output', help='Output file for correlation json '
+                        'data, compressed like the input file by extension')
     parser.add_argument('-l', '--loglevel', help="Set a loglevel",
                         choices=DEBUG_CHOICES,
                         default='WARNING')
@@ -56,40 +110,278 @@ def main():
                         help='store output as minimized json',)
     parser.add_argument('--diffdump', '-d', default=None,
                         help='dump the difference data that the correlations '
-                        'are calculated from as well.')
-    args = parser.parse_args()
+                        'are calculated from as well. Compressed by '
+                        'extension like the output.')
+    parser.add_argument('--intern', '-i', action='store_true',
+                        help='diff and correlate on integer ids instead of '
+                        'names; uses less memory on long histories')
+    parser.add_argument('--backend', '-b', choices=BACKEND_CHOICES,
+                        default='python',
+                        help='correlation backend. sparse computes the '
+                        'correlations as a scipy sparse matrix product')
+    parser.add_argument('--flips', choices=FLIPS_CHOICES, default='sets',
+                        help='how to find flipped tests. bitset compares '
+                        'numpy bit vectors of whole products at once')
+    parser.add_argument('--index', default=None,
+                        help='also write the correlations as a binary index '
+                        'that correlation_parser can memory map')
+    parser.add_argument('--sqlite', default=None, metavar='DATABASE',
+                        help='also write the correlations to an SQLite '
+                        'database that correlation_parser can query')
+    parser.add_argument('--shards', default=None, metavar='DIRECTORY',
+                        help='also write the correlations sharded by module '
+                        'into this directory, so that correlation_parser '
+                        'only reads the shards of the modules it is asked '
+                        'about. update only rewrites the shards of the '
+                        'modules that changed.')
+    parser.add_argument('--shard-by', choices=SHARD_SCHEMES, default='hash',
+                        help='assign modules to shards by a hash of their '
+                        'name, or by the first --shard-depth components of '
+                        'their path')
+    parser.add_argument('--shard-count', type=int, default=DEFAULT_SHARDS,
+                        help='amount of shards when sharding by hash')
+    parser.add_argument('--shard-depth', type=int, default=DEFAULT_DEPTH,
+                        help='amount of path components, e.g. apps/ is 1, in '
+                        'the shards when sharding by prefix')
+    parser.add_argument('--jobs', '-j', type=int, default=1,
+                        help='diff and correlate products in parallel in this '
+                        'many processes, or only correlate chunks of diffs '
+                        'in parallel with --chunk-size. Not used by update.')
+    parser.add_argument('--chunk-size', type=int, default=None, metavar='N',
+                        help='correlate the diffs in chunks of N and merge '
+                        'the partial correlations, in --jobs processes')
+    parser.add_argument('--half-life', type=float, default=None,
+                        help='let correlation weights decay, halving every '
+                        'this many builds of their product')
+    parser.add_argument('--window', '-w', type=int, default=None,
+                        help='only correlate the last this many builds of '
+                        'each product. Not used by update.')
+    parser.add_argument('--metrics-out', default=None,
+                        help='write timers, counters and peak memory usage '
+                        'as json to this file. When streaming, the correlate '
+                        'timer includes the time spent diffing.')
+    parser.add_argument('--profile-out', default=None,
+                        help='profile the run with cProfile and write the '
+                        'statistics to this file. The top functions are '
+                        'also included in --metrics-out.')
+    args = parser.parse_args(argv)
+    if args.shard_count < 1 or args.shard_depth < 1:
+        parser.error('--shard-count and --shard-depth must be positive')
+    if args.chunk_size is not None:
+        if args.chunk_size < 1:
+            parser.error('--chunk-size must be positive')
+        for unsupported, name in ((args.backend != 'python', '--backend'),
+                                  (args.half_life is not None,
+                                   '--half-life'),
+                                  (args.window is not None, '--window'),
+                                  (update, 'update')):
+            if unsupported:
+                parser.error('{} can not be used with --chunk-size'.format(
+                    name))
+    if args.window is not None:
+        if args.window < 1:
+            parser.error('--window must be positive')
+        for unsupported, name in ((args.jobs > 1, '--jobs'),
+                                  (args.backend != 'python', '--backend'),
+                                  (args.half_life is not None,
+                                   '--half-life'),
+                                  (update, 'update')):
+            if unsupported:
+                parser.error('{} can not be used with --window'.format(name))
+    if args.half_life is not None:
+        if args.half_life <= 0:
+            parser.error('--half-life must be positive')
+        for unsupported, name in ((args.jobs > 1, '--jobs'),
+                                  (args.backend != 'python', '--backend'),
+                                  (args.index, '--index')):
+            if unsupported:
+                parser.error('{} can not be used with --half-life'.format(
+                    name))
+    args.update = update
+    return args
 
-    # Deal with args
+
+def engine_functions(args):
+    """Return the (diff_stream, correlate) functions selected by args"""
+    diff_stream = diff_build_stream
+    # the optional backends are imported here so that numpy and scipy are
+    # only needed when they are selected
+    if args.flips == 'bitset':
+        try:
+            from diff.bitset_flips import diff_build_stream_bitset
+        except ImportError as error:
+            sys.exit(MISSING_EXTRA.format(option='--flips bitset',
+                                          module=error.name, extra='bitset'))
+        diff_stream = diff_build_stream_bitset
+    correlate_func = correlate
+    if args.backend == 'sparse':
+        try:
+            from diff.sparse_correlation import correlate_sparse
+        except ImportError as error:
+            sys.exit(MISSING_EXTRA.format(option='--backend sparse',
+                                          module=error.name, extra='sparse'))
+        correlate_func = correlate_sparse
+    if args.half_life is not None and not args.update:
+        correlate_func = functools.partial(correlate_decayed,
+                                           half_life=args.half_life)
+    if args.chunk_size is not None:
+        correlate_func = functools.partial(correlate_mapreduce,
+                                           jobs=args.jobs,
+                                           chunk_size=args.chunk_size)
+    return diff_stream, correlate_func
+
+
+def read_builds(fileh, args):
+    """Return the build stream of fileh, in the format given by args"""
+    fmt = args.format
+    if fmt is None:
+        name = uncompressed_name(args.filename)
+        fmt = 'ndjson' if name.endswith(NDJSON_EXTENSIONS) else 'json'
+    if fmt == 'ndjson':
+        return iter_ndjson_builds(fileh)
+    return iter_json_builds(fileh)
+
+
+def analyze(args):
+    """Diff and correlate the whole history in args.filename"""
     diffdump = args.diffdump
     filename = args.filename
+    symbols = SymbolTable() if args.intern else None
+    diff_stream, correlate_func = engine_functions(args)
+
+    if args.jobs > 1 and args.chunk_size is None:
+        logging.debug("Correlating %s in %d processes...", filename,
+                      args.jobs)
+        with open_file(filename) as fileh:
+            return correlate_parallel(
+                read_builds(fileh, args), args.jobs, diff_stream=diff_stream,
+                correlate_func=correlate_func, intern=args.intern,
+                keep_diffs=bool(diffdump))
+
+    if args.window is not None:
+        logging.debug("Correlating the last %d builds of each product in "
+                      "%s...", args.window, filename)
+        with open_file(filename) as fileh:
+            window = correlate_window(read_builds(fileh, args), args.window,
+                                      diff_stream=diff_stream,
+                                      symbols=symbols)
+        correlation = window.correlation
+        diff = window.diffs() if diffdump else None
+    else:
+        logging.debug("Streaming and correlating %s...", filename)
+        with open_file(filename) as fileh:
+            builds = read_builds(fileh, args)
+            if args.half_life is not None:  # decay per product
+                products = deque()
+                builds = tag_products(builds, products)
+                correlate_func = functools.partial(correlate_func,
+                                                   products=products)
+            diff = diff_stream(builds, symbols=symbols)
+            if diffdump:  # the diffs need to be kept around to be dumped
+                diff = list(diff)
+            correlation = correlate_func(diff)
+
+    if symbols is not None:  # translate ids back to names for the output
+        correlation = resolve_correlation(correlation, symbols)
+        if diffdump:
+            diff = resolve_diffs(diff, symbols)
+
+    return correlation, diff
+
+
+def update(args):
+    """Add the correlations of the builds in args.filename that are new since
+    the state in args.state was saved"""
+    symbols = SymbolTable() if args.intern else None
+    diff_stream, correlate_func = engine_functions(args)
+
+    logging.debug("Loading state from %s", args.state)
+    state = load_state(args.state)
+    if args.half_life is not None:
+        enable_decay(state, args.half_life)
+
+    logging.debug("Updating with new builds from %s...", args.filename)
+    with open_file(args.filename) as fileh:
+        diff = update_state(state, read_builds(fileh, args),
+                            diff_stream=diff_stream,
+                            correlate_func=correlate_func, symbols=symbols)
+    logging.info("Diffed %d new builds.", len(diff))
+
+    logging.info("Writing state to %s.", args.state)
+    save_state(state, args.state)
+    if args.half_life is not None:
+        return (DecayedCorrelation.from_state(state['decayed']).correlation(),
+                diff)
+    return state['correlation'], diff
+
+
+def changed_modules(diff, args):
+    """Return the modules whose correlations an update changed, or None if
+    all of them may have changed"""
+    # decayed weights change every build
+    if not args.update or args.half_life is not None:
+        return None
+    return {module for build_diff in diff for module in build_diff['modules']}
+
+
+def main():
+    """Main method to run Difference Engine™ standalone"""
+    args = parse_args()
+
+    # Deal with args
+    diffdump = args.diffdump
     output = args.output
     pretty = True if not args.minimized else False
 
     # Setup logging
     setup_logging(args.loglevel, args.logfile)
+    if args.metrics_out or args.profile_out:
+        metrics.enable(profile=bool(args.profile_out))
 
-    logging.debug("Reading %s", filename)
-    with codecs.open(filename, 'r', encoding="utf-8") as fileh:
-        text = fileh.read()
+    with metrics.timer('update' if args.update else 'analyze'):
+        correlation, diff = update(args) if args.update else analyze(args)
 
-    logging.debug("Parsing json...")
-    diff = parse_json(text)
+    with metrics.timer('write_output'):
+        with open_file(output, 'w') as fileh:
+            logging.info("Writing %scorrelation to %s.",
+                         "pretty " if pretty else "", output)
+            fileh.write(json_dumps(correlation, pretty=pretty))
 
-    logging.debug("Correlating...")
-    correlation = correlate(diff)
+    if diffdump:  # Write diffdump if set
+        with metrics.timer('write_diffdump'):
+            with open_file(diffdump, 'w') as fileh:
+                logging.info("Writing diffdump to %s.", diffdump)
+                fileh.write(json_dumps(diff, pretty=pretty))
 
-    with codecs.open(output, 'w', encoding='utf-8') as fileh:
-        logging.info("Writing %scorrelation to %s.",
-                     "pretty " if pretty else "", output)
-        fileh.write(json_dumps(correlation, pretty=pretty))
+    if args.index:
+        with metrics.timer('write_index'):
+            logging.info("Writing correlation index to %s.", args.index)
+            write_index(correlation, args.index)
 
-    if diffdump:  # Write diffdump if set
-        with codecs.open(diffdump, 'w', encoding='utf-8') as fileh:
-            logging.info("Writing diffdump to %s.", diffdump)
-            fileh.write(json_dumps(diff, pretty=pretty))
+    if args.sqlite:
+        with metrics.timer('write_sqlite'):
+            logging.info("Writing correlation database to %s.", args.sqlite)
+            write_store(correlation, args.sqlite)
+
+    if args.shards:
+        with metrics.timer('write_shards'):
+            write_shards(correlation, args.shards, scheme=args.shard_by,
+                         shards=args.shard_count, depth=args.shard_depth,
+                         modules=changed_modules(diff, args))
 
     if args.print_:
-        print('\n'.join(printable_analysis(correlation, cutoff=args.cutoff)))
+        for line in printable_analysis(correlation, cutoff=args.cutoff):
+            print(line)
+
+    if args.profile_out:
+        logging.info("Writing profile to %s.", args.profile_out)
+        metrics.write_profile(args.profile_out)
+    if args.metrics_out:
+        names = get_normalizer().stats()
+        metrics.count('name_cache_hits', names['hits'])
+        metrics.count('name_cache_misses', names['misses'])
+        logging.info("Writing metrics to %s.", args.metrics_out)
+        metrics.write(args.metrics_out)
 
 
 if __name__ == "__main__":
@@ -60,14 +60,14 @@ much each test depends on each package.
 
 # External imports
 from __future__ import print_function
-import logging
-import copy
 import operator
 import time
 from collections import OrderedDict
 
 # Internal imports
-from util.util import hashable
+from diff.normalize import get_normalizer
+from util import metrics
+from util.util import iter_json_builds
 from util.util import json_loads
 from util.util import validate_build_contents
 
@@ -90,13 +90,57 @@ def changed_modules(prev_build, next_build):
 
             ['mod1']
     """
-    # The function `hashable` is used to convert lists to tuples, if applicable
-    modules_prev = set(hashable(prev_build['modules']))
-    modules_next = set(hashable(next_build['modules']))
-    changed = modules_next - modules_prev
+    changed = module_set(next_build) - module_set(prev_build)
     return [mod[0] for mod in changed]
 
 
+def module_set(build):
+    """Returns the (module, revision) pairs of build as a set of tuples"""
+    return {tuple(mod) for mod in build['modules']}
+
+
+def test_sets(build, normalize=True):
+    """Returns the passed and the failed tests of build as two sets, see
+    `flips`"""
+    tests = build['tests']
+    if normalize:
+        return (set(rm_params_from_names(tests['pass'])),
+                set(rm_params_from_names(tests['fail'])))
+    return set(tests['pass']), set(tests['fail'])
+
+
+def build_sets(build, normalize=True):
+    """Returns the sets that diffing build against the builds before and
+    after it needs, so that they only have to be created once per build.
+
+    Returns:
+        (tuple): (modules, passed, failed), see `module_set` and `test_sets`
+    """
+    return (module_set(build),) + test_sets(build, normalize=normalize)
+
+
+def diff_sets(prev_sets, next_sets):
+    """Diff two builds given as `build_sets`.
+
+    Returns:
+        (tuple): (changed modules, flipped tests) as lists, see
+        `changed_modules` and `flips`
+    """
+    changed = next_sets[0] - prev_sets[0]
+    return [mod[0] for mod in changed], _flipped(prev_sets[1:], next_sets[1:])
+
+
+def _flipped(prev_tests, next_tests):
+    """Returns the tests that flipped between two (passed, failed) pairs of
+    test sets"""
+    prev_passed, prev_failed = prev_tests
+    next_passed, next_failed = next_tests
+    diff = (next_passed - prev_passed) | (next_failed - prev_failed)
+    name_intersect = ((prev_passed | prev_failed) &
+                      (next_passed | next_failed))
+    return [test for test in diff if test in name_intersect]
+
+
 def rm_params_from_names(mlist):
     """Look at testnames and filter out everything after a '(' character, to
     avoid different names for testnames that include parameters.
@@ -106,13 +150,16 @@ def rm_params_from_names(mlist):
                       ['list(param1, param2)', 'of', 'tests(foo, bar)']
 
     Returns:
-        (list): A list of tests, with everything after the rightmost `(`
+        (list): A list of tests, with everything from the first `(`
         filtered out. E.g: ['list, 'of', 'tests']
+
+    The names are normalized by the shared `normalize.NameNormalizer`, which
+    caches them and can be given other rules, see `normalize.set_normalizer`.
     """
-    return [name[:name.find('(')] if '(' in name else name for name in mlist]
+    return get_normalizer().normalize_names(mlist)
 
 
-def flips(prev_build, next_build):
+def flips(prev_build, next_build, normalize=True):
     """Returns the tests in next_build that have flipped since prev_build.
     I.e. this diff will return a set with test elements in next_build that are
     different from the elements in prev_build.
@@ -159,27 +206,46 @@ def flips(prev_build, next_build):
                                       }
                         }
 
+        normalize (bool): Strip parameters from the test names. Turn this off
+            for builds that have already been normalized, see `intern_build`.
+
     Returns:
         (list) A list of module names that were changed between prev_build and
         next_build. Continuing the example above, the returned list will be:
 
             ['test1', 'testY']
     """
-    tests_prev_passed = set(rm_params_from_names(prev_build['tests']['pass']))
-    tests_prev_failed = set(rm_params_from_names(prev_build['tests']['fail']))
-    tests_next_passed = set(rm_params_from_names(next_build['tests']['pass']))
-    tests_next_failed = set(rm_params_from_names(next_build['tests']['fail']))
+    return _flipped(test_sets(prev_build, normalize=normalize),
+                    test_sets(next_build, normalize=normalize))
 
-    diff = ((tests_next_passed - tests_prev_passed) |
-            (tests_next_failed - tests_prev_failed))
 
-    name_intersect = ((tests_prev_passed | tests_prev_failed) &
-                      (tests_next_passed | tests_next_failed))
+def intern_build(build, symbols):
+    """Return a copy of build where module names and normalized test names
+    have been replaced by their ids in symbols.
 
-    return [test for test in diff if test in name_intersect]
+    Args:
+        build (dict): A Build, see `diff_builds`
+        symbols (SymbolTable): The table to intern names in
+
+    Returns:
+        (dict): The interned Build, e.g:
+            {'modules': [(0, 'rev1'), (1, 'rev1')],
+             'tests': {'pass': [2], 'fail': [3, 4]}}
+    """
+    intern = symbols.intern
+    tests = build['tests']
+    return {
+        'modules': [(intern(mod[0]), mod[1]) for mod in build['modules']],
+        'tests': {
+            'pass': [intern(test) for test in
+                     rm_params_from_names(tests['pass'])],
+            'fail': [intern(test) for test in
+                     rm_params_from_names(tests['fail'])],
+        }
+    }
 
 
-def diff_builds(buildset, pkgnames=None, testnames=None):
+def diff_builds(buildset, pkgnames=None, testnames=None, symbols=None):
     """Iterate through BuildSet and find which packages were changed in
     subsequent builds, and which tests flipped. It is very important that
     buildset is ordered. Unchanged packags will be removed from the return
@@ -220,37 +286,74 @@ def diff_builds(buildset, pkgnames=None, testnames=None):
         ]
         This list will be used to calculate correlations later
 
+        If `symbols` is a SymbolTable, names are interned in it and the
+        returned lists contain ids instead of names.
+
     """
-    def assert_ordered(item):
-        """Makes sure item is an OrderedDict"""
-        if not isinstance(item, OrderedDict):
-            raise TypeError("You MUST diff an ordered dictionary, but was "
-                            "{}".format(type(item)))
+    with metrics.timer('diff_builds'):
+        return list(diff_build_stream(iter_builds(buildset),
+                                      pkgnames=pkgnames, testnames=testnames,
+                                      symbols=symbols))
+
 
-    ret = []
+def iter_builds(buildset):
+    """Flatten a build superset into a stream of builds.
+
+    Args:
+        buildset (dict): Products mapped to an OrderedDict of builds, see
+            `diff_builds`
 
+    Yields:
+        (tuple): (product, buildname, build) in order
+    """
     for product in buildset:
-        assert_ordered(buildset[product])  # must be OrderedDict
-        prev_build = None
-        for buildname in buildset[product]:
-            current_build = buildset[product][buildname]
-            # Add pkg/test names to corresponding sets if applicable
-            if isinstance(pkgnames, set) and isinstance(testnames, set):
-                testnames.update(set(dict(current_build['tests'])))
-                pkgnames.update(set(dict(current_build['modules'])))
-
-            # initialize build -1 to the same as the first build
-            if not prev_build:
-                prev_build = current_build
-            module_diff = changed_modules(prev_build, current_build)
-            test_diff = flips(prev_build, current_build)
-            # append _sorted_ diffs to make comparisons easier
-            # NOTE if this sorting takes too long, revert to using sets
-            ret.append({'modules': sorted(module_diff),
-                        'tests': sorted(test_diff)})
-            prev_build = current_build
-
-    return ret
+        builds = buildset[product]
+        if not isinstance(builds, OrderedDict):  # must be OrderedDict
+            raise TypeError("You MUST diff an ordered dictionary, but was "
+                            "{}".format(type(builds)))
+        for buildname in builds:
+            yield product, buildname, builds[buildname]
+
+
+def diff_build_stream(builds, pkgnames=None, testnames=None, symbols=None):
+    """Lazy version of `diff_builds`. Only the latest build of each product is
+    kept in memory, so the build stream can be arbitrarily long.
+
+    Args:
+        builds (iterable): (product, buildname, build) tuples, in order, as
+            produced by `iter_builds` or `util.iter_json_builds`
+        symbols (SymbolTable): If set, intern names in symbols and yield ids
+
+    Yields:
+        (dict): The changed modules and flipped tests of each build, see
+        `diff_builds`
+    """
+    # Ids are sorted by name so that the output does not depend on interning
+    sort_key = symbols.name if symbols is not None else None
+    counting = metrics.enabled()
+    # The sets of the latest build of each product, each build is turned
+    # into sets once and diffed against both of its neighbours
+    prev_sets = {}
+    for product, _, current_build in builds:
+        # Add pkg/test names to corresponding sets if applicable
+        if isinstance(pkgnames, set) and isinstance(testnames, set):
+            testnames.update(set(dict(current_build['tests'])))
+            pkgnames.update(set(dict(current_build['modules'])))
+        if symbols is not None:
+            current_build = intern_build(current_build, symbols)
+
+        current_sets = build_sets(current_build, normalize=symbols is None)
+        # initialize build -1 to the same as the first build
+        module_diff, test_diff = diff_sets(
+            prev_sets.get(product, current_sets), current_sets)
+        if counting:
+            metrics.count('builds_diffed')
+            metrics.count('flips_found', len(test_diff))
+        # yield _sorted_ diffs to make comparisons easier
+        # NOTE if this sorting takes too long, revert to using sets
+        yield {'modules': sorted(module_diff, key=sort_key),
+               'tests': sorted(test_diff, key=sort_key)}
+        prev_sets[product] = current_sets
 
 
 def correlate(diff_list):
@@ -294,14 +397,41 @@ def correlate(diff_list):
         ordered_dict[module][test] += 1
 
     correlations = OrderedDict()
-    for diff in diff_list:
-        for module in diff['modules']:
-            for test in diff['tests']:
-                increment_correlation(correlations, module, test)
+    counting = metrics.enabled()
+    pairs = 0
+    with metrics.timer('correlate'):
+        for diff in diff_list:
+            for module in diff['modules']:
+                for test in diff['tests']:
+                    increment_correlation(correlations, module, test)
+            if counting:
+                pairs += len(diff['modules']) * len(diff['tests'])
+    metrics.count('pairs_emitted', pairs)
 
     return correlations
 
 
+def add_correlations(correlation, other):
+    """Add the weights of the correlation `other` to `correlation`, in place.
+
+    Modules and tests that are new to `correlation` are appended in the order
+    of `other`, so adding the correlations of two consecutive diff lists gives
+    the same result, order included, as correlating both lists at once.
+
+    Returns:
+        correlation (OrderedDict): The updated correlation
+    """
+    for module in other:
+        try:
+            tests = correlation[module]
+        except KeyError:
+            tests = correlation[module] = OrderedDict()
+        for test, weight in other[module].items():
+            tests[test] = tests.get(test, 0) + weight
+
+    return correlation
+
+
 def diff_json(json_string):
     """Placeholder function to replace parse_json function"""
     return parse_json(json_string)
@@ -314,43 +444,110 @@ def parse_json(json_string):
     return diff
 
 
+def parse_json_stream(fileh, symbols=None):
+    """Use when indata is a json file that is too big to be read at once.
+    Returns a generator of diffs, in the same order as `parse_json`."""
+    return diff_build_stream(iter_json_builds(fileh), symbols=symbols)
+
+
+def resolve_diffs(diff_list, symbols):
+    """Translate the ids in an interned diff list back to names"""
+    name = symbols.name
+    return [{'modules': [name(mod) for mod in diff['modules']],
+             'tests': [name(test) for test in diff['tests']]}
+            for diff in diff_list]
+
+
+def resolve_correlation(correlation, symbols):
+    """Translate the ids in an interned correlation back to names, keeping
+    the order of the correlation"""
+    name = symbols.name
+    resolved = OrderedDict()
+    for module in correlation:
+        tests = correlation[module]
+        resolved[name(module)] = OrderedDict(
+            (name(test), tests[test]) for test in tests)
+    return resolved
+
+
 # Main method stuff
 # #################
 
-def filter_correlations(diff, cutoff=-1):
-    """Filter (remove) unwanted entries from database"""
-    retdb = copy.deepcopy(diff)
-    for pak in diff:
-        for test in diff[pak]:
-            if diff[pak][test] < cutoff:
-                del retdb[pak][test]
-                if retdb[pak] == {}:
-                    del retdb[pak]
-        if diff[pak] == {}:
-            del retdb[pak]
+def filter_correlations(diff, cutoff=-1, in_place=False):
+    """Filter (remove) unwanted entries from database.
+
+    Args:
+        diff (dict): A correlation, see `correlate`
+        cutoff (int): Remove the entries that weigh less than this
+        in_place (bool): Remove the entries from diff itself instead of
+            returning a filtered copy, which saves copying large tables
+
+    Returns:
+        (dict): The correlation without the entries below cutoff, and
+        without modules that have no entries left
+    """
+    if not in_place:
+        retdb = OrderedDict()
+        for pak, tests in iter_filtered(diff, cutoff=cutoff):
+            kept = OrderedDict(tests)
+            if kept:
+                retdb[pak] = kept
+        return retdb
+
+    counting = metrics.enabled()
+    for pak in list(diff):
+        tests = diff[pak]
+        for test in [test for test, weight in tests.items()
+                     if weight < cutoff]:
+            del tests[test]
+            if counting:
+                metrics.count('entries_filtered')
+        if not tests:
+            del diff[pak]
+    return diff
+
+
+def iter_filtered(correlation, cutoff=-1):
+    """Lazy filtered view of a correlation, which leaves it unchanged and
+    copies nothing.
+
+    Args:
+        correlation (dict): A correlation, see `correlate`
+        cutoff (int): Skip the entries that weigh less than this
+
+    Yields:
+        (tuple): (module, tests) for every module, in order, where tests is
+        an iterator over the (test, weight) pairs of module that weigh at
+        least cutoff. Modules without such tests are still yielded.
+    """
+    counting = metrics.enabled()
+    for pak, tests in correlation.items():
+        yield pak, _filtered_tests(tests, cutoff, counting)
+
 
-    logging.debug("filtered dict: %s", retdb)
-    return retdb
+def _filtered_tests(tests, cutoff, counting):
+    """Yields the (test, weight) pairs of tests that weigh at least cutoff,
+    counting the others as filtered if counting is set"""
+    for test, weight in tests.items():
+        if weight >= cutoff:
+            yield test, weight
+        elif counting:
+            metrics.count('entries_filtered')
 
 
 def printable_analysis(correlation, cutoff=-1):
-    """Returns a print-friendly list based on the input database"""
-    # Filter out correlations below cutoff limit:
-    data = filter_correlations(correlation, cutoff=cutoff)
-
-    output = []
-    for pak in sorted(data):
-        output.append(pak)  # Add package name to output
-
-        # sort test results with highest weight first, if weight is same, sort
-        # by testname
-        test_results = sorted(
-            data[pak].items(), key=operator.itemgetter(1, 0), reverse=True)
-
-        # Add test results to output list
-        for test in test_results:
-            test_weight = test[1]
-            test_name = test[0]
-            output.append('  %s:\t%s' % (test_name, test_weight))
-
-    return output
+    """Yields the lines of a print-friendly version of the input database,
+    one at a time, without copying it. Entries below cutoff are left out,
+    and counted as filtered like `iter_filtered` does."""
+    for pak, tests in sorted(iter_filtered(correlation, cutoff=cutoff),
+                             key=operator.itemgetter(0)):
+        # Sort test results with highest weight first, if weight is same,
+        # sort by testname
+        test_results = sorted(tests, key=operator.itemgetter(1, 0),
+                              reverse=True)
+        if not test_results:
+            continue
+
+        yield pak  # Add package name to output
+        for test_name, test_weight in test_results:
+            yield '  %s:\t%s' % (test_name, test_weight)
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""Incremental correlation updates.
+
+Re-diffing and re-correlating a whole history every time a few builds have
+been added to it is wasteful, since the correlation of a history is the sum of
+the correlations of its parts. This module keeps a state with the correlation
+counts so far, together with the last seen build of each product, and only
+diffs the builds that are new since then.
+
+The state is stored as json:
+
+    {"correlation": {"mod1": {"testA": 3}, ...},
+     "products": {"prod1": {"first": "bid1",
+                            "last": "bid4711",
+                            "count": 4711,
+                            "build": {"modules": [...], "tests": {...}}},
+                  ...}}
+
+where `build` is the last seen build of the product, which the first new build
+is diffed against. If the state has been created with a half-life, see
+`enable_decay`, it also keeps time-decayed correlations under the key
+`decayed`, see `decay.DecayedCorrelation.state`.
+
+The builds to update with can be given in two ways:
+
+    * The full, appended, history. The first `count` builds of each product
+      have been seen before and are skipped without being diffed.
+    * Only the new builds. If the first build of a product is not the one
+      recorded in the state, all its builds are treated as new.
+"""
+
+import codecs
+import errno
+from collections import OrderedDict
+from collections import deque
+
+from diff.decay import DecayedCorrelation
+from diff.difference_engine import add_correlations
+from diff.difference_engine import correlate
+from diff.difference_engine import diff_build_stream
+from diff.difference_engine import resolve_correlation
+from diff.difference_engine import resolve_diffs
+from util.util import json_dumps
+from util.util import json_loads
+
+
+def new_state():
+    """Return an empty state, as if no builds had been seen"""
+    return OrderedDict([('correlation', OrderedDict()),
+                        ('products', OrderedDict())])
+
+
+def enable_decay(state, half_life):
+    """Make state keep time-decayed correlations with half_life as well.
+
+    Raises:
+        ValueError: If state already has seen builds without decay, or uses
+            another half-life
+    """
+    decayed = state.get('decayed')
+    if decayed is None:
+        if state['products']:
+            raise ValueError("The state has been updated without a half-life "
+                             "before, decayed weights can not be added to it")
+        state['decayed'] = DecayedCorrelation(half_life).state()
+    elif decayed['half_life'] != half_life:
+        raise ValueError("The state has a half-life of {}, not {}".format(
+            decayed['half_life'], half_life))
+
+
+def load_state(filename):
+    """Load a state from filename, or return an empty state if there is no
+    such file. Any other error is raised, so that a state that can not be
+    read is never replaced by one built from scratch."""
+    try:
+        with codecs.open(filename, 'r', encoding='utf-8') as fileh:
+            return json_loads(fileh.read())
+    except (OSError, IOError) as error:
+        if error.errno != errno.ENOENT:
+            raise
+        return new_state()
+
+
+def save_state(state, filename):
+    """Write state to filename"""
+    with codecs.open(filename, 'w', encoding='utf-8') as fileh:
+        fileh.write(json_dumps(state))
+
+
+def new_builds(builds, state):
+    """Filter out the builds that have already been seen according to state,
+    and record the new builds in it.
+
+    Before the first new build of a product that has been seen before, the
+    last seen build of that product is inserted again so that the new build
+    has something to be diffed against.
+
+    Args:
+        builds (iterable): (product, buildname, build) tuples, in order
+        state (dict): The state to compare with and update
+
+    Yields:
+        (tuple): ((product, buildname, build), is_seed) where is_seed is True
+        for the re-inserted last seen builds.
+
+    Raises:
+        ValueError: If the history has been rewritten since state was saved
+    """
+    products = state['products']
+    position = {}  # amount of builds seen of each product in this input
+    skip = {}  # amount of builds to skip for each product
+    for product, buildname, build in builds:
+        index = position[product] = position.get(product, -1) + 1
+        seen = products.get(product)
+        if index == 0:
+            full_history = seen is not None and buildname == seen['first']
+            skip[product] = seen['count'] if full_history else 0
+        if index < skip[product]:
+            if index == skip[product] - 1 and buildname != seen['last']:
+                raise ValueError(
+                    "Build {} of {} is {} but was {} in the state".format(
+                        index, product, buildname, seen['last']))
+            continue
+
+        if seen is None:
+            seen = products[product] = OrderedDict(
+                [('first', buildname), ('last', buildname), ('count', 0),
+                 ('build', build)])
+        elif index == skip[product]:
+            yield (product, seen['last'], seen['build']), True
+
+        seen['last'] = buildname
+        seen['count'] += 1
+        seen['build'] = build
+        yield (product, buildname, build), False
+
+
+def update_state(state, builds, diff_stream=diff_build_stream,
+                 correlate_func=correlate, symbols=None):
+    """Diff and correlate the builds that are new since state, and add their
+    correlation counts to it.
+
+    Args:
+        state (dict): The state to update, see `new_state`
+        builds (iterable): (product, buildname, build) tuples, in order
+        diff_stream (function): The function to diff builds with, e.g.
+            `difference_engine.diff_build_stream`
+        correlate_func (function): The function to correlate diffs with
+        symbols (SymbolTable): If set, diff and correlate on interned names
+
+    Returns:
+        (list): The diffs of the new builds
+    """
+    seeds = deque()
+    products = deque()  # of the new builds, for the decay clocks
+
+    def tagged_builds():
+        """Remember which of the builds that are seeds"""
+        for item, is_seed in new_builds(builds, state):
+            seeds.append(is_seed)
+            if not is_seed:
+                products.append(item[0])
+            yield item
+
+    # Each build gives exactly one diff, in order, so the diffs of the seeds
+    # can be told apart and dropped
+    diffs = [diff for diff in diff_stream(tagged_builds(), symbols=symbols)
+             if not seeds.popleft()]
+    correlation = correlate_func(diffs)
+    if symbols is not None:
+        correlation = resolve_correlation(correlation, symbols)
+        diffs = resolve_diffs(diffs, symbols)
+    add_correlations(state['correlation'], correlation)
+    if 'decayed' in state:  # only the counts of the new pairs are touched,
+        # and then the ones that have decayed to nothing are dropped
+        state['decayed'] = DecayedCorrelation.from_state(
+            state['decayed']).add(diffs, products).prune().state()
+    return diffs
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""Map-reduce correlation of diffs.
+
+`difference_engine.correlate` counts the module/test pairs of a whole diff
+list in one go. The counts are sums, so they can be computed in pieces
+instead:
+
+    map         `map_chunk` correlates any chunk of diffs into a partial
+                count table, which has the same form as a correlation
+    reduce      `merge_partials` adds two partial tables together
+
+Merging is associative, and merging the tables of consecutive chunks in
+order gives exactly the correlation of all of them, order included, see
+`difference_engine.add_correlations`. Partial tables are plain json, so they
+can be written with `write_partial`, e.g. by separate runs on separate
+machines, and combined later with `reduce_partials` without redoing the
+diffs. The correlation output of diffeng is such a table, unless weights
+decay with --half-life.
+"""
+
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from diff.difference_engine import add_correlations
+from diff.difference_engine import correlate
+from diff.parallel import ordered_map
+from util.util import json_dumps
+from util.util import json_loads
+from util.util import open_file
+
+# Amount of diffs correlated per task by default
+CHUNK_SIZE = 10000
+
+
+def iter_chunks(diffs, chunk_size=CHUNK_SIZE):
+    """Split an iterable of diffs into lists of at most chunk_size diffs"""
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be positive, was {}".format(
+            chunk_size))
+    diffs = iter(diffs)
+    chunk = list(islice(diffs, chunk_size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(diffs, chunk_size))
+
+
+def map_chunk(diffs):
+    """Correlate a chunk of diffs into a partial count table. Runs in a
+    worker process when correlating in parallel."""
+    return correlate(diffs)
+
+
+def merge_partials(first, second):
+    """Add two partial count tables together, without changing either.
+
+    Returns:
+        (OrderedDict): The merged table, with the modules and tests of first
+        before those that are new in second
+    """
+    merged = OrderedDict(
+        (module, OrderedDict(tests)) for module, tests in first.items())
+    return add_correlations(merged, second)
+
+
+def reduce_partials(partials):
+    """Merge any amount of partial count tables, in order, see
+    `merge_partials`"""
+    merged = OrderedDict()
+    for partial in partials:
+        add_correlations(merged, partial)
+    return merged
+
+
+def correlate_mapreduce(diff_list, jobs=1, chunk_size=CHUNK_SIZE):
+    """Like `difference_engine.correlate`, but correlating chunks of diffs in
+    `jobs` worker processes and merging the partial tables in order. The
+    result is the same, order included.
+
+    Args:
+        diff_list (iterable): Diffs, as returned by `diff_build_stream`.
+            Partial tables of separate runs can only be merged if the diffs
+            have names rather than interned ids.
+        jobs (int): Amount of worker processes, or 1 to map in this process
+        chunk_size (int): Amount of diffs per task
+    """
+    chunks = iter_chunks(diff_list, chunk_size)
+    if jobs <= 1:
+        return reduce_partials(map_chunk(chunk) for chunk in chunks)
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        return reduce_partials(ordered_map(executor, map_chunk, chunks,
+                                           2 * jobs))
+
+
+def write_partial(partial, filename):
+    """Write a partial count table to filename as json, compressed if the
+    extension says so, see `util.open_file`"""
+    with open_file(filename, 'w') as fileh:
+        fileh.write(json_dumps(partial))
+
+
+def read_partial(filename):
+    """Read a partial count table, e.g. the output of diffeng"""
+    with open_file(filename) as fileh:
+        return json_loads(fileh.read())
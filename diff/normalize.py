@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""Normalization of test names.
+
+Parameterized tests report names like `pkg.test(param1, param2)`, which are
+normalized to `pkg.test` so that every parameterization counts as the same
+test. The same names occur in nearly every build, so instead of normalizing
+them again for every build, `NameNormalizer` remembers the normalized form of
+each raw name it has seen:
+
+    normalizer = NameNormalizer([strip_prefix_rule('suite.'), strip_params])
+    normalizer.normalize_names(['suite.test(1)', 'suite.other'])
+    # ['test', 'other']
+
+The rules are functions from a name to a name, applied in order. Regular
+expressions given to `regex_rule` are compiled once, when the rule is created.
+
+The cache holds at most `maxsize` names. When it is full, the name that was
+cached first is evicted, so the cache stays bounded when names keep changing,
+e.g. when they include build numbers, without costing any bookkeeping on hits.
+
+All callers in the engine share the normalizer returned by `get_normalizer`,
+which can be replaced with `set_normalizer`.
+"""
+
+from collections import OrderedDict
+import re
+
+# Amount of distinct raw names cached by default
+MAX_NAMES = 2 ** 20
+
+
+def strip_params(name):
+    """Filter out everything from the first '(' in name, e.g.
+    'tests(foo, bar)' -> 'tests'"""
+    return name[:name.find('(')] if '(' in name else name
+
+
+def regex_rule(pattern, replacement=''):
+    """Returns a rule that replaces every match of the regular expression
+    pattern in a name with replacement"""
+    return _RegexRule(re.compile(pattern), replacement)
+
+
+def strip_prefix_rule(prefix):
+    """Returns a rule that removes prefix from the names that start with it"""
+    return _PrefixRule(prefix)
+
+
+class _RegexRule(object):
+    """A rule that substitutes a compiled regular expression"""
+
+    __slots__ = ('regex', 'replacement')
+
+    def __init__(self, regex, replacement):
+        self.regex = regex
+        self.replacement = replacement
+
+    def __call__(self, name):
+        return self.regex.sub(self.replacement, name)
+
+
+class _PrefixRule(object):
+    """A rule that strips a prefix"""
+
+    __slots__ = ('prefix',)
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+
+    def __call__(self, name):
+        if name.startswith(self.prefix):
+            return name[len(self.prefix):]
+        return name
+
+
+class NameNormalizer(object):
+    """Normalizes test names with a bounded cache, see the module
+    documentation"""
+
+    def __init__(self, rules=None, maxsize=MAX_NAMES):
+        """Create a normalizer.
+
+        Args:
+            rules (iterable): Functions from a name to a name, applied in
+                order. Defaults to `strip_params`.
+            maxsize (int): Amount of raw names to cache at most
+        """
+        if maxsize < 1:
+            raise ValueError("maxsize must be positive, was {}".format(
+                maxsize))
+        self.rules = tuple(rules) if rules is not None else (strip_params,)
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._cache = {}
+
+    def _miss(self, name):
+        """Normalize name and cache the result"""
+        normalized = name
+        for rule in self.rules:
+            normalized = rule(normalized)
+        cache = self._cache
+        if len(cache) >= self.maxsize:
+            del cache[next(iter(cache))]
+        cache[name] = normalized
+        self.misses += 1
+        return normalized
+
+    def normalize(self, name):
+        """Returns the normalized form of name"""
+        try:
+            normalized = self._cache[name]
+        except KeyError:
+            return self._miss(name)
+        self.hits += 1
+        return normalized
+
+    def normalize_names(self, names):
+        """Returns a list with the normalized form of each name in names"""
+        cache = self._cache
+        misses = self.misses
+        normalized = [cache[name] if name in cache else self._miss(name)
+                      for name in names]
+        self.hits += len(normalized) - (self.misses - misses)
+        return normalized
+
+    def clear(self):
+        """Forget the cached names and reset the statistics"""
+        self._cache.clear()
+        self.hits = self.misses = 0
+
+    def stats(self):
+        """Returns the cache statistics as a dict with the amount of hits,
+        misses, cached names and the maximum amount of cached names"""
+        return OrderedDict([('hits', self.hits), ('misses', self.misses),
+                            ('size', len(self._cache)),
+                            ('maxsize', self.maxsize)])
+
+
+_NORMALIZER = NameNormalizer()
+
+
+def get_normalizer():
+    """Returns the normalizer shared by all callers"""
+    return _NORMALIZER
+
+
+def set_normalizer(normalizer):
+    """Replace the shared normalizer, e.g. to use other rules. Worker
+    processes only see the new normalizer if they are forked afterwards.
+
+    Returns:
+        (NameNormalizer): The normalizer that was replaced
+    """
+    global _NORMALIZER  # pylint: disable=global-statement
+    previous, _NORMALIZER = _NORMALIZER, normalizer
+    return previous
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""Parallel diffing and correlation, one product at a time.
+
+The builds of a product are only ever diffed against builds of the same
+product, so products can be diffed and correlated independently of each other
+in a pool of worker processes. The partial correlations are merged in product
+order, which gives exactly the same correlation, order included, as running
+everything in one process.
+"""
+
+from collections import OrderedDict
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from diff.difference_engine import add_correlations
+from diff.difference_engine import correlate
+from diff.difference_engine import diff_build_stream
+from diff.difference_engine import resolve_correlation
+from diff.difference_engine import resolve_diffs
+from util.util import SymbolTable
+
+
+def iter_products(builds):
+    """Group a build stream into runs of builds of the same product.
+
+    Args:
+        builds (iterable): (product, buildname, build) tuples, in order
+
+    Yields:
+        (tuple): (product, builds, seed) where builds is a list of the
+        (product, buildname, build) tuples of one run, and seed is the last
+        build of the previous run of the same product, or None if this is the
+        first run of that product
+    """
+    last_builds = {}
+    product, run = None, []
+    for item in builds:
+        if item[0] != product and run:
+            yield product, run, last_builds.get(product)
+            last_builds[product] = run[-1]
+            run = []
+        product = item[0]
+        run.append(item)
+    if run:
+        yield product, run, last_builds.get(product)
+
+
+def diff_product(task):
+    """Diff and correlate the builds of one product. Runs in a worker.
+
+    Args:
+        task (tuple): (builds, seed, diff_stream, correlate_func, intern,
+            keep_diffs), see `iter_products` and `correlate_parallel`
+
+    Returns:
+        (tuple): (correlation, diffs), where diffs is None unless keep_diffs
+    """
+    builds, seed, diff_stream, correlate_func, intern, keep_diffs = task
+    symbols = SymbolTable() if intern else None
+    if seed is not None:  # continue where the previous run of builds ended
+        builds = [seed] + builds
+    diffs = list(diff_stream(builds, symbols=symbols))
+    if seed is not None:
+        diffs = diffs[1:]
+    correlation = correlate_func(diffs)
+    if symbols is not None:
+        correlation = resolve_correlation(correlation, symbols)
+        if keep_diffs:
+            diffs = resolve_diffs(diffs, symbols)
+    return correlation, diffs if keep_diffs else None
+
+
+def ordered_map(executor, func, tasks, window):
+    """Like executor.map, but without reading more than window tasks ahead,
+    so that the build stream is not read into memory all at once"""
+    pending = deque()
+    for task in tasks:
+        pending.append(executor.submit(func, task))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+# pylint: disable=too-many-arguments
+def correlate_parallel(builds, jobs, diff_stream=diff_build_stream,
+                       correlate_func=correlate, intern=False,
+                       keep_diffs=False):
+    """Diff and correlate a build stream with one task per product in a pool
+    of `jobs` processes.
+
+    Args:
+        builds (iterable): (product, buildname, build) tuples, in order
+        jobs (int): Amount of worker processes
+        diff_stream (function): The function to diff builds with, e.g.
+            `difference_engine.diff_build_stream`
+        correlate_func (function): The function to correlate diffs with
+        intern (bool): Intern names while diffing and correlating in workers
+        keep_diffs (bool): Also return the diffs, e.g. for dumping them
+
+    Returns:
+        (tuple): (correlation, diffs), where diffs is None unless keep_diffs
+    """
+    tasks = ((run, seed, diff_stream, correlate_func, intern, keep_diffs)
+             for _, run, seed in iter_products(builds))
+    correlation = OrderedDict()
+    diffs = [] if keep_diffs else None
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        for partial, partial_diffs in ordered_map(executor, diff_product,
+                                                  tasks, 2 * jobs):
+            add_correlations(correlation, partial)
+            if keep_diffs:
+                diffs.extend(partial_diffs)
+
+    return correlation, diffs
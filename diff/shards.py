@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+"""Correlation data sharded by module into a directory of small files.
+
+Looking up a few modules in one big correlation json file means parsing all
+of it. Here the correlation is split into shards instead, and a manifest
+tells which file holds which shard:
+
+    correlation/
+        manifest.json
+        0000.json       {"apps/scm": {"test_syslog": 8}, ...}
+        0001.json
+        ...
+
+Modules are assigned to shards with one of two schemes:
+
+    hash        crc32 of the module name modulo the number of shards, which
+                spreads modules evenly
+    prefix      the first `depth` path components of the module name, e.g.
+                'apps' for 'apps/scm', which keeps related modules together
+
+The manifest looks like:
+
+    {"version": 1, "scheme": "hash", "shards": 64, "depth": 1,
+     "files": {"0000": {"file": "0000.json", "modules": 12}, ...}}
+
+A ShardedCorrelation behaves like a read only version of the correlation
+dict, and only reads the shards of the modules that are asked for. Every file
+is written to a temporary file first and then renamed, so readers never see
+a half written shard. `write_shards` can rewrite only the shards of the
+modules that changed, e.g. after an incremental update.
+"""
+
+from collections import OrderedDict
+import json
+import os
+import re
+import zlib
+
+from util.util import json_dumps
+
+MANIFEST = 'manifest.json'
+VERSION = 1
+SCHEMES = ('hash', 'prefix')
+DEFAULT_SHARDS = 64
+DEFAULT_DEPTH = 1
+
+# Characters of prefixes that are kept in the file names of shards
+UNSAFE_CHARACTERS = re.compile(r'[^A-Za-z0-9_.-]+')
+
+
+def _crc32(text):
+    """crc32 of text, which unlike hash() is the same in every process"""
+    return zlib.crc32(text.encode('utf-8')) & 0xffffffff
+
+
+def shard_key(module, scheme='hash', shards=DEFAULT_SHARDS,
+              depth=DEFAULT_DEPTH):
+    """Return the key of the shard that module belongs to.
+
+    Args:
+        module (str): Name of the module
+        scheme (str): 'hash' or 'prefix', see the module documentation
+        shards (int): Amount of shards of the hash scheme
+        depth (int): Amount of path components in the keys of the prefix
+            scheme. Modules with fewer components share the key ''.
+    """
+    if scheme == 'hash':
+        return '{:04d}'.format(_crc32(module) % shards)
+    if scheme == 'prefix':
+        parts = module.split('/')
+        return '/'.join(parts[:depth]) if len(parts) > depth else ''
+    raise ValueError("Unknown shard scheme {!r}, use one of {}".format(
+        scheme, ', '.join(SCHEMES)))
+
+
+def shard_filename(key, scheme='hash'):
+    """Return the name of the file of the shard with key"""
+    if scheme == 'hash':
+        return '{}.json'.format(key)
+    # prefixes may contain anything, so they are sanitized and made unique
+    return '{}-{:08x}.json'.format(UNSAFE_CHARACTERS.sub('_', key) or 'root',
+                                   _crc32(key))
+
+
+def is_sharded(path):
+    """Returns True if path is a directory of sharded correlation data"""
+    return os.path.isfile(os.path.join(path, MANIFEST))
+
+
+def read_manifest(directory):
+    """Read the manifest of the shards in directory"""
+    with open(os.path.join(directory, MANIFEST), 'r') as fileh:
+        manifest = json.load(fileh, object_pairs_hook=OrderedDict)
+    if manifest.get('version') != VERSION:
+        raise ValueError("{} is not a version {} sharded correlation".format(
+            directory, VERSION))
+    return manifest
+
+
+def _write_atomic(filename, text):
+    """Write text to filename through a temporary file"""
+    temporary = filename + '.tmp'
+    with open(temporary, 'w') as fileh:
+        fileh.write(text)
+    os.replace(temporary, filename)
+
+
+def _group(correlation, layout, keys=None):
+    """Group the modules of correlation by shard key, keeping only the shards
+    in keys if it is given"""
+    shards = OrderedDict()
+    for module in correlation:
+        key = shard_key(module, **layout)
+        if keys is None or key in keys:
+            shards.setdefault(key, OrderedDict())[module] = \
+                correlation[module]
+    return shards
+
+
+def write_shards(correlation, directory, scheme='hash', shards=DEFAULT_SHARDS,
+                 depth=DEFAULT_DEPTH, modules=None):
+    """Write correlation to directory as shards with a manifest.
+
+    Args:
+        correlation (dict): Modules mapped to dicts of tests and weights, as
+            returned by `difference_engine.correlate`
+        directory (str): The directory to write, created if missing
+        scheme (str): 'hash' or 'prefix', see `shard_key`
+        shards (int): Amount of shards of the hash scheme
+        depth (int): Amount of path components in prefix keys
+        modules (iterable): If set, only rewrite the shards of these modules,
+            provided that directory already holds shards with the same
+            layout. Everything is rewritten otherwise.
+
+    Returns:
+        (list): The keys of the shards that were written
+    """
+    if scheme == 'hash' and shards < 1:
+        raise ValueError("The amount of shards must be positive, was "
+                         "{}".format(shards))
+    layout = OrderedDict([('scheme', scheme), ('shards', shards),
+                          ('depth', depth)])
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    old_files = {}
+    keys = None
+    if is_sharded(directory):
+        manifest = read_manifest(directory)
+        old_files = manifest['files']
+        same_layout = all(manifest.get(name) == value
+                          for name, value in layout.items())
+        if modules is not None and same_layout:
+            keys = {shard_key(module, **layout) for module in modules}
+
+    grouped = _group(correlation, layout, keys)
+    files = OrderedDict()
+    if keys is not None:
+        files.update(old_files)
+        for key in keys:  # dropped if all its modules are gone
+            files.pop(key, None)
+    for key, shard in grouped.items():
+        filename = shard_filename(key, scheme)
+        _write_atomic(os.path.join(directory, filename), json_dumps(shard))
+        files[key] = OrderedDict([('file', filename),
+                                  ('modules', len(shard))])
+
+    manifest = OrderedDict([('version', VERSION)])
+    manifest.update(layout)
+    manifest['files'] = OrderedDict(
+        (key, files[key]) for key in sorted(files))
+    _write_atomic(os.path.join(directory, MANIFEST),
+                  json_dumps(manifest, pretty=True))
+
+    current = {entry['file'] for entry in files.values()}
+    for entry in old_files.values():
+        if entry['file'] not in current:
+            os.remove(os.path.join(directory, entry['file']))
+    return list(grouped)
+
+
+class ShardedCorrelation(object):
+    """Read only access to sharded correlation data, which loads each shard
+    the first time one of its modules is asked for"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        manifest = read_manifest(directory)
+        self._layout = dict(scheme=manifest['scheme'],
+                            shards=manifest['shards'],
+                            depth=manifest['depth'])
+        self._files = manifest['files']
+        self._shards = {}  # loaded shards, by key
+
+    def _load(self, key):
+        """Read the shard with key"""
+        with open(os.path.join(self.directory,
+                               self._files[key]['file']), 'r') as fileh:
+            return json.load(fileh, object_pairs_hook=OrderedDict)
+
+    def shard(self, key):
+        """Return the modules of the shard with key, loading it if needed.
+        Shards that do not exist are empty."""
+        try:
+            return self._shards[key]
+        except KeyError:
+            if key not in self._files:
+                return {}
+            shard = self._shards[key] = self._load(key)
+            return shard
+
+    @property
+    def loaded(self):
+        """Return the keys of the shards that have been loaded"""
+        return sorted(self._shards)
+
+    def __getitem__(self, module):
+        return self.shard(shard_key(module, **self._layout))[module]
+
+    def get(self, module, default=None):
+        """Return the tests of module, or default if there are none"""
+        try:
+            return self[module]
+        except KeyError:
+            return default
+
+    def __contains__(self, module):
+        return module in self.shard(shard_key(module, **self._layout))
+
+    def __iter__(self):
+        for module, _ in self.items():
+            yield module
+
+    def __len__(self):
+        return sum(entry['modules'] for entry in self._files.values())
+
+    def items(self):
+        """Iterate over (module, tests) pairs, one shard at a time. Shards
+        that were not loaded already are read without being kept, so that
+        iterating over everything does not hold all of it in memory."""
+        for key in self._files:
+            shard = self._shards.get(key)
+            if shard is None:
+                shard = self._load(key)
+            for item in shard.items():
+                yield item
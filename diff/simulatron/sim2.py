@@ -3,9 +3,15 @@
 # be of unknown state (and correspondingly ignored by the Difference Engine
 # Fix this in the random_build() function
 
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from random import Random
+import hashlib
+import json
 import random
+import struct
 
+from diff.parallel import ordered_map
 from util.util import Build
 from util.util import BuildSet
 import util.util as util
@@ -34,13 +40,14 @@ def newrev(rev, mark):
     return new_rev
 
 
-def _testnoise2(tests_dict, tests, test_noise, seed):
+def _testnoise2(tests_dict, tests, test_noise, seed, rng=None):
     # TODO Test me!
     # If test_noise, add some randomy flipped tests
-    change = Random().random()
+    change = (rng or Random(seed)).random()
     if change < test_noise/100.0:
         nbr_to_change = 2
-        randomly_change_tests = Random(seed).sample(tests, nbr_to_change)
+        randomly_change_tests = (rng or Random(seed)).sample(tests,
+                                                             nbr_to_change)
         for test in randomly_change_tests:
             # note to prevent possible bugs I should remove the changed tests
             # from the modules list. it is not currently necessary, however
@@ -62,13 +69,14 @@ def _testnoise(tests_dict, tests, test_noise, seed):
         tests_dict[_testname] = ('pass' if _teststatus == 'fail' else 'fail')
 
 
-def _pkgnoise2(paks_dict, modules, pkg_noise, seed):
+def _pkgnoise2(paks_dict, modules, pkg_noise, seed, rng=None):
     # TODO Test me!
     # If test_noise, add some randomy flipped tests
-    change = Random().random()
+    change = (rng or Random(seed)).random()
     if change < pkg_noise/100.0:
         nbr_to_change = 2
-        randomly_change_pkgs = Random(seed).sample(modules, nbr_to_change)
+        randomly_change_pkgs = (rng or Random(seed)).sample(modules,
+                                                            nbr_to_change)
         for pkg in randomly_change_pkgs:
             # note to prevent possible bugs I should remove the changed tests from
             # the modules list. it is not currently necessary, however
@@ -90,18 +98,18 @@ def _pkgnoise(paks_dict, modules, pkg_noise, seed):
 
 
 def add_noise(paks_dict, tests_dict, modules, tests, pkg_noise, test_noise,
-              seed):
+              seed, rng=None):
     """Function to add noise to build
 
     """
     # If pkg_noise, add some randomly changed packages
-    _pkgnoise2(paks_dict, modules, pkg_noise, seed)
+    _pkgnoise2(paks_dict, modules, pkg_noise, seed, rng=rng)
 
     # If test_noise, add some randomy flipped tests
-    _testnoise2(tests_dict, tests, test_noise, seed)
+    _testnoise2(tests_dict, tests, test_noise, seed, rng=rng)
 
 
-def _choice(seq, seed):
+def _choice(seq, seed, rng=None):
     """Choose a random element from a non-empty sequence.
 
     Embedding random.choice from 2.6 in order to get an uniform
@@ -115,11 +123,11 @@ def _choice(seq, seed):
 
     Raises IndexError if seq is empty
     """
-    rng = random.Random(seed)
+    rng = rng or random.Random(seed)
     return seq[int(rng.random() * len(seq))]
 
 
-def random_build(modules, tests, pkg_noise, test_noise, seed=None):
+def random_build(modules, tests, pkg_noise, test_noise, seed=None, rng=None):
     """Generate a build with random changes to packages.
 
     This function will generate a build with the following behavior:
@@ -141,6 +149,9 @@ def random_build(modules, tests, pkg_noise, test_noise, seed=None):
             to the build.
         seed (int?): Only use this to produce determinstic resulst (i.e. for
             unit testing purposes).
+        rng (Random): Draw all random values from rng instead, which makes a
+            series of builds deterministic without repeating the same changes
+            in every build. Overrides seed.
 
     Returns:
         tuple of lists: (changed_packages, flipped_tests)
@@ -154,7 +165,7 @@ def random_build(modules, tests, pkg_noise, test_noise, seed=None):
 
     # Get the packages to change for this build
     # TODO Change variable nbr of packages
-    change_pkg = _choice(modules, seed)
+    change_pkg = _choice(modules, seed, rng=rng)
     modules.remove(change_pkg)
     pakname = change_pkg[0]
     # print(pakname)
@@ -171,7 +182,7 @@ def random_build(modules, tests, pkg_noise, test_noise, seed=None):
 
     # Add pkg and test noise, if applicable
     add_noise(paks_dict, tests_dict, modules, tests, pkg_noise, test_noise,
-              seed)
+              seed, rng=rng)
 
     # Convert dicts back to lists
     ret_tests = sorted([(k, v) for k, v in tests_dict.items()])
@@ -195,8 +206,16 @@ def generate_buildset(size, mappings, pkg_noise=0, test_noise=0, seed=None):
         buildset (BuildSet): An object containing several builds
 
     """
-    buildset = BuildSet()
+    return BuildSet(list(iter_buildset(size, mappings, pkg_noise=pkg_noise,
+                                       test_noise=test_noise, seed=seed)))
 
+
+def iter_buildset(size, mappings, pkg_noise=0, test_noise=0, seed=None,
+                  rng=None):
+    """Lazy version of `generate_buildset`, yields one Build at a time. All
+    builds are drawn from rng, or from one Random seeded with seed, so that a
+    seed gives a deterministic series of builds without repeating the same
+    changes and noise in every build, see `random_build`."""
     available_test_names = sorted(list(mappings.values()))
     tests = []
     for name in available_test_names:
@@ -207,14 +226,12 @@ def generate_buildset(size, mappings, pkg_noise=0, test_noise=0, seed=None):
     for name in available_pkg_names:
         pkgs.append((name, 'rev0'))
 
+    rng = rng or Random(seed)
     for buildnbr in range(size):
         pkgs, tests = random_build(pkgs, tests,
                                     pkg_noise=pkg_noise,
-                                    test_noise=test_noise, seed=seed)
-        new_build = Build(buildnbr, pkgs, tests)
-        buildset.add(new_build)
-
-    return buildset
+                                    test_noise=test_noise, rng=rng)
+        yield Build(buildnbr, pkgs, tests)
 
 
 def generate_pkg_names(nbr, prefix='pak'):
@@ -227,24 +244,180 @@ def pkgmappings(pkgnames, test_suffix='.test'):
     mappings = {pak: "{}{}".format(pak, test_suffix) for pak in pkgnames}
     return mappings
 
+
+def product_names(products):
+    """Generate a list of product names"""
+    return ['prod{}'.format(num) for num in range(products)]
+
+
+def product_seed(seed, product):
+    """Derive the seed of one product from the master seed of a superset.
+
+    The seed only depends on the master seed and the product name, so every
+    product is generated the same way no matter in which process, or in which
+    order, it is generated.
+    """
+    digest = hashlib.sha256('{}/{}'.format(seed, product).encode('utf-8'))
+    return struct.unpack('<Q', digest.digest()[:8])[0]
+
+
+def _iter_product(task):
+    """Generate the builds of one product.
+
+    Args:
+        task (tuple): (packages, builds, pkg_noise, test_noise, seed,
+            vectorized), see `create_superset`, where seed is the seed of
+            the product
+
+    Yields:
+        (Build): The builds of the product, in order
+    """
+    packages, builds, pkg_noise, test_noise, seed, vectorized = task
+    pkg_mappings = pkgmappings(generate_pkg_names(packages))
+    if vectorized:
+        # imported here so that numpy is only needed for vectorized sets
+        from diff.simulatron.vectorized import iter_buildset as generate
+        builds = generate(builds, pkg_mappings, pkg_noise=pkg_noise,
+                          test_noise=test_noise, seed=seed)
+    else:
+        builds = iter_buildset(builds, pkg_mappings, pkg_noise=pkg_noise,
+                               test_noise=test_noise, rng=Random(seed))
+    return builds
+
+
+def _product_builds(task):
+    """Returns the builds of one product as a list. Runs in a worker process
+    when generating in parallel."""
+    return list(_iter_product(task))
+
+
+def _product_buildset(task):
+    """Returns the builds of one product as `BuildSet.dict`. Runs in a worker
+    process when generating in parallel."""
+    return BuildSet(_product_builds(task)).dict
+
+
+def _product_tasks(products, packages, builds, pkg_noise, test_noise, seed,
+                   vectorized):
+    """Returns the names and worker tasks of the products of a superset"""
+    if seed is None:
+        seed = Random().getrandbits(64)
+    names = product_names(products)
+    return names, [(packages, builds, pkg_noise, test_noise,
+                    product_seed(seed, product), vectorized)
+                   for product in names]
+
+
 # pylint: disable=too-many-arguments
 def create_superset(products=1, packages=10, builds=2, pkg_noise=0,
-                    test_noise=0, seed=None):
+                    test_noise=0, seed=None, vectorized=False, jobs=1):
     """Create several sets of builds with package changes and test flips so
-    that the Difference Engine can analyze it."""
-    prod_list = []
-    for num in range(products):
-        prod_list.append('prod{}'.format(num))
+    that the Difference Engine can analyze it.
 
-    pkg_names = generate_pkg_names(packages)
-    pkg_mappings = pkgmappings(pkg_names)
+    Every product is generated from its own seed, derived from seed, see
+    `product_seed`. The same seed therefore always gives the same superset,
+    also when the products are generated in parallel in `jobs` processes.
 
-    superset = {}
-    for product in prod_list:
-        buildset = generate_buildset(
-            builds, pkg_mappings, pkg_noise=pkg_noise,
-            test_noise=test_noise, seed=seed)
-        superset[product] = buildset.dict
+    If vectorized is set, the builds are generated with numpy, see
+    `diff.simulatron.vectorized`, which is much faster for large sets.
+    """
+    names, tasks = _product_tasks(products, packages, builds, pkg_noise,
+                                  test_noise, seed, vectorized)
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            buildsets = list(executor.map(_product_buildset, tasks))
+    else:
+        buildsets = [_product_buildset(task) for task in tasks]
+
+    return dict(zip(names, buildsets))
 
-    return superset
 
+def _iter_product_lists(names, tasks, jobs):
+    """Generate the builds of one product at a time, in jobs processes if
+    jobs > 1, with at most 2 * jobs products in memory.
+
+    Yields:
+        (tuple): (product, list of Builds) in order
+    """
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            for item in zip(names, ordered_map(executor, _product_builds,
+                                               tasks, 2 * jobs)):
+                yield item
+    else:
+        for product, task in zip(names, tasks):
+            yield product, _product_builds(task)
+
+
+def iter_superset(products=1, packages=10, builds=2, pkg_noise=0,
+                  test_noise=0, seed=None, vectorized=False, jobs=1):
+    """Lazy version of `create_superset`, which generates one product at a
+    time so that histories of any length can be written as they are
+    generated. With jobs > 1, at most 2 * jobs products are kept in memory.
+
+    Yields:
+        (tuple): (product, Build) in order
+    """
+    names, tasks = _product_tasks(products, packages, builds, pkg_noise,
+                                  test_noise, seed, vectorized)
+    if jobs > 1:
+        for product, product_builds in _iter_product_lists(names, tasks,
+                                                           jobs):
+            for build in product_builds:
+                yield product, build
+    else:
+        for product, task in zip(names, tasks):
+            for build in _iter_product(task):
+                yield product, build
+
+
+def iter_superset_json(products=1, packages=10, builds=2, pkg_noise=0,
+                       test_noise=0, seed=None, vectorized=False, jobs=1,
+                       pretty=False):
+    """Generate the json text of `create_superset` one product at a time,
+    with `BuildSet.iter_json`, so that only the builds of one product are in
+    memory instead of the whole superset as dicts. With jobs > 1, at most
+    2 * jobs products are kept in memory.
+
+    Yields:
+        (str): Chunks of the same json text as
+        `json_dumps(create_superset(...), pretty=pretty)`
+    """
+    names, tasks = _product_tasks(products, packages, builds, pkg_noise,
+                                  test_noise, seed, vectorized)
+    if not names:
+        yield '{}'
+        return
+    indent = 4 if pretty else None
+    separator = ',\n    ' if pretty else ', '
+    yield '{\n    ' if pretty else '{'
+    for num, (product, product_builds) in enumerate(
+            _iter_product_lists(names, tasks, jobs)):
+        yield '{}{}: '.format(separator if num else '', json.dumps(product))
+        for chunk in BuildSet(product_builds).iter_json(indent=indent,
+                                                        depth=1):
+            yield chunk
+    yield '\n}' if pretty else '}'
+
+
+def engine_build(build):
+    """Convert the contents of a Simulatron build, with tests as (name,
+    status) pairs, to a build with the {'pass': [...], 'fail': [...]} tests
+    that the Difference Engine reads"""
+    tests = OrderedDict([('pass', []), ('fail', [])])
+    for name, status in build['tests']:
+        tests[status].append(name)
+    return OrderedDict([('modules', build['modules']), ('tests', tests)])
+
+
+def ndjson_record(product, build):
+    """Return a Build as a record of the line oriented history format, which
+    `util.iter_ndjson_builds` reads:
+
+        {"product": "prod0", "build": "0", "modules": [...],
+         "tests": {"pass": [...], "fail": [...]}}
+    """
+    record = OrderedDict([('product', product), ('build', build.name)])
+    packages, tests = build.sorted_contents()
+    record.update(engine_build({'modules': list(packages), 'tests': tests}))
+    return record
@@ -5,6 +5,7 @@ import util.util as util
 import diff.simulatron.sim2 as sim2
 
 import argparse
+import sys
 
 # Default values for test output
 TESTNOISE = 0
@@ -14,25 +15,70 @@ BUILDS_PER_PRODUCT = 3
 PRODUCTS = 1
 
 
-def main():
+def write_ndjson(builds, *fileobjs):
+    """Write builds one line at a time, as they are generated.
+
+    Args:
+        builds (iterable): (product, Build) tuples, see `sim2.iter_superset`
+        fileobjs (file): File objects opened for writing text, each gets
+            every line
+    """
+    for product, build in builds:
+        line = util.json_dumps(sim2.ndjson_record(product, build)) + '\n'
+        for fileh in fileobjs:
+            fileh.write(line)
+
+
+def write_json(chunks, *fileobjs):
+    """Write chunks of json text as they are generated.
+
+    Args:
+        chunks (iterable): Chunks of json text, see `sim2.iter_superset_json`
+        fileobjs (file): File objects opened for writing text, each gets
+            every chunk
+    """
+    for chunk in chunks:
+        for fileh in fileobjs:
+            fileh.write(chunk)
+
+
+def main(argv=None):
     """Main method"""
-    args = parse_args()
+    args = parse_args(argv)
     stdout = args.stdout
     filename = args.filename
     pretty = args.pretty
 
-    superset = sim2.create_superset(args.products, args.packages, args.builds,
-                                    args.pkgnoise, args.testnoise)
-
-    if stdout:
-        print(util.json_dumps(superset, pretty=pretty))
+    if args.ndjson:
+        builds = sim2.iter_superset(args.products, args.packages, args.builds,
+                                    args.pkgnoise, args.testnoise,
+                                    seed=args.seed, vectorized=args.vectorized,
+                                    jobs=args.jobs)
+        stdouts = [sys.stdout] if stdout else []
+        if filename:
+            with util.open_file(filename, 'w') as fileh:
+                write_ndjson(builds, fileh, *stdouts)
+        else:
+            write_ndjson(builds, *stdouts)
+        return
 
+    # written one product at a time instead of creating the whole superset
+    chunks = sim2.iter_superset_json(args.products, args.packages,
+                                     args.builds, args.pkgnoise,
+                                     args.testnoise, seed=args.seed,
+                                     vectorized=args.vectorized,
+                                     jobs=args.jobs, pretty=pretty)
+    stdouts = [sys.stdout] if stdout else []
     if filename:
-        with open(filename, 'w') as fileh:
-            fileh.write(util.json_dumps(superset, pretty=pretty))
+        with util.open_file(filename, 'w') as fileh:
+            write_json(chunks, fileh, *stdouts)
+    else:
+        write_json(chunks, *stdouts)
+    if stdout:
+        print()
 
 
-def parse_args():
+def parse_args(argv=None):
     """Parse command line options"""
     default_outfile ='/tmp/simdata.json'
     parser = argparse.ArgumentParser()
@@ -40,7 +86,8 @@ def parse_args():
         '-f',
         '--filename',
         default=default_outfile,
-        help='If output to file is set, this is the destination. Defaults to '
+        help='If output to file is set, this is the destination. Compressed '
+             'if it ends in .gz, .bz2 or .xz. Defaults to '
              '{}'.format(default_outfile))
     parser.add_argument(
         '-o',
@@ -85,8 +132,33 @@ def parse_args():
         type=int,
         metavar='int',
         help="Amount of products per simulation")
+    parser.add_argument(
+        '--vectorized',
+        action='store_true',
+        help="Generate builds with numpy, which is much faster for large "
+             "simulations")
+    parser.add_argument(
+        '--seed',
+        default=None,
+        type=int,
+        metavar='int',
+        help="Master seed of the simulation. Every product gets its own seed "
+             "derived from it, so the same seed gives the same output no "
+             "matter how many jobs are used. Random if not set.")
+    parser.add_argument(
+        '-j',
+        '--jobs',
+        default=1,
+        type=int,
+        metavar='int',
+        help="Generate products in parallel in this many processes")
+    parser.add_argument(
+        '--ndjson',
+        action='store_true',
+        help="Write one build per line as soon as it is generated, instead "
+             "of the whole simulation at once. Uses constant memory.")
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
     if not (args.filename or args.stdout):
         args.stdout = True
 
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""Vectorized generation of simulated builds.
+
+`sim2.generate_buildset` calls `sim2.random_build` once per build, which
+copies and re-sorts every module and test list. This module draws the changes
+of a whole product history at once instead, with the same behaviour:
+
+    * Every build changes one package, chosen uniformly, and marks its
+      revision with an X. The test belonging to that package flips.
+    * With a probability of pkg_noise percent, two other packages are changed
+      as well, without being marked.
+    * With a probability of test_noise percent, two other tests flip.
+
+The state of the history is three arrays over the packages: the revision
+numbers, whether the latest change was a marked one, and which tests fail.
+Builds are generated a chunk of rows at a time from the changes of each
+chunk, so the memory needed does not grow with the length of the history,
+and they are only turned into `Build` objects when they are output.
+"""
+
+import numpy
+
+from util.util import Build
+from util.util import BuildSet
+
+# Amount of builds generated at a time
+CHUNK_SIZE = 4096
+
+TEST_STATUS = ('pass', 'fail')
+
+
+def _two_others(rng, excluded, size):
+    """Draw two distinct indices below size per element of excluded, none of
+    them equal to that element"""
+    first = rng.integers(0, size - 1, len(excluded))
+    second = rng.integers(0, size - 2, len(excluded))
+    second += second >= first  # distinct from first
+    # skip past the excluded index, keeping the pair distinct and uniform
+    first += first >= excluded
+    second += second >= excluded
+    return first, second
+
+
+def _noise(rng, changed, probability, size):
+    """Draw the noise changes of a chunk of builds.
+
+    Returns:
+        (tuple): (rows, columns) of the noise changes
+    """
+    rows = numpy.flatnonzero(rng.random(len(changed)) < probability)
+    if not len(rows):  # pylint: disable=len-as-condition
+        return rows, rows
+    if size < 3:
+        raise ValueError("Noise needs at least 3 packages, got {}".format(
+            size))
+    first, second = _two_others(rng, changed[rows], size)
+    return numpy.concatenate((rows, rows)), numpy.concatenate((first, second))
+
+
+def product_states(size, packages, pkg_noise=0, test_noise=0, rng=None,
+                   chunk_size=CHUNK_SIZE):
+    """Simulate the history of one product.
+
+    Args:
+        size (int): Amount of builds
+        packages (int): Amount of packages, each with one test
+        pkg_noise (int): Percent chance of two extra package changes per build
+        test_noise (int): Percent chance of two extra test flips per build
+        rng (numpy.random.Generator): Random number generator to draw from
+        chunk_size (int): Amount of builds to generate at a time
+
+    Yields:
+        (tuple): (revisions, marked, failed) arrays with one row per build and
+        one column per package: the revision number of each package, whether
+        its latest change was marked, and whether its test failed
+    """
+    rng = numpy.random.default_rng() if rng is None else rng
+    revisions = numpy.zeros(packages, dtype=numpy.int64)
+    marked = numpy.zeros(packages, dtype=bool)
+    failed = numpy.zeros(packages, dtype=bool)
+
+    for start in range(0, size, chunk_size):
+        rows = min(chunk_size, size - start)
+        index = numpy.arange(rows)
+        changed = rng.integers(0, packages, rows)
+
+        # 0 means unchanged, 1 a noise change and 2 a marked change
+        changes = numpy.zeros((rows, packages), dtype=numpy.int8)
+        noise_rows, noise_columns = _noise(rng, changed, pkg_noise / 100.0,
+                                           packages)
+        changes[noise_rows, noise_columns] = 1
+        changes[index, changed] = 2
+
+        flipped = numpy.zeros((rows, packages), dtype=bool)
+        noise_rows, noise_columns = _noise(rng, changed, test_noise / 100.0,
+                                           packages)
+        flipped[noise_rows, noise_columns] = True
+        flipped[index, changed] = True
+
+        chunk_revisions = revisions + numpy.cumsum(changes > 0, axis=0)
+        # the row of the latest change of each package, -1 if none yet
+        latest = numpy.maximum.accumulate(
+            numpy.where(changes > 0, index[:, None], -1), axis=0)
+        chunk_marked = numpy.where(
+            latest >= 0,
+            changes[numpy.maximum(latest, 0), numpy.arange(packages)] == 2,
+            marked)
+        chunk_failed = failed ^ numpy.logical_xor.accumulate(flipped, axis=0)
+
+        yield chunk_revisions, chunk_marked, chunk_failed
+        revisions, marked, failed = (chunk_revisions[-1], chunk_marked[-1],
+                                     chunk_failed[-1])
+
+
+def _changed_columns(chunk, previous):
+    """Returns a list with the columns that differ from the row before, for
+    each row of chunk. previous is the row before the first row."""
+    before = numpy.vstack((previous[None], chunk[:-1]))
+    rows, columns = numpy.nonzero(chunk != before)
+    bounds = numpy.searchsorted(rows, numpy.arange(len(chunk) + 1)).tolist()
+    columns = columns.tolist()
+    return [columns[bounds[row]:bounds[row + 1]] for row in range(len(chunk))]
+
+
+def iter_buildset(size, mappings, pkg_noise=0, test_noise=0, seed=None,
+                  chunk_size=CHUNK_SIZE):
+    """Generate the builds of one product, see `sim2.generate_buildset`.
+
+    Only the packages and tests that changed since the previous build are
+    formatted, the rest are shared with it.
+
+    Yields:
+        (Build): The builds, in order
+    """
+    pkg_names = sorted(mappings)
+    test_names = [mappings[name] for name in pkg_names]
+    # Builds list their tests sorted by name, like their packages
+    test_order = sorted(range(len(test_names)), key=test_names.__getitem__)
+    test_position = {num: pos for pos, num in enumerate(test_order)}
+    pkgs = [(name, 'rev0') for name in pkg_names]
+    tests = [(test_names[num], TEST_STATUS[0]) for num in test_order]
+    revisions = numpy.zeros(len(pkg_names), dtype=numpy.int64)
+    failed = numpy.zeros(len(pkg_names), dtype=bool)
+    rng = numpy.random.default_rng(seed)
+
+    buildnbr = 0
+    for chunk_revisions, chunk_marked, chunk_failed in product_states(
+            size, len(pkg_names), pkg_noise=pkg_noise,
+            test_noise=test_noise, rng=rng, chunk_size=chunk_size):
+        changed = _changed_columns(chunk_revisions, revisions)
+        flipped = _changed_columns(chunk_failed, failed)
+        for row, (row_changed, row_flipped) in enumerate(zip(changed,
+                                                             flipped)):
+            pkgs = list(pkgs)
+            for num in row_changed:
+                pkgs[num] = (pkg_names[num], '{}rev{}'.format(
+                    'X' if chunk_marked[row, num] else '',
+                    int(chunk_revisions[row, num])))
+            tests = list(tests)
+            for num in row_flipped:
+                tests[test_position[num]] = (
+                    test_names[num], TEST_STATUS[int(chunk_failed[row, num])])
+            yield Build(buildnbr, pkgs, tests)
+            buildnbr += 1
+        revisions, failed = chunk_revisions[-1], chunk_failed[-1]
+
+
+def generate_buildset(size, mappings, pkg_noise=0, test_noise=0, seed=None,
+                      chunk_size=CHUNK_SIZE):
+    """Vectorized version of `sim2.generate_buildset`.
+
+    Args:
+        size (int): Size of buildset
+        mappings (dict): Dict mapping pkgnames (keys) to testnames (values)
+        pkg_noise (int): Percent chance of two extra package changes per build
+        test_noise (int): Percent chance of two extra test flips per build
+        seed (int): The seed used for randomized values
+        chunk_size (int): Amount of builds to generate at a time
+
+    Returns:
+        buildset (BuildSet): An object containing several builds
+    """
+    return BuildSet(list(iter_buildset(size, mappings, pkg_noise=pkg_noise,
+                                       test_noise=test_noise, seed=seed,
+                                       chunk_size=chunk_size)))
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""Sparse matrix backend for correlating diffs.
+
+`difference_engine.correlate` counts module/test co-occurrences one pair at a
+time. The same counts can be had as a single matrix product: if M is the
+diffs × modules incidence matrix of the changed modules, and T the diffs ×
+tests incidence matrix of the flipped tests, then
+
+    C = M.T * T
+
+is the modules × tests matrix where C[m, t] is the number of diffs in which
+module m changed and test t flipped, i.e. the correlation weight of m->t.
+
+Both incidence matrices are very sparse, so they are built as scipy CSR
+matrices straight from the index lists and the product is left to scipy.
+"""
+
+from array import array
+from collections import OrderedDict
+
+import numpy
+from scipy import sparse
+
+from util.util import SymbolTable
+
+
+def incidence_matrices(diff_list):
+    """Build the sparse incidence matrices for a list of diffs.
+
+    Diffs that lack either changed modules or flipped tests do not contribute
+    to any correlation and are skipped.
+
+    Args:
+        diff_list (iterable): Diffs as returned by `diff_builds`
+
+    Returns:
+        (tuple): (modules, tests, module_matrix, test_matrix) where modules and
+        tests are lists of the names for each matrix column, in the order they
+        were first seen, and the matrices are CSR matrices with one row per
+        contributing diff.
+    """
+    module_indices = SymbolTable()
+    test_indices = SymbolTable()
+    module_ptr, module_cols = array('q', [0]), array('q')
+    test_ptr, test_cols = array('q', [0]), array('q')
+
+    for diff in diff_list:
+        if not (diff['modules'] and diff['tests']):
+            continue
+        module_cols.extend(module_indices.intern(module)
+                           for module in diff['modules'])
+        test_cols.extend(test_indices.intern(test) for test in diff['tests'])
+        module_ptr.append(len(module_cols))
+        test_ptr.append(len(test_cols))
+
+    rows = len(module_ptr) - 1
+    module_matrix = _csr(module_ptr, module_cols, (rows, len(module_indices)))
+    test_matrix = _csr(test_ptr, test_cols, (rows, len(test_indices)))
+    return (module_indices.names, test_indices.names, module_matrix,
+            test_matrix)
+
+
+def _csr(indptr, indices, shape):
+    """Create a CSR incidence matrix with ones at the given positions.
+    Duplicate positions are summed, just like repeated increments."""
+    indptr = numpy.frombuffer(indptr, dtype=numpy.int64)
+    indices = numpy.frombuffer(indices, dtype=numpy.int64)
+    data = numpy.ones(len(indices), dtype=numpy.int64)
+    matrix = sparse.csr_matrix((data, indices, indptr), shape=shape)
+    matrix.sum_duplicates()
+    return matrix
+
+
+def correlate_sparse(diff_list):
+    """Sparse matrix version of `difference_engine.correlate`.
+
+    The returned weights are identical to those of `correlate`. Modules are
+    ordered the same way, but the tests of each module are ordered by when
+    they first flipped anywhere in the history rather than by when they first
+    flipped together with that module.
+
+    Args:
+        diff_list (iterable): Diffs as returned by `diff_builds`
+
+    Returns:
+        correlation (OrderedDict): Modules mapped to their correlated tests
+        and weights, see `difference_engine.correlate`
+    """
+    modules, tests, module_matrix, test_matrix = incidence_matrices(diff_list)
+    counts = module_matrix.T.tocsr().dot(test_matrix).tocsr()
+    counts.sort_indices()
+
+    correlations = OrderedDict()
+    indptr = counts.indptr.tolist()
+    indices = counts.indices.tolist()
+    weights = counts.data.tolist()
+    for row, module in enumerate(modules):
+        start, end = indptr[row], indptr[row + 1]
+        correlations[module] = OrderedDict(
+            (tests[col], weight) for col, weight in
+            zip(indices[start:end], weights[start:end]))
+
+    return correlations
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""Correlation data in an SQLite database.
+
+The database has one table for module names, one for test names, and one for
+the weights of each module and test:
+
+    modules     id, name
+    tests       id, name
+    weights     module_id, test_id, weight
+
+Weights are indexed on (module_id, weight), so the tests of a module are
+found without scanning the table. Narrow and wide test selection is done by
+summing, sorting and limiting the weights in SQL, see
+`CorrelationStore.select`. Many processes can read the same database at once.
+
+A CorrelationStore also behaves like a read only version of the correlation
+dict, e.g. `store['mod1']` returns `{'testA': 2, 'testB': 1}`.
+"""
+
+from itertools import groupby
+from operator import itemgetter
+import os
+import sqlite3
+from urllib.request import pathname2url
+
+MAGIC = b'SQLite format 3\x00'
+
+SCHEMA = '''
+CREATE TABLE modules (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE);
+CREATE TABLE tests (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE);
+CREATE TABLE weights (
+    module_id INTEGER NOT NULL REFERENCES modules (id),
+    test_id INTEGER NOT NULL REFERENCES tests (id),
+    weight NOT NULL,  -- no type affinity, so ints stay ints, floats floats
+    PRIMARY KEY (module_id, test_id)
+) WITHOUT ROWID;
+CREATE INDEX weights_by_module_weight ON weights (module_id, weight);
+'''
+
+# ORDER BY clauses of the orders of `correlation_parser.sort_tests`. Names
+# are compared as utf-8 bytes, which sorts like Python sorts strings.
+ORDER_BY = {
+    'weight': 'total, name',
+    'weight-reverse': 'total DESC, name DESC',
+    'alphabet': 'name',
+    'alphabet-reverse': 'name DESC',
+}
+
+
+def is_store(filename):
+    """Returns True if filename is an SQLite database"""
+    try:
+        with open(filename, 'rb') as fileh:
+            return fileh.read(len(MAGIC)) == MAGIC
+    except (OSError, IOError):
+        return False
+
+
+def write_store(correlation, filename):
+    """Write correlation to filename as an SQLite database. The database is
+    written to a temporary file and renamed, so that readers of a previous
+    version keep reading it undisturbed.
+
+    Args:
+        correlation (dict): Modules mapped to dicts of tests and weights, as
+            returned by `difference_engine.correlate`
+        filename (str): The file to write
+    """
+    temporary = filename + '.tmp'
+    if os.path.exists(temporary):
+        os.remove(temporary)
+    test_ids = {}
+    for tests in correlation.values():
+        for test in tests:
+            if test not in test_ids:
+                test_ids[test] = len(test_ids)
+
+    connection = sqlite3.connect(temporary)
+    try:
+        connection.executescript(SCHEMA)
+        with connection:  # one transaction
+            connection.executemany(
+                'INSERT INTO modules (id, name) VALUES (?, ?)',
+                enumerate(correlation))
+            connection.executemany(
+                'INSERT INTO tests (id, name) VALUES (?, ?)',
+                ((test_id, test) for test, test_id in test_ids.items()))
+            connection.executemany(
+                'INSERT INTO weights (module_id, test_id, weight) '
+                'VALUES (?, ?, ?)',
+                ((module_id, test_ids[test], weight)
+                 for module_id, tests in enumerate(correlation.values())
+                 for test, weight in tests.items()))
+        connection.execute('ANALYZE')
+    finally:
+        connection.close()
+    os.replace(temporary, filename)
+
+
+class CorrelationStore(object):
+    """Read only access to a correlation database"""
+
+    def __init__(self, filename):
+        if not is_store(filename):
+            raise ValueError("{} is not an SQLite database".format(filename))
+        # read only, and usable from the threads of a server
+        self._connection = sqlite3.connect(
+            'file:{}?mode=ro'.format(pathname2url(os.path.abspath(filename))),
+            uri=True, check_same_thread=False)
+
+    def close(self):
+        """Close the database"""
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def select(self, modules=None, cutoff=None, order='weight-reverse',
+               top=None):
+        """Sum the weights of each test over modules, like a narrow test
+        selection does, or over all modules, like a wide one does.
+
+        Args:
+            modules (list): Names of the modules, or None for all modules
+            cutoff (int): Leave out the tests whose summed weight is lower
+            order (str): One of the orders of ORDER_BY
+            top (int): Return at most this many tests
+
+        Returns:
+            (list): (test, summed weight) tuples, in order
+        """
+        if order not in ORDER_BY:
+            raise ValueError("Order '%s' is not supported" % order)
+        selected, join, having, limit = '', '', '', ''
+        params = []
+        if modules is not None:
+            if not modules:
+                return []
+            # Joined rather than tested with IN, so that a module listed
+            # twice is summed twice, like the other correlation formats do
+            selected = 'WITH selected(name) AS (VALUES {}) '.format(
+                ', '.join(['(?)'] * len(modules)))
+            join = ('JOIN modules ON modules.id = weights.module_id '
+                    'JOIN selected ON selected.name = modules.name')
+            params.extend(modules)
+        if cutoff is not None:
+            having = 'HAVING total >= ?'
+            params.append(cutoff)
+        if top is not None:
+            limit = 'LIMIT ?'
+            params.append(top)
+        return self._connection.execute(
+            '{}SELECT tests.name AS name, SUM(weight) AS total FROM weights '
+            'JOIN tests ON tests.id = weights.test_id {} '
+            'GROUP BY weights.test_id {} ORDER BY {} {}'.format(
+                selected, join, having, ORDER_BY[order], limit),
+            params).fetchall()
+
+    def sum_weights(self, modules=None, cutoff=None):
+        """Returns the summed weight of each test over modules, or over all
+        modules, as a dict, without the tests whose summed weight is lower
+        than cutoff"""
+        return dict(self.select(modules, cutoff=cutoff, order='alphabet'))
+
+    def __getitem__(self, module):
+        rows = self._connection.execute(
+            'SELECT tests.name, weight FROM modules '
+            'JOIN weights ON weights.module_id = modules.id '
+            'JOIN tests ON tests.id = weights.test_id '
+            'WHERE modules.name = ?', (module,)).fetchall()
+        if not rows and module not in self:
+            raise KeyError(module)
+        return dict(rows)
+
+    def get(self, module, default=None):
+        """Return the tests of module, or default if it is not stored"""
+        try:
+            return self[module]
+        except KeyError:
+            return default
+
+    def __contains__(self, module):
+        return self._connection.execute(
+            'SELECT 1 FROM modules WHERE name = ?', (module,)).fetchone() \
+            is not None
+
+    def __iter__(self):
+        for (module,) in self._connection.execute(
+                'SELECT name FROM modules ORDER BY name'):
+            yield module
+
+    def __len__(self):
+        return self._connection.execute(
+            'SELECT COUNT(*) FROM modules').fetchone()[0]
+
+    def items(self):
+        """Iterate over (module, tests) pairs, in module name order"""
+        rows = self._connection.execute(
+            'SELECT modules.name, tests.name, weight FROM modules '
+            'LEFT JOIN weights ON weights.module_id = modules.id '
+            'LEFT JOIN tests ON tests.id = weights.test_id '
+            'ORDER BY modules.name')
+        for module, module_rows in groupby(rows, key=itemgetter(0)):
+            yield module, {test: weight for _, test, weight in module_rows
+                           if test is not None}
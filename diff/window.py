@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""Correlations over a sliding window of builds.
+
+Correlating only the latest builds of each product would otherwise mean
+slicing the history and re-running `diff_builds` and `correlate` for every
+window. `SlidingWindow` keeps the diffs of the last `size` builds of each
+product in a ring buffer instead, together with their correlation counts.
+When a build enters the window the counts of its module/test pairs are
+incremented, and when it leaves they are decremented again, so advancing the
+window costs O(pairs of those two builds), no matter how large it is.
+"""
+
+from collections import OrderedDict
+from collections import deque
+
+from diff.difference_engine import diff_build_stream
+
+
+class SlidingWindow(object):
+    """Correlation counts of the last `size` builds of each product"""
+
+    def __init__(self, size):
+        if size < 1:
+            raise ValueError("The window size must be positive, was {}".format(
+                size))
+        self.size = size
+        self.windows = OrderedDict()  # product -> deque of diffs
+        self.correlation = OrderedDict()
+
+    def _count(self, diff, step):
+        """Add step to the counts of all module/test pairs of diff, and drop
+        the counts that reach zero"""
+        for module in diff['modules']:
+            try:
+                tests = self.correlation[module]
+            except KeyError:
+                tests = self.correlation[module] = OrderedDict()
+            for test in diff['tests']:
+                weight = tests.get(test, 0) + step
+                if weight:
+                    tests[test] = weight
+                else:
+                    del tests[test]
+            if not tests:
+                del self.correlation[module]
+
+    def push(self, product, diff):
+        """Add the diff of the next build of product to the window, and drop
+        the oldest build of product if the window is full"""
+        try:
+            window = self.windows[product]
+        except KeyError:
+            window = self.windows[product] = deque()
+        window.append(diff)
+        self._count(diff, 1)
+        if len(window) > self.size:
+            self._count(window.popleft(), -1)
+
+    def diffs(self):
+        """Returns the diffs in the window, product by product"""
+        return [diff for window in self.windows.values() for diff in window]
+
+
+def iter_windows(builds, size, diff_stream=diff_build_stream, symbols=None):
+    """Diff a build stream and slide a window over it.
+
+    Args:
+        builds (iterable): (product, buildname, build) tuples, in order
+        size (int): Amount of builds of each product in the window
+        diff_stream (function): The function to diff builds with, e.g.
+            `difference_engine.diff_build_stream`
+        symbols (SymbolTable): If set, diff and correlate on interned names
+
+    Yields:
+        (tuple): (product, buildname, window) after each build, where window
+        is the SlidingWindow. Its correlation has the same weights as
+        `correlate(window.diffs())`, but it is updated in place, so copy it
+        to keep it.
+    """
+    window = SlidingWindow(size)
+    names = deque()
+
+    def tagged_builds():
+        """Remember which product and build each diff belongs to"""
+        for item in builds:
+            names.append(item[:2])
+            yield item
+
+    # Each build gives exactly one diff, in order
+    for diff in diff_stream(tagged_builds(), symbols=symbols):
+        product, buildname = names.popleft()
+        window.push(product, diff)
+        yield product, buildname, window
+
+
+def correlate_window(builds, size, diff_stream=diff_build_stream,
+                     symbols=None):
+    """Returns the SlidingWindow over the last size builds of each product
+    in builds, see `iter_windows`"""
+    window = SlidingWindow(size)
+    for _, _, window in iter_windows(builds, size, diff_stream=diff_stream,
+                                     symbols=symbols):
+        pass
+    return window
@@ -8,21 +8,30 @@ Use for context independent test selection.
 from __future__ import print_function
 import argparse
 import json
-import operator
+
+from scripts.correlation_parser import SORT_KEYS
+from scripts.correlation_parser import positive_int
+from scripts.correlation_parser import sort_tests
 
 NBR_OF_TESTS = 1203
 
-def parse_args():
+def parse_args(argv=None):
     """setup argparser"""
     parser = argparse.ArgumentParser()
     parser.add_argument('filename', help='correlation data file')
-    args = parser.parse_args()
+    parser.add_argument('--sort', default='weight-reverse',
+                        choices=list(SORT_KEYS), dest='order',
+                        help='order of the output, heaviest first by default')
+    parser.add_argument('--top', type=positive_int, default=None,
+                        metavar='N',
+                        help='only output the first N tests in sort order')
+    args = parser.parse_args(argv)
     return args
 
 
-def main():
+def main(argv=None):
     """Main function"""
-    args = parse_args()
+    args = parse_args(argv)
     filename = args.filename
     with open(filename, 'r') as fileh:
         string_data = fileh.read()
@@ -30,7 +39,7 @@ def main():
     data = json.loads(string_data)
 
     tests = sum_tests(data)
-    sorted_tests = sorted(tests.items(), key=operator.itemgetter(1, 0))
+    sorted_tests = sort_tests(tests, args.order, top=args.top)
 
     to_print = []
     for item in sorted_tests:
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""Benchmark the Difference Engine pipeline
+
+Generate simulated histories of several sizes with the Simulatron and time
+each stage of the pipeline on them, one stage at a time:
+
+    parse_json              json text to diffs, i.e. parsing and diffing
+    diff_builds             build superset to diffs
+    correlate               diffs to correlation
+    filter_correlations     correlation to filtered correlation
+    json_dumps              correlation to json text
+
+Every stage is run `--repeat` times and the fastest run is reported, which is
+the least disturbed by whatever else is running on the machine. The peak
+amount of memory allocated by a stage is measured in a separate run with
+tracemalloc, since tracing slows the stage down.
+
+The results are written as a json report:
+
+    {"python": "3.6.9", "repeat": 3, "seed": 1,
+     "results": [{"size": "small", "products": 1, "packages": 50,
+                  "builds": 100, "noise": 0, "json_bytes": 123456,
+                  "stages": {"parse_json": {"seconds": 0.01,
+                                            "peak_bytes": 123456},
+                             ...}},
+                 ...]}
+"""
+
+from __future__ import print_function
+from collections import OrderedDict
+import argparse
+import gc
+import platform
+import timeit
+import tracemalloc
+
+from diff.difference_engine import correlate
+from diff.difference_engine import diff_builds
+from diff.difference_engine import filter_correlations
+from diff.difference_engine import parse_json
+from diff.simulatron import sim2
+from util.util import json_dumps
+from util.util import json_loads
+
+# Histories to benchmark, as products x packages x builds x noise
+SIZES = OrderedDict([
+    ('small', (1, 50, 100, 0)),
+    ('medium', (4, 200, 500, 1)),
+    ('large', (8, 1000, 2000, 2)),
+])
+DEFAULT_SIZES = ['small', 'medium']
+REPEAT = 3
+SEED = 1
+
+
+def parse_args(argv=None):
+    """Setup argparser"""
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument(
+        '-s', '--size', action='append', type=parse_size, dest='sizes',
+        help='history to benchmark, either one of {} or PRODUCTSxPACKAGESx'
+        'BUILDSxNOISE, e.g. 4x200x500x1. Can be given several times. '
+        'Defaults to {}'.format(', '.join(SIZES), ', '.join(DEFAULT_SIZES)))
+    parser.add_argument('-r', '--repeat', type=int, default=REPEAT,
+                        help='times to run each stage')
+    parser.add_argument('--seed', type=int, default=SEED,
+                        help='seed of the simulated histories')
+    parser.add_argument('--no-memory', dest='memory', action='store_false',
+                        help='do not measure peak memory usage')
+    parser.add_argument('-o', '--output', default='/tmp/benchmark.json',
+                        help='file to write the json report to')
+    args = parser.parse_args(argv)
+    if not args.sizes:
+        args.sizes = [parse_size(size) for size in DEFAULT_SIZES]
+    return args
+
+
+def parse_size(text):
+    """Parse a size given on the command line.
+
+    Returns:
+        (tuple): (name, (products, packages, builds, noise))
+    """
+    if text in SIZES:
+        return text, SIZES[text]
+    try:
+        size = tuple(int(part) for part in text.split('x'))
+    except ValueError:
+        size = ()
+    if len(size) != 4:
+        raise argparse.ArgumentTypeError(
+            "invalid size {!r}, use one of {} or PRODUCTSxPACKAGESxBUILDSx"
+            "NOISE".format(text, ', '.join(SIZES)))
+    return text, size
+
+
+def create_history(products, packages, builds, noise, seed=SEED):
+    """Simulate a history that the Difference Engine can read.
+
+    Returns:
+        (str): The history as json text
+    """
+    superset = sim2.create_superset(products, packages, builds,
+                                    pkg_noise=noise, test_noise=noise,
+                                    seed=seed)
+    history = OrderedDict()
+    for product in sorted(superset):
+        builds = superset[product]
+        history[product] = OrderedDict(
+            (name, sim2.engine_build(builds[name])) for name in builds)
+    return json_dumps(history)
+
+
+def pipeline(text):
+    """The stages of the pipeline, each a function without arguments that
+    runs the stage on the output of the previous stages.
+
+    Returns:
+        (OrderedDict): Stage names mapped to functions
+    """
+    superset = json_loads(text)
+    diffs = diff_builds(superset)
+    correlation = correlate(diffs)
+    filtered = filter_correlations(correlation, cutoff=1)
+    return OrderedDict([
+        ('parse_json', lambda: parse_json(text)),
+        ('diff_builds', lambda: diff_builds(superset)),
+        ('correlate', lambda: correlate(diffs)),
+        ('filter_correlations',
+         lambda: filter_correlations(correlation, cutoff=1)),
+        ('json_dumps', lambda: json_dumps(filtered)),
+    ])
+
+
+def peak_memory(stage):
+    """Returns the peak amount of bytes allocated while running stage"""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        stage()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def benchmark(size, repeat=REPEAT, memory=True, seed=SEED):
+    """Benchmark all stages on a history of size.
+
+    Args:
+        size (tuple): (name, (products, packages, builds, noise)) as returned
+            by `parse_size`
+        repeat (int): Times to run each stage, the fastest run is reported
+        memory (bool): Also measure the peak memory usage of each stage
+        seed (int): Seed of the simulated history
+
+    Returns:
+        (OrderedDict): The results, see the module documentation
+    """
+    name, (products, packages, builds, noise) = size
+    text = create_history(products, packages, builds, noise, seed=seed)
+    stages = pipeline(text)
+
+    result = OrderedDict([
+        ('size', name), ('products', products), ('packages', packages),
+        ('builds', builds), ('noise', noise), ('json_bytes', len(text)),
+        ('stages', OrderedDict()),
+    ])
+    for stage_name, stage in stages.items():
+        times = timeit.repeat(stage, repeat=repeat, number=1)
+        measured = result['stages'][stage_name] = OrderedDict(
+            [('seconds', min(times))])
+        if memory:
+            measured['peak_bytes'] = peak_memory(stage)
+    return result
+
+
+def print_result(result):
+    """Print a benchmark result as a table"""
+    print("{size}: {products} products x {packages} packages x {builds} "
+          "builds, noise {noise}".format(**result))
+    for stage_name, measured in result['stages'].items():
+        peak = measured.get('peak_bytes')
+        print("    {: <20} {: >9.4f} s {}".format(
+            stage_name, measured['seconds'],
+            '' if peak is None else '{: >9.1f} MiB'.format(peak / 2.0**20)))
+
+
+def main(argv=None):
+    """Main method"""
+    args = parse_args(argv)
+    report = OrderedDict([('python', platform.python_version()),
+                          ('repeat', args.repeat), ('seed', args.seed),
+                          ('results', [])])
+    for size in args.sizes:
+        result = benchmark(size, repeat=args.repeat, memory=args.memory,
+                           seed=args.seed)
+        report['results'].append(result)
+        print_result(result)
+
+    with open(args.output, 'w') as fileh:
+        fileh.write(json_dumps(report, pretty=True))
+    print("Report written to {}".format(args.output))
+
+
+if __name__ == '__main__':
+    main()
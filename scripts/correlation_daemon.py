@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""Correlation daemon
+
+Load correlation data once and answer correlation_parser queries over a unix
+socket, so that CI jobs do not have to parse the correlation file over and
+over again. Query it with `correlation_parser --socket PATH`, which prints the
+same output as when reading the file itself.
+
+Protocol: the client sends one json object on a single line,
+
+    {"mode": "narrow", "modules": ["apps/scm"], "cutoff": 0,
+     "order": "weight", "verbose": false, "top": null, "budget": 60,
+     "durations": "/path/to/durations.json"}
+
+where top, budget, durations and default_duration are optional. The
+durations file is read by the daemon, so its path has to be absolute. The
+daemon answers with one json object and closes the connection,
+
+    {"status": 0, "output": "test1\\ntest2\\n"}
+
+where status is the exit status correlation_parser would have had.
+
+The correlation file and the durations files are reloaded if they have
+changed since they were last read.
+"""
+
+from __future__ import print_function
+import argparse
+import contextlib
+import io
+import json
+import os
+import signal
+import socketserver
+import stat
+import sys
+
+from scripts import correlation_parser
+
+REQUEST_FIELDS = ('mode', 'modules', 'cutoff', 'order', 'verbose')
+OPTIONAL_FIELDS = {'top': None, 'budget': None, 'durations': None,
+                   'default_duration': None}
+
+
+def parse_args():
+    """Setup argparser"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-f', '--correlation-data', required=True,
+                        help='correlation file to serve')
+    parser.add_argument('--socket', required=True,
+                        help='unix socket to listen on')
+    return parser.parse_args()
+
+
+def check_top(top):
+    """Raise ValueError unless top is None or a positive integer"""
+    if top is not None and (isinstance(top, bool) or
+                            not isinstance(top, int) or top < 1):
+        raise ValueError("top must be a positive integer, was {!r}".format(
+            top))
+
+
+def check_budget(query):
+    """Raise ValueError if query has a budget but no way to know the
+    durations of the tests, like the --budget check of correlation_parser"""
+    if (query.budget is not None and not query.durations and
+            query.default_duration is None):
+        raise ValueError("budget needs durations or default_duration")
+
+
+class QueryHandler(socketserver.StreamRequestHandler):
+    """Answer one query per connection"""
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline().decode('utf-8'))
+            query = argparse.Namespace(**OPTIONAL_FIELDS)
+            for field in REQUEST_FIELDS:
+                setattr(query, field, request[field])
+            for field in OPTIONAL_FIELDS:
+                setattr(query, field,
+                        request.get(field, OPTIONAL_FIELDS[field]))
+            check_top(query.top)
+            check_budget(query)
+            status, output = self.server.answer(query)
+        except (ValueError, KeyError, TypeError) as err:
+            status, output = 2, "ERROR: Bad request: {}\n".format(err)
+        except (OSError, IOError) as err:
+            status, output = 2, "ERROR: {}\n".format(err)
+        response = {'status': status, 'output': output}
+        self.wfile.write(json.dumps(response).encode('utf-8'))
+
+
+def _close(data):
+    """Close correlation data that holds a memory map or a database
+    connection, i.e. a CorrelationIndex or a CorrelationStore"""
+    close = getattr(data, 'close', None)
+    if close is not None:
+        close()
+
+
+class CorrelationServer(socketserver.UnixStreamServer):
+    """Unix socket server holding the correlation data in memory.
+
+    Queries are answered one at a time. Each one only takes a fraction of a
+    millisecond, and it lets the output of correlation_parser be captured by
+    redirecting stdout.
+    """
+
+    def __init__(self, socket_path, filename):
+        self.filename = filename
+        self.data = None
+        self.mtime = None
+        self._durations = {}  # path -> (mtime, durations)
+        self.load()
+        socketserver.UnixStreamServer.__init__(self, socket_path,
+                                               QueryHandler)
+
+    def load(self):
+        """(Re)load the correlation data if the file has changed"""
+        try:
+            mtime = os.stat(self.filename).st_mtime
+        except OSError:
+            mtime = None
+        if self.data is not None and mtime == self.mtime:
+            return
+        self.mtime = mtime
+        previous, self.data = (self.data,
+                               correlation_parser.read_data(self.filename))
+        _close(previous)
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        _close(self.data)
+        self.data = None
+
+    def read_durations(self, path):
+        """Return the durations in path, read again only if the file has
+        changed since it was last read"""
+        mtime = os.stat(path).st_mtime
+        cached = self._durations.get(path)
+        if cached is None or cached[0] != mtime:
+            cached = self._durations[path] = (
+                mtime, correlation_parser.read_durations(path))
+        return cached[1]
+
+    def answer(self, query):
+        """Run query like correlation_parser would.
+
+        Returns:
+            (tuple): (exit status, printed output)
+
+        Raises:
+            ValueError: If the durations path of query is not absolute
+            OSError: If the durations file of query can not be read
+        """
+        self.load()
+        durations = None
+        if query.budget is not None and query.durations:
+            if not os.path.isabs(query.durations):
+                raise ValueError("durations must be an absolute path, was "
+                                 "{}".format(query.durations))
+            durations = self.read_durations(query.durations)
+        output = io.StringIO()
+        status = 0
+        with contextlib.redirect_stdout(output):
+            try:
+                if query.mode.lower() == 'narrow':
+                    correlation_parser.narrow(self.filename, query,
+                                              data=self.data,
+                                              durations=durations)
+                if query.mode.lower() == 'wide':
+                    if not self.data:
+                        print("ERROR: File {} not found".format(self.filename))
+                        raise SystemExit(1)
+                    correlation_parser.wide(self.filename, query,
+                                            data=self.data,
+                                            durations=durations)
+            except SystemExit as err:
+                status = err.code
+        return status, output.getvalue()
+
+
+def remove_stale_socket(path):
+    """Remove the socket at path, left behind by a previous daemon. Anything
+    else at path is left alone.
+
+    Raises:
+        ValueError: If path exists but is not a socket
+    """
+    try:
+        mode = os.stat(path).st_mode
+    except OSError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise ValueError("{} exists and is not a socket, refusing to remove "
+                         "it".format(path))
+    os.remove(path)
+
+
+def main():
+    """Main method"""
+    args = parse_args()
+    try:
+        remove_stale_socket(args.socket)
+    except ValueError as err:
+        print("ERROR: {}".format(err))
+        sys.exit(1)
+
+    server = CorrelationServer(args.socket, args.correlation_data)
+    # Clean up the socket when stopped with kill as well as with ctrl-c
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    print("Serving {} on {}".format(args.correlation_data, args.socket))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(args.socket)
+
+
+if __name__ == "__main__":
+    main()
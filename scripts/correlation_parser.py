@@ -8,21 +8,64 @@ Written for Python3 but should support Python2 as well.
 
 from collections import defaultdict
 import argparse
+import heapq
 import json
+import os
+import socket
 import sys
 import operator
 
+from diff.corrindex import CorrelationIndex
+from diff.corrindex import is_index
+from diff.shards import ShardedCorrelation
+from diff.shards import is_sharded
+from diff.sqlstore import CorrelationStore
+from diff.sqlstore import is_store
+from util import metrics
+from util.util import open_file
 
 MAX_NBR_OF_TESTS = 1203
 MODE_CHOICES = ['WIDE', 'wide', 'NARROW', 'narrow']
 
+# The sort key and whether to reverse the order, for each --sort choice. Test
+# names are unique, so no two items ever compare equal.
+SORT_KEYS = {
+    'weight': (operator.itemgetter(1, 0), False),
+    'weight-reverse': (operator.itemgetter(1, 0), True),
+    'alphabet': (None, False),
+    'alphabet-reverse': (None, True),
+}
+
+
+def positive_int(value):
+    """argparse type for options that must be a positive integer"""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(
+            "must be a positive integer, was {}".format(value))
+    return number
+
+
+def open_data(filename):
+    """Open correlation data from filename. A binary correlation index is
+    memory mapped, of a directory of sharded correlation data only the
+    shards of the modules that are asked for are read, and an SQLite
+    database is queried. Anything else is parsed as json."""
+    if is_index(filename):
+        return CorrelationIndex(filename)
+    if is_sharded(filename):
+        return ShardedCorrelation(filename)
+    if is_store(filename):
+        return CorrelationStore(filename)
+    with open_file(filename) as fileh:
+        return json.load(fileh)
+
 
 def read_data(filename):
-    """Read json data from filename"""
+    """Read correlation data from filename"""
     data = {}
     try:
-        with open(filename, 'r') as fileh:
-            data = json.loads(fileh.read())
+        data = open_data(filename)
     except (OSError, IOError):
         pass
     return data
@@ -44,10 +87,17 @@ def parse_args():
     parser.add_argument('modules', nargs='+', help='module(s) to get '
                         'recommendations on. Space separated list of modules. '
                         'Ignored if wide mode is specified.')
-    parser.add_argument('-f', '--correlation-data', required=True,
-                        help='json file to analyze')
+    parser.add_argument('-f', '--correlation-data',
+                        help='json file to analyze, decompressed on the '
+                        'fly if it ends in .gz, .bz2 or .xz. Can also be a '
+                        'correlation index, a directory of shards or an '
+                        'SQLite database.')
+    parser.add_argument('--socket', default=None,
+                        help='query a running correlation_daemon on this '
+                        'unix socket instead of reading a file')
     parser.add_argument('-c', '--cutoff', help='cutoff limit for correlation '
-                        'weights', default=0, type=int)
+                        'weights. Tests whose summed weight is lower are not '
+                        'selected.', default=0, type=int)
     parser.add_argument('--mode', default='NARROW',
                         choices=MODE_CHOICES, help='regression test strategy.')
     parser.add_argument('-v', '--verbose', action="store_true",
@@ -58,29 +108,129 @@ def parse_args():
         choices=['weight', 'weight-reverse', 'alphabet', 'alphabet-reverse'],
         dest='order',
     )
-    return parser.parse_args()
-
-
-def sort_tests(tests: dict, order: str) -> list:
+    parser.add_argument('--top', type=positive_int, default=None,
+                        metavar='N',
+                        help='only output the first N tests in sort order')
+    parser.add_argument('--budget', type=float, default=None,
+                        help='only select the tests with the highest total '
+                        'weight that fit in this much run time')
+    parser.add_argument('--durations', default=None,
+                        help='json file mapping test names to their run '
+                        'time, in the same unit as --budget')
+    parser.add_argument('--default-duration', type=float, default=None,
+                        help='run time of tests missing from --durations. '
+                        'Defaults to their mean run time.')
+    parser.add_argument('--metrics-out', default=None,
+                        help='write timers and counters as json to this file')
+    args = parser.parse_args()
+    if not (args.correlation_data or args.socket):
+        parser.error('one of -f/--correlation-data or --socket is required')
+    if (args.budget is not None and not args.durations and
+            args.default_duration is None):
+        parser.error('--budget needs --durations or --default-duration')
+    return args
+
+
+def sort_tests(tests: dict, order: str, top: int = None) -> list:
     """Takes a dict containing str/int key/value pairs like:
         {'testsname': correlation_weight}
 
-    Returns a list ordered as specified by parameter `order`.
+    Returns a list ordered as specified by parameter `order`. If `top` is
+    set, only the first `top` items of that list are returned. They are
+    picked with a heap, which is O(n log top) instead of sorting everything.
     """
-    if order == 'weight':
-        return sorted(tests.items(), key=operator.itemgetter(1, 0))
-    elif order == 'weight-reverse':
-        return sorted(tests.items(), key=operator.itemgetter(1, 0))[::-1]
-    elif order == 'alphabet':
-        return sorted(tests.items())
-    elif order == 'alphabet-reverse':
-        return sorted(tests.items())[::-1]
+    if order not in SORT_KEYS:
+        raise ValueError("Order '%s' is not supported" % order)
+    key, reverse = SORT_KEYS[order]
+
+    if top is not None:
+        select = heapq.nlargest if reverse else heapq.nsmallest
+        return select(top, tests.items(), key=key)
+    return sorted(tests.items(), key=key, reverse=reverse)
+
+
+def read_durations(filename):
+    """Read a json file mapping test names to run times"""
+    with open_file(filename) as fileh:
+        return json.load(fileh)
+
+
+def select_within_budget(tests, durations, budget, default_duration=None):
+    """Choose the tests that give the highest summed correlation weight while
+    their summed run time stays within budget.
 
-    raise ValueError("Order '%s' is not supported" % order)
+    This is a 0/1 knapsack problem, solved greedily: tests are taken in order
+    of weight per run time for as long as they fit. The result is compared
+    with the single heaviest test that fits, which guarantees at least half of
+    the optimal weight. Sorting dominates, so 10^4 tests take milliseconds.
 
+    Args:
+        tests (dict): Test names mapped to correlation weights
+        durations (dict): Test names mapped to run times
+        budget (float): Total run time available
+        default_duration (float): Run time of tests missing from durations.
+            Defaults to the mean of durations.
 
-def narrow(filename, args):
-    """Perform narrow test selection."""
+    Returns:
+        (tuple): (selected, run_time) where selected is a dict of the chosen
+        tests and their weights, and run_time is their summed run time
+    """
+    if default_duration is None:
+        default_duration = (sum(durations.values()) / len(durations)
+                            if durations else 0)
+    candidates = [(test, weight, durations.get(test, default_duration))
+                  for test, weight in tests.items()
+                  if durations.get(test, default_duration) <= budget]
+
+    def density(candidate):
+        """Weight per run time, tests that take no time at all come first"""
+        _, weight, duration = candidate
+        return weight / duration if duration > 0 else float('inf')
+
+    candidates.sort(key=lambda cand: (-density(cand), -cand[1], cand[0]))
+    selected, run_time, total_weight = {}, 0, 0
+    for test, weight, duration in candidates:
+        if run_time + duration <= budget:
+            selected[test] = weight
+            run_time += duration
+            total_weight += weight
+
+    if candidates:
+        test, weight, duration = max(candidates,
+                                     key=lambda cand: (cand[1], -cand[2]))
+        if weight > total_weight:
+            selected, run_time = {test: weight}, duration
+
+    return selected, run_time
+
+
+def apply_budget(tests, args, durations=None):
+    """Reduce tests to those selected within args.budget, if it is set. If
+    durations is given it is used instead of reading args.durations.
+
+    Returns:
+        (tuple): (tests, run_time) where run_time is None if there is no
+        budget
+    """
+    if args.budget is None:
+        return tests, None
+    if durations is None:
+        durations = read_durations(args.durations) if args.durations else {}
+    return select_within_budget(tests, durations, args.budget,
+                                default_duration=args.default_duration)
+
+
+def print_budget(run_time, args):
+    """Print how much of the budget the selected tests use"""
+    if run_time is not None:
+        print("Estimated run time: {:.1f} of budget {:.1f}".format(
+            run_time, args.budget))
+
+
+def narrow(filename, args, data=None, durations=None):
+    """Perform narrow test selection. If data is given it is used instead of
+    reading filename, and if durations is given it is used instead of reading
+    args.durations."""
     # TODO: Refactor this
     modules = args.modules
 
@@ -88,37 +238,34 @@ def narrow(filename, args):
         print("\nParsing using narrow selection on file '{}' for "
               "recommendations on {}\n".format(filename, modules))
 
-    data = read_data(filename)
+    if data is None:
+        with metrics.timer('read_data'):
+            data = read_data(filename)
     if not data:
         print("ERROR: File {} not found".format(filename))
         sys.exit(1)
 
-    tests = {}
-    empty_tests = []
-    for module in modules:
-        current_module_tests = get_tests(module, data)
-        if not current_module_tests:
-            empty_tests.append(module)
-        tests = {k: tests.get(k, 0) + current_module_tests.get(k, 0) for k in
-                 set(tests) | set(current_module_tests)}
-
-    if not tests:
+    empty_tests = [module for module in modules
+                   if not get_tests(module, data)]
+    if len(empty_tests) == len(modules):
         print("WARNING: No tests correlated to specified module(s):"
               "{}".format(modules))
         sys.exit(1)
 
-    ordered_tests = sort_tests(tests, args.order)
+    ordered_tests, run_time = select_tests(data, modules, args, durations)
+    metrics.count('modules_queried', len(modules))
+    metrics.count('tests_selected', len(ordered_tests))
 
     if args.verbose:
         print("Recommended tests:")
         for test in ordered_tests:
-            if test[1] >= args.cutoff:
-                print("{: <5} {}".format(test[1], test[0]))
+            print("{: <5} {}".format(test[1], test[0]))
 
         if args.cutoff:
             print("(cutoff at weight {})".format(args.cutoff))
 
         print("\nTotal recommended tests: {}".format(len(ordered_tests)))
+        print_budget(run_time, args)
 
         time_saved = MAX_NBR_OF_TESTS - len(ordered_tests)
         print("\nTime savings running only recommended tests: {} units "
@@ -130,20 +277,21 @@ def narrow(filename, args):
         print_list([item[0] for item in ordered_tests])
 
 
-def wide(filename, args):
-    """Perform wide test selection."""
+def wide(filename, args, data=None, durations=None):
+    """Perform wide test selection. If data is given it is used instead of
+    reading filename, and if durations is given it is used instead of reading
+    args.durations."""
     # TODO: Refactor this
     if args.verbose:
         print("\nParsing using wide selection on file '{}'"
               "\n".format(filename))
 
-    with open(filename, 'r') as fileh:
-        string_data = fileh.read()
+    if data is None:
+        with metrics.timer('read_data'):
+            data = open_data(filename)
 
-    data = json.loads(string_data)
-
-    tests = sum_tests(data)
-    sorted_tests = sort_tests(tests, args.order)
+    sorted_tests, run_time = select_tests(data, None, args, durations)
+    metrics.count('tests_selected', len(sorted_tests))
 
     if args.verbose:
         for item in sorted_tests:
@@ -154,6 +302,7 @@ def wide(filename, args):
         time_savings_percentage = ((1 - len(sorted_tests) / MAX_NBR_OF_TESTS)
                                    * 100)
         print("Nbr of correlated tests: {}".format(len(sorted_tests)))
+        print_budget(run_time, args)
         print("Time savings: {:.1f}%".format(time_savings_percentage))
     else:
         print_list([item[0] for item in sorted_tests])
@@ -164,29 +313,115 @@ def print_list(test_list, sep='\n'):
     print(sep.join(test_list))
 
 
+def select_tests(data, modules, args, durations=None):
+    """Sum the weights of the tests of modules, or of all modules if modules
+    is None, and select and sort them as args say. Tests whose summed weight
+    is below args.cutoff are left out before the budget and top are applied.
+    A CorrelationStore does all of it in SQL unless there is a budget. See
+    `apply_budget` for durations.
+
+    Returns:
+        (tuple): (sorted (test, weight) tuples, run_time), where run_time is
+        None if there is no budget
+    """
+    if isinstance(data, CorrelationStore):
+        if args.budget is None:
+            return data.select(modules, cutoff=args.cutoff, order=args.order,
+                               top=args.top), None
+        tests = data.sum_weights(modules, cutoff=args.cutoff)
+    else:
+        if modules is None:
+            tests = sum_tests(data)
+        else:
+            tests = defaultdict(int)
+            for module in modules:
+                for test, weight in get_tests(module, data).items():
+                    tests[test] += weight
+        tests = {test: weight for test, weight in tests.items()
+                 if weight >= args.cutoff}
+    tests, run_time = apply_budget(tests, args, durations)
+    return sort_tests(tests, args.order, top=args.top), run_time
+
+
 def sum_tests(data):
     """Go through each package in data, get the tests and their correlations,
     and add test and correlation to a list. If test already exists, increment
     weight by the weight of the test found."""
     tests = defaultdict(int)
-    for package in data:
-        for test in data[package]:
-            tests[test] += data[package][test]
+    for _, package_tests in data.items():
+        for test, weight in package_tests.items():
+            tests[test] += weight
 
     return tests
 
 
+def query_daemon(socket_path, args):
+    """Send the query in args to the correlation_daemon listening on
+    socket_path, and print its answer.
+
+    Returns:
+        (int): The exit status of the query
+    """
+    request = {'mode': args.mode, 'modules': args.modules,
+               'cutoff': args.cutoff, 'order': args.order,
+               'verbose': args.verbose, 'top': args.top,
+               'budget': args.budget,
+               # the daemon does not share the working directory
+               'durations': (os.path.abspath(args.durations)
+                             if args.durations else None),
+               'default_duration': args.default_duration}
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(socket_path)
+        client.sendall(json.dumps(request).encode('utf-8') + b'\n')
+        client.shutdown(socket.SHUT_WR)
+        chunks = []
+        chunk = client.recv(65536)
+        while chunk:
+            chunks.append(chunk)
+            chunk = client.recv(65536)
+    except OSError as err:
+        print("ERROR: No correlation daemon answering on {}: {}".format(
+            socket_path, err))
+        return 2
+    finally:
+        client.close()
+
+    response = json.loads(b''.join(chunks).decode('utf-8'))
+    sys.stdout.write(response['output'])
+    return response['status']
+
+
 def main():
     """Main method"""
 
     args = parse_args()
+    if args.metrics_out:
+        metrics.enable()
+    try:
+        run(args)
+    finally:
+        if args.metrics_out:
+            metrics.write(args.metrics_out)
+
+
+def run(args):
+    """Answer the query in args, from a file or from a daemon"""
     filename = args.correlation_data
 
-    if args.mode.lower() == 'narrow':
-        narrow(filename, args)
+    if args.socket:
+        with metrics.timer('query_daemon'):
+            status = query_daemon(args.socket, args)
+        if status:
+            sys.exit(status)
+        return
+
+    with metrics.timer(args.mode.lower()):
+        if args.mode.lower() == 'narrow':
+            narrow(filename, args)
 
-    if args.mode.lower() == 'wide':
-        wide(filename, args)
+        if args.mode.lower() == 'wide':
+            wide(filename, args)
 
 
 if __name__ == "__main__":
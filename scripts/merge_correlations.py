@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""Merge correlation data of separate runs of the Difference Engine
+
+The weights of a correlation are counts, so the correlations of separate
+histories, e.g. of different products diffed on different machines, can be
+added together instead of diffing everything again:
+
+    diffeng_merge merged.json products_a.json products_b.json.gz
+
+Correlations are merged in the order they are given, see
+`diff.mapreduce.reduce_partials`. Correlations written with --half-life do not
+hold counts, and can not be merged meaningfully.
+"""
+
+from __future__ import print_function
+import argparse
+
+from diff.mapreduce import read_partial
+from diff.mapreduce import reduce_partials
+from diff.mapreduce import write_partial
+
+
+def parse_args(argv=None):
+    """setup argparser"""
+    parser = argparse.ArgumentParser(
+        description='Add the correlations of separate runs together.')
+    parser.add_argument('output', help='file to write the merged correlation '
+                        'to, compressed by extension')
+    parser.add_argument('filenames', nargs='+', metavar='filename',
+                        help='correlation data file, as written by diffeng')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Main function"""
+    args = parse_args(argv)
+    merged = reduce_partials(read_partial(filename)
+                             for filename in args.filenames)
+    write_partial(merged, args.output)
+
+
+if __name__ == '__main__':
+    main()
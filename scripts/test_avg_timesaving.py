@@ -2,6 +2,12 @@
 # pylint: disable=missing-docstring
 
 from collections import OrderedDict as od
+
+import pytest
+
+pytest.importorskip('numpy')
+
+# pylint: disable=wrong-import-position
 from scripts.avg_timesaving import get_test_sizes
 
 
@@ -79,15 +79,20 @@ setup(
     # your project is installed. For an analysis of "install_requires" vs pip's
     # requirements files see:
     # https://packaging.python.org/en/latest/requirements.html
-    install_requires=[''],
+    install_requires=[],
 
     # List additional groups of dependencies here (e.g. development
     # dependencies). You can install these using the following syntax,
     # for example:
     # $ pip install -e .[dev,test]
+    # The default pure python backends need none of them. The optional
+    # backends import numpy and scipy when they are selected, see README.md.
     extras_require={
         'dev': ['check-manifest'],
         'test': ['coverage', 'pytest'],
+        'sparse': ['numpy', 'scipy'],
+        'bitset': ['numpy'],
+        'vectorized': ['numpy'],
     },
 
     ## If there are data files included in your packages that need to be
@@ -111,6 +116,9 @@ setup(
             'diffeng=diff.diffeng:main',
             'simulatron=diff.simulatron.simulatron:main',
             'correlation_parser=scripts.correlation_parser:main',
+            'correlation_daemon=scripts.correlation_daemon:main',
+            'diffeng_benchmark=scripts.benchmark:main',
+            'diffeng_merge=scripts.merge_correlations:main',
         ],
     },
 
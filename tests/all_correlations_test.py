@@ -0,0 +1,31 @@
+"""Tests for summing the correlations of all packages"""
+import json
+
+import pytest
+
+from scripts import all_correlations
+
+from tests.helpers import CORRELATION
+
+# pylint: disable=missing-docstring
+# pylint: disable=redefined-outer-name
+
+
+@pytest.fixture
+def correlation_file(tmpdir):
+    filename = str(tmpdir.join('correlation.json'))
+    with open(filename, 'w') as fileh:
+        json.dump(CORRELATION, fileh)
+    return filename
+
+
+def test_top_is_heaviest(correlation_file, capsys):
+    all_correlations.main([correlation_file, '--top', '1'])
+    assert capsys.readouterr().out == 'test_syslog\n'
+
+
+def test_sort(correlation_file, capsys):
+    all_correlations.main([correlation_file, '--sort', 'weight'])
+    assert capsys.readouterr().out.strip().split(',') == [
+        'test_ünicode', 'test_the_rest', 'discovery_tests', 'ptz_tests',
+        'test_syslog']
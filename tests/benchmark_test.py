@@ -0,0 +1,53 @@
+"""Tests for the pipeline benchmark"""
+import argparse
+import json
+import os
+import tempfile
+
+import pytest
+
+from diff.difference_engine import parse_json
+from scripts import benchmark
+
+# pylint: disable=missing-docstring
+
+
+def test_parse_size():
+    assert benchmark.parse_size('small') == ('small', benchmark.SIZES['small'])
+    assert benchmark.parse_size('2x10x5x1') == ('2x10x5x1', (2, 10, 5, 1))
+
+
+@pytest.mark.parametrize('text', ['huge', '2x10x5', '2x10xfivex1'])
+def test_parse_size_error(text):
+    with pytest.raises(argparse.ArgumentTypeError):
+        benchmark.parse_size(text)
+
+
+def test_create_history_is_readable():
+    diffs = parse_json(benchmark.create_history(2, 5, 4, 0, seed=3))
+    assert len(diffs) == 8
+
+
+def test_benchmark():
+    result = benchmark.benchmark(('tiny', (2, 5, 4, 0)), repeat=1)
+    assert list(result['stages']) == ['parse_json', 'diff_builds',
+                                      'correlate', 'filter_correlations',
+                                      'json_dumps']
+    for measured in result['stages'].values():
+        assert measured['seconds'] >= 0
+        assert measured['peak_bytes'] >= 0
+
+
+def test_main_writes_report(capsys):
+    with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as fileh:
+        filename = fileh.name
+    try:
+        benchmark.main(['-s', '1x5x3x0', '-s', '1x5x6x0', '-r', '1',
+                        '--no-memory', '-o', filename])
+        with open(filename) as fileh:
+            report = json.load(fileh)
+    finally:
+        os.remove(filename)
+    assert [result['builds'] for result in report['results']] == [3, 6]
+    assert 'peak_bytes' not in report['results'][0]['stages']['correlate']
+    assert 'Report written to' in capsys.readouterr().out
@@ -0,0 +1,85 @@
+"""Tests for bitset flip detection"""
+import io
+
+import pytest
+
+numpy = pytest.importorskip('numpy')
+
+# pylint: disable=wrong-import-position
+from diff import bitset_flips
+from diff import difference_engine
+from util.util import SymbolTable
+from util.util import iter_json_builds
+
+# pylint: disable=missing-docstring
+
+TEST_RESULTS = [
+    {'pass': ['A'], 'fail': ['B', 'C']},
+    {'pass': ['C'], 'fail': ['A', 'B']},
+    {'pass': ['C', 'D'], 'fail': []},
+    {'pass': ['1', '3'], 'fail': ['2', '4', 'A']},
+    {'pass': ['1'], 'fail': ['2', '4', '3', '5', 'A']},
+    {'pass': ['1', '5'], 'fail': ['1', '2', '4', '3', 'A']},
+]
+
+
+def test_pack_and_unpack_rows():
+    rows = [numpy.array([0, 9]), numpy.array([], dtype=int), numpy.array([8])]
+    bits = bitset_flips.pack_rows(rows, 10)
+    assert bits.shape == (3, 2)
+    assert bitset_flips.unpack_rows(bits, 10) == [[0, 9], [], [8]]
+
+
+def test_product_flips_same_as_flips():
+    flipped = bitset_flips.product_flips(TEST_RESULTS)
+    assert flipped[0] == []
+    for index in range(1, len(TEST_RESULTS)):
+        expected = difference_engine.flips({'tests': TEST_RESULTS[index - 1]},
+                                           {'tests': TEST_RESULTS[index]})
+        assert set(flipped[index]) == set(expected)
+
+
+def test_product_flips_ignores_missing_tests():
+    flipped = bitset_flips.product_flips([{'pass': ['A'], 'fail': []},
+                                          {'pass': [], 'fail': ['B']},
+                                          {'pass': [], 'fail': ['A', 'B']}])
+    assert flipped == [[], [], []]
+
+
+def test_product_flips_without_tests():
+    assert bitset_flips.product_flips([{'pass': [], 'fail': []}] * 2) == [[],
+                                                                         []]
+
+
+def make_stream():
+    builds = []
+    for index, tests in enumerate(TEST_RESULTS):
+        build = {'modules': [('mod1', index // 2), ('mod2', 1)],
+                 'tests': {'pass': [name + '(x)' for name in tests['pass']],
+                           'fail': tests['fail']}}
+        builds.append(('prod{}'.format(index % 2), str(index), build))
+    # the products are interleaved, and prod1 comes back after prod0
+    return builds[:2] + sorted(builds[2:])
+
+
+def test_diff_build_stream_bitset_same_as_diff_build_stream():
+    expected = list(difference_engine.diff_build_stream(make_stream()))
+    diff = list(bitset_flips.diff_build_stream_bitset(make_stream()))
+    assert diff == expected
+
+
+def test_diff_build_stream_bitset_interned():
+    symbols = SymbolTable()
+    expected = list(difference_engine.diff_build_stream(make_stream()))
+    diff = bitset_flips.diff_build_stream_bitset(make_stream(),
+                                                 symbols=symbols)
+    assert difference_engine.resolve_diffs(diff, symbols) == expected
+
+
+def test_diff_build_stream_bitset_from_json():
+    text = ('{"p": {"1": {"modules": [["m", 1]], "tests": {"pass": ["t"], '
+            '"fail": []}}, "2": {"modules": [["m", 2]], "tests": {"pass": [],'
+            ' "fail": ["t"]}}}}')
+    diff = bitset_flips.diff_build_stream_bitset(
+        iter_json_builds(io.StringIO(text)))
+    assert list(diff) == difference_engine.parse_json(text)
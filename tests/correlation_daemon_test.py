@@ -0,0 +1,184 @@
+"""Tests for the correlation daemon"""
+import json
+import os
+import socket
+import tempfile
+import threading
+
+import pytest
+
+from scripts import correlation_parser
+from scripts.correlation_daemon import CorrelationServer
+from scripts.correlation_daemon import remove_stale_socket
+
+from tests.helpers import CORRELATION
+from tests.helpers import make_args
+
+# pylint: disable=missing-docstring
+# pylint: disable=redefined-outer-name
+
+
+@pytest.fixture
+def daemon():
+    tmpdir = tempfile.mkdtemp()
+    filename = os.path.join(tmpdir, 'correlation.json')
+    socket_path = os.path.join(tmpdir, 'daemon.sock')
+    with open(filename, 'w') as fileh:
+        json.dump(CORRELATION, fileh)
+    server = CorrelationServer(socket_path, filename)
+    thread = threading.Thread(target=server.serve_forever, args=(0.01,))
+    thread.start()
+    yield filename, socket_path
+    server.shutdown()
+    server.server_close()
+    thread.join()
+    for path in (filename, socket_path):
+        os.remove(path)
+    os.rmdir(tmpdir)
+
+
+def make_query(**kwargs):
+    query = {'mode': 'narrow', 'modules': ['apps/scm'], 'order': 'weight'}
+    query.update(kwargs)
+    return make_args(**query)
+
+
+@pytest.mark.parametrize('query', [
+    make_query(),
+    make_query(verbose=True, cutoff=9, order='alphabet'),
+    make_query(modules=['apps/scm', 'apps/recording_indexer']),
+    make_query(mode='WIDE', verbose=True),
+    make_query(mode='wide', order='weight-reverse', top=1),
+    make_query(verbose=True, budget=1, default_duration=1),
+])
+def test_daemon_output_same_as_parser(daemon, query, capsys):
+    filename, socket_path = daemon
+    if query.mode.lower() == 'narrow':
+        correlation_parser.narrow(filename, query)
+    else:
+        correlation_parser.wide(filename, query)
+    expected = capsys.readouterr().out
+
+    assert correlation_parser.query_daemon(socket_path, query) == 0
+    assert capsys.readouterr().out == expected
+
+
+def test_daemon_exit_status(daemon, capsys):
+    _, socket_path = daemon
+    query = make_query(modules=['no/such/module'])
+    assert correlation_parser.query_daemon(socket_path, query) == 1
+    assert 'WARNING' in capsys.readouterr().out
+
+
+@pytest.mark.parametrize('top', [0, -1, 1.5, True])
+def test_daemon_rejects_bad_top(daemon, top, capsys):
+    _, socket_path = daemon
+    assert correlation_parser.query_daemon(socket_path,
+                                           make_query(top=top)) == 2
+    assert 'top must be a positive integer' in capsys.readouterr().out
+
+
+def test_daemon_rejects_budget_without_durations(daemon, capsys):
+    _, socket_path = daemon
+    assert correlation_parser.query_daemon(socket_path,
+                                           make_query(budget=2)) == 2
+    assert 'budget needs durations' in capsys.readouterr().out
+
+
+def test_daemon_durations_relative_to_client(daemon, monkeypatch, capsys):
+    filename, socket_path = daemon
+    directory = os.path.dirname(filename)
+    with open(os.path.join(directory, 'durations.json'), 'w') as fileh:
+        json.dump({'test_syslog': 1, 'ptz_tests': 5}, fileh)
+    monkeypatch.chdir(directory)
+    query = make_query(budget=2, durations='durations.json')
+    try:
+        assert correlation_parser.query_daemon(socket_path, query) == 0
+        assert capsys.readouterr().out == 'test_syslog\n'
+    finally:
+        os.remove('durations.json')
+
+
+def test_daemon_missing_durations(daemon, capsys):
+    _, socket_path = daemon
+    query = make_query(budget=2, durations='/no/such/durations.json')
+    assert correlation_parser.query_daemon(socket_path, query) == 2
+    assert capsys.readouterr().out.startswith('ERROR:')
+
+
+def test_durations_cached_until_changed(tmpdir, monkeypatch):
+    path = tmpdir.join('durations.json')
+    path.write('{"test_syslog": 1}')
+    reads = []
+    read_durations = correlation_parser.read_durations
+    monkeypatch.setattr(correlation_parser, 'read_durations',
+                        lambda name: reads.append(name) or
+                        read_durations(name))
+    server = CorrelationServer(str(tmpdir.join('daemon.sock')),
+                               str(tmpdir.join('correlation.json')))
+    try:
+        assert server.read_durations(str(path)) == {'test_syslog': 1}
+        assert server.read_durations(str(path)) == {'test_syslog': 1}
+        assert len(reads) == 1
+        path.write('{"test_syslog": 2}')
+        os.utime(str(path), (0, 0))
+        assert server.read_durations(str(path)) == {'test_syslog': 2}
+        assert len(reads) == 2
+    finally:
+        server.server_close()
+
+
+def test_daemon_reloads_changed_file(daemon, capsys):
+    filename, socket_path = daemon
+    with open(filename, 'w') as fileh:
+        json.dump({'apps/scm': {'new_test': 1}}, fileh)
+    os.utime(filename, (0, 0))
+    correlation_parser.query_daemon(socket_path, make_query())
+    assert capsys.readouterr().out == 'new_test\n'
+
+
+class FakeBackend(object):
+    closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def test_reload_closes_previous_backend(daemon):
+    filename, _ = daemon
+    server = CorrelationServer(filename + '.sock', filename)
+    try:
+        previous = server.data = FakeBackend()
+        os.utime(filename, (0, 0))
+        server.load()
+        assert previous.closed
+        assert server.data == CORRELATION
+        last = server.data = FakeBackend()
+    finally:
+        server.server_close()
+        os.remove(filename + '.sock')
+    assert last.closed
+
+
+def test_remove_stale_socket(tmpdir):
+    path = str(tmpdir.join('daemon.sock'))
+    remove_stale_socket(path)  # nothing there
+    sock = socket.socket(socket.AF_UNIX)
+    sock.bind(path)
+    sock.close()
+    remove_stale_socket(path)
+    assert not os.path.exists(path)
+
+
+def test_remove_stale_socket_refuses_other_files(tmpdir):
+    path = tmpdir.join('correlation.json')
+    path.write('{}')
+    with pytest.raises(ValueError):
+        remove_stale_socket(str(path))
+    assert path.read() == '{}'
+
+
+def test_query_without_daemon(tmpdir, capsys):
+    socket_path = str(tmpdir.join('missing.sock'))
+    assert correlation_parser.query_daemon(socket_path, make_query()) == 2
+    assert capsys.readouterr().out.startswith('ERROR:')
@@ -1,3 +1,5 @@
+import argparse
+
 import pytest
 # import sys
 # import os
@@ -5,9 +7,11 @@ import pytest
 # SCRIPT_DIR = os.path.dirname(os.path.realpath(os.path.join(os.getcwd(), os.path.expanduser(__file__))))
 # sys.path.append(os.path.normpath(os.path.join(SCRIPT_DIR, PACKAGE_PARENT)))
 
+from scripts.correlation_parser import positive_int
 from scripts.correlation_parser import sort_tests
 from scripts.correlation_parser import sum_tests
 from scripts.correlation_parser import narrow
+from scripts.correlation_parser import select_within_budget
 
 # Test narrow()
 # ============
@@ -46,10 +50,28 @@ def test_sort_tests_alphabet_reverse(def_list):
     sorted_weight = sort_tests(def_list, order='alphabet-reverse')
     assert sorted_weight == [('d', 0), ('c', 3), ('b', 2), ('a', 1)]
 
+@pytest.mark.parametrize('order', ['weight', 'weight-reverse', 'alphabet',
+                                   'alphabet-reverse'])
+@pytest.mark.parametrize('top', [0, 1, 3, 4, 10])
+def test_sort_tests_top(def_list, order, top):
+    assert (sort_tests(def_list, order=order, top=top) ==
+            sort_tests(def_list, order=order)[:top])
+
+def test_sort_tests_top_same_weights():
+    tests = {'t{}'.format(num): num % 3 for num in range(100)}
+    assert (sort_tests(tests, 'weight-reverse', top=10) ==
+            sort_tests(tests, 'weight-reverse')[:10])
+
 def test_sort_tests_error(def_list):
     with pytest.raises(ValueError):
         sorted_weight = sort_tests(def_list, order='non-existing-option')
 
+def test_positive_int():
+    assert positive_int('3') == 3
+    for value in ('0', '-1'):
+        with pytest.raises(argparse.ArgumentTypeError):
+            positive_int(value)
+
 
 
 # Test sum_tests
@@ -65,3 +87,34 @@ def test_sum_tests():
 
     tests = sum_tests(data)
     assert tests == {'test1': 4, 'test2': 9, 'test3': 8, 'test4': 9}
+
+
+# Test select_within_budget
+# =========================
+
+def test_select_within_budget_density():
+    tests = {'a': 10, 'b': 6, 'c': 6, 'd': 1}
+    durations = {'a': 10, 'b': 3, 'c': 3, 'd': 1}
+    selected, run_time = select_within_budget(tests, durations, 7)
+    assert selected == {'b': 6, 'c': 6, 'd': 1}
+    assert run_time == 7
+
+def test_select_within_budget_single_heaviest():
+    tests = {'a': 10, 'b': 1}
+    durations = {'a': 10, 'b': 0.5}
+    selected, run_time = select_within_budget(tests, durations, 10)
+    assert selected == {'a': 10}
+    assert run_time == 10
+
+def test_select_within_budget_default_duration():
+    tests = {'a': 2, 'b': 2, 'c': 1}
+    selected, _ = select_within_budget(tests, {'c': 1}, 2)
+    assert selected == {'a': 2, 'b': 2}
+    selected, _ = select_within_budget(tests, {'c': 1}, 2,
+                                       default_duration=5)
+    assert selected == {'c': 1}
+
+def test_select_within_budget_nothing_fits():
+    selected, run_time = select_within_budget({'a': 1}, {'a': 5}, 1)
+    assert selected == {}
+    assert run_time == 0
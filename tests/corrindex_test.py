@@ -0,0 +1,69 @@
+"""Tests for the binary correlation index"""
+import os
+import tempfile
+
+import pytest
+
+from diff import corrindex
+from scripts import correlation_parser
+
+from tests.helpers import CORRELATION
+from tests.helpers import make_args
+
+# pylint: disable=missing-docstring
+# pylint: disable=redefined-outer-name
+
+
+@pytest.fixture
+def index_file():
+    with tempfile.NamedTemporaryFile(suffix='.idx', delete=False) as fileh:
+        filename = fileh.name
+    corrindex.write_index(CORRELATION, filename)
+    yield filename
+    os.remove(filename)
+
+
+def test_index_lookup(index_file):
+    with corrindex.CorrelationIndex(index_file) as index:
+        assert len(index) == 4
+        assert list(index) == sorted(CORRELATION)
+        for module in CORRELATION:
+            assert module in index
+            assert index[module] == CORRELATION[module]
+        assert 'apps' not in index
+        assert index.get('zzz') is None
+        with pytest.raises(KeyError):
+            index['aaa']  # pylint: disable=pointless-statement
+        assert dict(index.items()) == CORRELATION
+
+
+def test_is_index(index_file):
+    assert corrindex.is_index(index_file)
+    assert not corrindex.is_index(__file__)
+    assert not corrindex.is_index('/tmp/no/such/file.idx')
+
+
+def test_not_an_index():
+    with pytest.raises(ValueError):
+        corrindex.CorrelationIndex(__file__)
+
+
+def test_empty_index():
+    with tempfile.NamedTemporaryFile(suffix='.idx', delete=False) as fileh:
+        filename = fileh.name
+    try:
+        corrindex.write_index({}, filename)
+        with corrindex.CorrelationIndex(filename) as index:
+            assert len(index) == 0
+            assert 'mod' not in index
+    finally:
+        os.remove(filename)
+
+
+def test_correlation_parser_reads_index(index_file, capsys):
+    args = make_args(modules=['apps/scm', 'apps/recording_indexer'])
+    correlation_parser.narrow(index_file, args)
+    assert capsys.readouterr().out.split() == [
+        'test_syslog', 'ptz_tests', 'discovery_tests', 'test_the_rest']
+    correlation_parser.wide(index_file, args)
+    assert capsys.readouterr().out.split()[0] == 'test_syslog'
@@ -0,0 +1,181 @@
+"""Tests for time-decayed correlations"""
+from collections import deque
+
+import pytest
+
+from diff import diffeng
+from diff import incremental
+from diff.decay import DecayedCorrelation
+from diff.decay import correlate_decayed
+from diff.decay import tag_products
+from diff.difference_engine import correlate
+from diff.difference_engine import diff_build_stream
+from diff.difference_engine import diff_builds
+from diff.diffeng import parse_args
+from tests.helpers import as_stream
+from tests.helpers import make_history
+from util.util import json_dumps
+from util.util import json_loads
+
+# pylint: disable=missing-docstring
+
+DIFFS = [
+    {'modules': ['mod1'], 'tests': ['testA']},
+    {'modules': ['mod2'], 'tests': ['testA', 'testB']},
+    {'modules': [], 'tests': []},
+    {'modules': ['mod1', 'mod2'], 'tests': ['testA']},
+    {'modules': ['mod3'], 'tests': ['testC']},
+]
+
+
+def expected_weight(indices, now, half_life):
+    return sum(0.5 ** ((now - index) / float(half_life)) for index in indices)
+
+
+def test_weights_decay():
+    decayed = DecayedCorrelation(2).add(DIFFS)
+    assert decayed.weight('mod1', 'testA') == pytest.approx(
+        expected_weight([0, 3], 4, 2))
+    assert decayed.weight('mod2', 'testB') == pytest.approx(
+        expected_weight([1], 4, 2))
+    assert decayed.weight('mod3', 'testC') == 1
+    assert decayed.weight('mod3', 'testA') == 0
+
+
+def test_correlation_order_and_rounding():
+    correlation = correlate_decayed(DIFFS, half_life=2)
+    assert list(correlation) == ['mod1', 'mod2', 'mod3']
+    assert list(correlation['mod2']) == ['testA', 'testB']
+    assert correlation['mod2']['testB'] == round(2 ** -1.5, 6)
+
+
+def test_builds_counted_per_product():
+    # the second product's builds come later in the stream, but do not age
+    # the flips of the first one
+    products = deque(['prod1'] * 2 + ['prod2'] * 100)
+    diffs = ([{'modules': [], 'tests': []},
+              {'modules': ['mod1'], 'tests': ['testA']}] +
+             [{'modules': ['mod1'], 'tests': ['testA']}] +
+             [{'modules': [], 'tests': []}] * 99)
+    decayed = DecayedCorrelation(10).add(diffs, products)
+    assert decayed.builds == {'prod1': 2, 'prod2': 100}
+    assert decayed.weight('mod1', 'testA') == pytest.approx(
+        1 + expected_weight([0], 99, 10))
+
+
+def test_tag_products():
+    builds = [('p1', 'b1', 1), ('p2', 'b1', 2)]
+    products = deque()
+    assert list(tag_products(iter(builds), products)) == builds
+    assert products == deque(['p1', 'p2'])
+
+
+def test_zero_weights_left_out():
+    decayed = DecayedCorrelation(1).add(
+        [{'modules': ['mod1'], 'tests': ['testA']}] +
+        [{'modules': ['mod2'], 'tests': ['testB']}] * 40)
+    assert decayed.weight('mod1', 'testA') > 0
+    assert decayed.correlation() == {'mod2': {'testB': 2.0}}
+    decayed.prune()
+    assert list(decayed.counts) == ['mod2']
+
+
+def test_long_half_life_is_plain_correlation():
+    correlation = correlate_decayed(DIFFS, half_life=1e12)
+    assert correlation == correlate(DIFFS)
+
+
+def test_min_weight_and_prune():
+    decayed = DecayedCorrelation(1).add(DIFFS)
+    assert decayed.correlation(min_weight=0.2) == {
+        'mod1': {'testA': 0.5625}, 'mod2': {'testA': 0.625},
+        'mod3': {'testC': 1.0}}
+    decayed.prune(0.2)
+    assert 'testB' not in decayed.counts['mod2']
+    decayed.prune(10)
+    assert decayed.counts == {}
+
+
+def test_add_in_parts_through_state():
+    whole = DecayedCorrelation(3).add(DIFFS)
+    part = DecayedCorrelation(3).add(DIFFS[:2])
+    part = DecayedCorrelation.from_state(json_loads(json_dumps(part.state())))
+    part.add(DIFFS[2:])
+    assert part.builds == whole.builds
+    assert part.correlation() == whole.correlation()
+
+
+def test_invalid_half_life():
+    with pytest.raises(ValueError):
+        DecayedCorrelation(0)
+
+
+def test_state_with_shared_build_clock():
+    with pytest.raises(ValueError):
+        DecayedCorrelation.from_state({'half_life': 2, 'builds': 5,
+                                       'counts': {}})
+
+
+def full_decayed_run(history, half_life):
+    products = deque()
+    diffs = diff_build_stream(tag_products(as_stream(history), products))
+    return correlate_decayed(diffs, half_life, products)
+
+
+def test_incremental_decay_is_full_decayed_run():
+    history = make_history(products=3)
+    state = incremental.new_state()
+    incremental.enable_decay(state, 4)
+    incremental.update_state(state, as_stream(history, end=3))
+    state = json_loads(json_dumps(state))
+    incremental.update_state(state, as_stream(history))
+    assert state['correlation'] == correlate(diff_builds(history))
+    decayed = DecayedCorrelation.from_state(state['decayed'])
+    expected = full_decayed_run(history, 4)
+    result = decayed.correlation()
+    assert list(result) == list(expected)
+    for module in expected:
+        assert dict(result[module]) == pytest.approx(dict(expected[module]))
+
+
+def test_enable_decay_errors():
+    state = incremental.new_state()
+    incremental.update_state(state, as_stream(make_history()))
+    with pytest.raises(ValueError):
+        incremental.enable_decay(state, 4)
+    state = incremental.new_state()
+    incremental.enable_decay(state, 4)
+    incremental.enable_decay(state, 4)
+    with pytest.raises(ValueError):
+        incremental.enable_decay(state, 5)
+
+
+@pytest.mark.parametrize('argv', [['--half-life', '0'],
+                                  ['--half-life', '5', '-j', '2'],
+                                  ['--half-life', '5', '-b', 'sparse'],
+                                  ['--half-life', '5', '--index', 'x.idx']])
+def test_half_life_option_errors(argv):
+    with pytest.raises(SystemExit):
+        parse_args(['in.json', 'out.json'] + argv)
+
+
+def test_incremental_decay_prunes(monkeypatch):
+    pruned = []
+    prune = DecayedCorrelation.prune
+    monkeypatch.setattr(DecayedCorrelation, 'prune',
+                        lambda self: pruned.append(self) or prune(self))
+    state = incremental.new_state()
+    incremental.enable_decay(state, 4)
+    incremental.update_state(state, as_stream(make_history()))
+    assert len(pruned) == 1
+
+
+def test_diffeng_decays_per_product(tmpdir):
+    history = make_history(products=3)
+    filename = str(tmpdir.join('history.json'))
+    output = str(tmpdir.join('correlation.json'))
+    with open(filename, 'w') as fileh:
+        fileh.write(json_dumps(history))
+    args = diffeng.parse_args([filename, output, '--half-life', '2'])
+    correlation, _ = diffeng.analyze(args)
+    assert correlation == full_decayed_run(history, 2)
@@ -2,8 +2,11 @@
 import diff.difference_engine as difference_engine
 from util.util import Build
 from util.util import BuildSet
+from util.util import SymbolTable
+from util.util import json_dumps
 
 # import pytest  # import this for e.g. pytest.mark.xfail
+import io
 import unittest
 from collections import OrderedDict
 from diff.difference_engine import parse_json
@@ -200,6 +203,23 @@ def test_diff_modules():
     assert set(correct_changed_modules) == set(changed_modules)
 
 
+def test_diff_sets():
+    build1 = {'modules': [['mod1', 'x'], ('mod2', 'x')],
+              'tests': {'pass': ['A(1)', 'B'], 'fail': ['C']}}
+    build2 = {'modules': [('mod1', 'y'), ('mod2', 'x')],
+              'tests': {'pass': ['B', 'C'], 'fail': ['A(2)']}}
+    sets1 = difference_engine.build_sets(build1)
+    sets2 = difference_engine.build_sets(build2)
+    assert sets1 == ({('mod1', 'x'), ('mod2', 'x')}, {'A', 'B'}, {'C'})
+    modules, tests = difference_engine.diff_sets(sets1, sets2)
+    assert modules == difference_engine.changed_modules(build1, build2)
+    assert set(tests) == set(difference_engine.flips(build1, build2)) == \
+        {'A', 'C'}
+    assert difference_engine.diff_sets(sets2, sets2) == ([], [])
+    assert difference_engine.build_sets(build1, normalize=False)[1] == \
+        {'A(1)', 'B'}
+
+
 def test_correlate():
     # pylint: disable=bad-continuation
     diff1 = [
@@ -330,6 +350,25 @@ def test_correct_correlations():
     assert correlation == correct_correlation
 
 
+def test_intern_build():
+    symbols = SymbolTable()
+    build = make_build([('mod1', 'x'), ['mod2', 'y']],
+                       make_testset(passed=['testA(1, 2)', 'mod1'],
+                                    failed='testB'))
+    interned = difference_engine.intern_build(build, symbols)
+    assert interned == {'modules': [(0, 'x'), (1, 'y')],
+                        'tests': {'pass': [2, 0], 'fail': [3]}}
+    assert symbols.names == ['mod1', 'mod2', 'testA', 'testB']
+
+
+def test_flips_without_normalization():
+    build1 = {'tests': {'pass': ['A(1)'], 'fail': ['A']}}
+    build2 = {'tests': {'pass': ['A'], 'fail': ['A(1)']}}
+    flips = difference_engine.flips(build1, build2, normalize=False)
+    assert set(flips) == set(['A', 'A(1)'])
+    assert difference_engine.flips(build1, build2) == []
+
+
 def test_filter_test_params():
     mlist = ['list',
              'of',
@@ -478,6 +517,23 @@ class ParseJSON(unittest.TestCase):
                    {'modules': [u'mod2'], 'tests': ['test2']}]
         assert parsed == correct
 
+    def test_parse_json_stream_same_as_parse_json(self):
+        for text in (self.text_small, self.text_big):
+            streamed = difference_engine.parse_json_stream(io.StringIO(text))
+            assert list(streamed) == difference_engine.parse_json(text)
+
+    def test_interned_pipeline_same_as_parse_json(self):
+        for text in (self.text_small, self.text_big):
+            symbols = SymbolTable()
+            diff = list(difference_engine.parse_json_stream(
+                io.StringIO(text), symbols=symbols))
+            expected = difference_engine.parse_json(text)
+            assert difference_engine.resolve_diffs(diff, symbols) == expected
+            correlation = difference_engine.resolve_correlation(
+                correlate(diff), symbols)
+            assert (json_dumps(correlation) ==
+                    json_dumps(correlate(expected)))
+
     # @pytest.mark.xfail
     def test_parse_json_text_big_flips(self):
         parsed = difference_engine.parse_json(self.text_big)
@@ -581,6 +637,16 @@ class TestDiffBuilds(unittest.TestCase):
         assert 'pak4.test' in diff[1]['tests']
         assert 'pak1.test' not in diff[1]['tests']
 
+    def test_diff_build_stream_keeps_products_apart(self):
+        builds = [('prod0', '0', self.builds['0']),
+                  ('prod1', '0', self.builds['1']),
+                  ('prod0', '1', self.builds['1']),
+                  ('prod1', '1', self.builds['1'])]
+        diff = list(difference_engine.diff_build_stream(builds))
+        assert diff[1] == {'tests': [], 'modules': []}
+        assert diff[2] == difference_engine.diff_builds(self.buildset)[1]
+        assert diff[3] == {'tests': [], 'modules': []}
+
     def test_correct_diff_builds(self):
         diff = difference_engine.diff_builds(self.buildset)
         correct_diff = [
@@ -601,7 +667,8 @@ def test_printable_analysis():
         'mod2': {'testA': 2, 'testB': 3, 'testC': 2},
         'mod3': {'testA': 2, 'testB': 2, 'testC': 2}
         }
-    printable = difference_engine.printable_analysis(correlation, cutoff=3)
+    printable = list(difference_engine.printable_analysis(correlation,
+                                                          cutoff=3))
     # With cutoff at 3, nothing from mod3 should show...
     assert 'mod3' not in printable
 
@@ -612,8 +679,9 @@ def test_printable_analysis_opt():
         'mod2': {'testA': 2, 'testB': 3, 'testC': 2},
         'mod3': {'testA': 2, 'testB': 2, 'testC': 2}
         }
-    printable1 = difference_engine.printable_analysis(correlation)
-    printable2 = difference_engine.printable_analysis(correlation, cutoff=3)
+    printable1 = list(difference_engine.printable_analysis(correlation))
+    printable2 = list(difference_engine.printable_analysis(correlation,
+                                                           cutoff=3))
     assert 'mod3' in printable1
     # With cutoff at 3, nothing from mod3 should show...
     assert 'mod3' not in printable2
@@ -627,6 +695,47 @@ def test_print_analysis():
         'D': {'D1': 1},
         'B': {'B1': 3, 'C1': 2, 'A1': 2, 'D1': 1}
     }
-    out = difference_engine.printable_analysis(analysis)
+    out = list(difference_engine.printable_analysis(analysis))
     highest_weight_A = int(out[1][-1])
     assert highest_weight_A == 4
+
+
+def test_printable_analysis_streams_lines():
+    correlation = {'B': {'t2': 1, 't1': 3}, 'A': {'t1': 2}, 'C': {'t1': 1}}
+    printable = difference_engine.printable_analysis(correlation, cutoff=2)
+    assert next(printable) == 'A'
+    assert list(printable) == ['  t1:\t2', 'B', '  t1:\t3']
+
+
+# Tests for filter_correlations
+# =============================
+def make_correlation():
+    return OrderedDict([('mod1', OrderedDict([('testA', 1), ('testB', 3)])),
+                        ('mod2', OrderedDict([('testA', 2)])),
+                        ('mod3', OrderedDict())])
+
+
+def test_filter_correlations_copies():
+    correlation = make_correlation()
+    filtered = difference_engine.filter_correlations(correlation, cutoff=2)
+    assert filtered == {'mod1': {'testB': 3}, 'mod2': {'testA': 2}}
+    assert correlation == make_correlation()
+    filtered['mod1']['testC'] = 4
+    assert 'testC' not in correlation['mod1']
+
+
+def test_filter_correlations_in_place():
+    correlation = make_correlation()
+    filtered = difference_engine.filter_correlations(correlation, cutoff=3,
+                                                     in_place=True)
+    assert filtered is correlation
+    assert correlation == {'mod1': {'testB': 3}}
+
+
+def test_iter_filtered():
+    correlation = make_correlation()
+    view = [(module, list(tests)) for module, tests in
+            difference_engine.iter_filtered(correlation, cutoff=2)]
+    assert view == [('mod1', [('testB', 3)]), ('mod2', [('testA', 2)]),
+                    ('mod3', [])]
+    assert correlation == make_correlation()
@@ -0,0 +1,47 @@
+"""Histories and helpers shared by the tests"""
+from argparse import Namespace
+from collections import OrderedDict
+
+# pylint: disable=missing-docstring
+
+CORRELATION = {
+    'apps/scm': {'test_syslog': 8, 'ptz_tests': 11, 'test_the_rest': 4},
+    'apps/recording_indexer': {'test_syslog': 23, 'discovery_tests': 8},
+    'libs/åäö': {'test_ünicode': 1},
+    'libs/empty': {},
+}
+
+
+def make_history(products=2, builds=6):
+    history = OrderedDict()
+    for prod in range(products):
+        history['prod{}'.format(prod)] = OrderedDict()
+        for bid in range(builds):
+            failed = ['test{}'.format(bid % 3), 'test{}'.format(prod)]
+            history['prod{}'.format(prod)]['bid{}'.format(bid)] = {
+                'modules': [('mod{}'.format(mod), bid // (mod + 1))
+                            for mod in range(3)],
+                'tests': {'pass': [test for test in ['test0', 'test1',
+                                                     'test2', 'test3']
+                                   if test not in failed],
+                          'fail': failed}}
+    return history
+
+
+def as_stream(history, start=0, end=None):
+    for product in history:
+        for buildname in list(history[product])[start:end]:
+            yield product, buildname, history[product][buildname]
+
+
+def as_dict(correlation):
+    return {module: dict(tests) for module, tests in correlation.items()}
+
+
+def make_args(**kwargs):
+    """Arguments of correlation_parser, with the optional ones unset"""
+    args = {'verbose': False, 'modules': [], 'order': 'weight-reverse',
+            'cutoff': 0, 'top': None, 'budget': None, 'durations': None,
+            'default_duration': None}
+    args.update(kwargs)
+    return Namespace(**args)
@@ -0,0 +1,111 @@
+"""Tests for incremental correlation updates"""
+import os
+import tempfile
+from collections import OrderedDict
+
+import pytest
+
+from diff import incremental
+from diff.difference_engine import add_correlations
+from diff.difference_engine import correlate
+from diff.difference_engine import diff_builds
+from util.util import SymbolTable
+
+from tests.helpers import as_dict
+from tests.helpers import as_stream
+from tests.helpers import make_history
+
+# pylint: disable=missing-docstring
+
+
+def test_add_correlations():
+    correlation = OrderedDict([('mod1', OrderedDict([('testA', 1)]))])
+    add_correlations(correlation, {'mod1': {'testA': 2, 'testB': 1},
+                                   'mod2': {'testA': 1}})
+    assert correlation == {'mod1': {'testA': 3, 'testB': 1},
+                           'mod2': {'testA': 1}}
+    assert list(correlation['mod1']) == ['testA', 'testB']
+
+
+def test_update_from_empty_state_is_full_run():
+    history = make_history()
+    state = incremental.new_state()
+    diffs = incremental.update_state(state, as_stream(history))
+    assert diffs == diff_builds(history)
+    assert state['correlation'] == correlate(diff_builds(history))
+    assert state['products']['prod1']['count'] == 6
+    assert state['products']['prod1']['last'] == 'bid5'
+
+
+@pytest.mark.parametrize('start', [0, 4])
+def test_update_with_full_or_new_builds(start):
+    history = make_history()
+    state = incremental.new_state()
+    incremental.update_state(state, as_stream(history, end=4))
+    diffs = incremental.update_state(state, as_stream(history, start=start))
+    assert len(diffs) == 4
+    assert (as_dict(state['correlation']) ==
+            as_dict(correlate(diff_builds(history))))
+
+
+def test_update_with_other_engines():
+    pytest.importorskip('numpy')
+    pytest.importorskip('scipy')
+    from diff.bitset_flips import diff_build_stream_bitset
+    from diff.sparse_correlation import correlate_sparse
+    history = make_history()
+    state = incremental.new_state()
+    incremental.update_state(state, as_stream(history, end=3))
+    incremental.update_state(state, as_stream(history, start=3),
+                             diff_stream=diff_build_stream_bitset,
+                             correlate_func=correlate_sparse,
+                             symbols=SymbolTable())
+    assert (as_dict(state['correlation']) ==
+            as_dict(correlate(diff_builds(history))))
+
+
+def test_update_without_new_builds():
+    history = make_history()
+    state = incremental.new_state()
+    incremental.update_state(state, as_stream(history))
+    assert incremental.update_state(state, as_stream(history)) == []
+    assert state['correlation'] == correlate(diff_builds(history))
+
+
+def test_update_with_rewritten_history():
+    history = make_history()
+    state = incremental.new_state()
+    incremental.update_state(state, as_stream(history, end=4))
+    del history['prod0']['bid3']
+    with pytest.raises(ValueError):
+        incremental.update_state(state, as_stream(history))
+
+
+def test_save_and_load_state():
+    history = make_history()
+    state = incremental.new_state()
+    incremental.update_state(state, as_stream(history, end=4))
+    with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as fileh:
+        filename = fileh.name
+    try:
+        incremental.save_state(state, filename)
+        loaded = incremental.load_state(filename)
+    finally:
+        os.remove(filename)
+    incremental.update_state(loaded, as_stream(history))
+    assert (as_dict(loaded['correlation']) ==
+            as_dict(correlate(diff_builds(history))))
+
+
+def test_load_missing_state():
+    assert incremental.load_state('/tmp/no/such/state.json') == \
+        incremental.new_state()
+
+
+def test_load_unreadable_state():
+    directory = tempfile.mkdtemp()
+    try:
+        with pytest.raises((OSError, IOError)):
+            incremental.load_state(directory)
+    finally:
+        os.rmdir(directory)
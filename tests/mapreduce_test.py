@@ -0,0 +1,88 @@
+"""Tests for map-reduce correlation"""
+import os
+
+import pytest
+
+from diff import diffeng
+from diff import mapreduce
+from diff.difference_engine import correlate
+from diff.difference_engine import diff_build_stream
+from scripts import merge_correlations
+from util.util import json_dumps
+
+from tests.helpers import as_stream
+from tests.helpers import make_history
+
+# pylint: disable=missing-docstring
+
+
+def make_diffs(products=3, builds=8):
+    return list(diff_build_stream(as_stream(make_history(products, builds))))
+
+
+def test_iter_chunks():
+    assert list(mapreduce.iter_chunks(range(5), 2)) == [[0, 1], [2, 3], [4]]
+    assert list(mapreduce.iter_chunks([], 2)) == []
+    with pytest.raises(ValueError):
+        list(mapreduce.iter_chunks(range(5), 0))
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 5, 100])
+def test_same_as_correlate(chunk_size):
+    diffs = make_diffs()
+    correlation = mapreduce.correlate_mapreduce(iter(diffs),
+                                                chunk_size=chunk_size)
+    assert json_dumps(correlation) == json_dumps(correlate(diffs))
+
+
+def test_same_as_correlate_in_parallel():
+    diffs = make_diffs()
+    correlation = mapreduce.correlate_mapreduce(diffs, jobs=2, chunk_size=3)
+    assert json_dumps(correlation) == json_dumps(correlate(diffs))
+
+
+def test_merge_is_associative_and_pure():
+    diffs = make_diffs()
+    first, second, third = [mapreduce.map_chunk(chunk) for chunk in
+                            mapreduce.iter_chunks(diffs, 8)]
+    before = json_dumps([first, second, third])
+    left = mapreduce.merge_partials(mapreduce.merge_partials(first, second),
+                                    third)
+    right = mapreduce.merge_partials(first,
+                                     mapreduce.merge_partials(second, third))
+    assert json_dumps(left) == json_dumps(right)
+    assert json_dumps(left) == json_dumps(correlate(diffs))
+    assert json_dumps([first, second, third]) == before
+
+
+def test_partial_round_trip(tmpdir):
+    partial = mapreduce.map_chunk(make_diffs())
+    for name in ('partial.json', 'partial.json.gz'):
+        filename = str(tmpdir.join(name))
+        mapreduce.write_partial(partial, filename)
+        assert mapreduce.read_partial(filename) == partial
+
+
+def test_merge_correlations(tmpdir):
+    diffs = make_diffs()
+    chunks = list(mapreduce.iter_chunks(diffs, 10))
+    filenames = []
+    for number, chunk in enumerate(chunks):
+        filenames.append(str(tmpdir.join('{}.json.bz2'.format(number))))
+        mapreduce.write_partial(mapreduce.map_chunk(chunk), filenames[-1])
+    output = str(tmpdir.join('merged.json'))
+    merge_correlations.main([output] + filenames)
+    assert os.path.isfile(output)
+    assert json_dumps(mapreduce.read_partial(output)) == json_dumps(
+        correlate(diffs))
+
+
+def test_diffeng_args():
+    args = diffeng.parse_args(['in.json', 'out.json', '--chunk-size', '10',
+                               '--jobs', '2'])
+    _, correlate_func = diffeng.engine_functions(args)
+    assert correlate_func.keywords == {'jobs': 2, 'chunk_size': 10}
+    for bad in (['--chunk-size', '0'], ['--chunk-size', '5', '--window', '3'],
+                ['--chunk-size', '5', '--half-life', '3']):
+        with pytest.raises(SystemExit):
+            diffeng.parse_args(['in.json', 'out.json'] + bad)
@@ -0,0 +1,161 @@
+"""Tests for the metrics layer"""
+import json
+
+import pytest
+
+from diff import diffeng
+from diff.difference_engine import correlate
+from diff.difference_engine import diff_build_stream
+from diff.difference_engine import diff_builds
+from diff.difference_engine import filter_correlations
+from tests.helpers import as_stream
+from tests.helpers import make_history
+from util.util import json_dumps
+from util import metrics
+
+# pylint: disable=missing-docstring
+
+
+@pytest.fixture(autouse=True)
+def disabled():
+    metrics.disable()
+    yield
+    metrics.disable()
+
+
+def test_disabled_by_default():
+    assert not metrics.enabled()
+    with metrics.timer('stage'):
+        metrics.count('items', 3)
+    assert metrics.report() == {}
+    assert metrics.disable() is None
+
+
+def test_timers_and_counters():
+    metrics.enable()
+    for _ in range(3):
+        with metrics.timer('stage'):
+            metrics.count('items', 2)
+    metrics.count('other')
+
+    report = metrics.report()
+    assert report['timers']['stage']['calls'] == 3
+    assert report['timers']['stage']['seconds'] >= 0
+    assert report['counters'] == {'items': 6, 'other': 1}
+    assert report['peak_memory']['stage'] > 0
+    assert report['max_rss_bytes'] > 0
+    assert 'profile' not in report
+
+
+def test_enable_resets():
+    metrics.enable()
+    metrics.count('items')
+    metrics.enable()
+    assert metrics.report()['counters'] == {}
+
+
+def test_timer_on_exception():
+    metrics.enable()
+    with pytest.raises(KeyError):
+        with metrics.timer('stage'):
+            raise KeyError('boom')
+    assert metrics.report()['timers']['stage']['calls'] == 1
+
+
+def test_timed():
+    @metrics.timed('twice')
+    def twice(value):
+        return 2 * value
+
+    assert twice(2) == 4  # disabled
+    metrics.enable()
+    assert twice(3) == 6
+    assert twice.__name__ == 'twice'
+    assert metrics.report()['timers']['twice']['calls'] == 1
+
+
+def test_profile(tmpdir):
+    metrics.enable(profile=True)
+    correlate(diff_builds(make_history(products=1, builds=5)))
+    filename = str(tmpdir.join('profile.out'))
+    metrics.write_profile(filename)
+    assert tmpdir.join('profile.out').check()
+
+    profile = metrics.report()['profile']
+    assert 0 < len(profile) <= metrics.PROFILE_TOP
+    assert any('(correlate)' in entry['function'] for entry in profile)
+    assert all(set(entry) == {'function', 'calls', 'seconds', 'cumulative'}
+               for entry in profile)
+
+
+def test_write(tmpdir):
+    metrics.enable()
+    metrics.count('items', 5)
+    filename = str(tmpdir.join('metrics.json'))
+    metrics.write(filename)
+    with open(filename) as fileh:
+        report = json.load(fileh)
+    assert report['counters'] == {'items': 5}
+
+
+def test_pipeline_counters():
+    history = make_history(products=2, builds=10)
+    metrics.enable()
+    diffs = diff_builds(history)
+    correlation = correlate(diffs)
+    filtered = filter_correlations(correlation, cutoff=3)
+
+    report = metrics.report()
+    assert set(report['timers']) >= {'diff_builds', 'correlate'}
+    counters = report['counters']
+    assert counters['builds_diffed'] == len(diffs) == 20
+    assert counters['flips_found'] == sum(len(diff['tests'])
+                                          for diff in diffs)
+    assert counters['pairs_emitted'] == sum(
+        weight for tests in correlation.values() for weight in tests.values())
+    assert counters['entries_filtered'] == (
+        sum(len(tests) for tests in correlation.values()) -
+        sum(len(tests) for tests in filtered.values()))
+
+
+def test_bitset_counters():
+    pytest.importorskip('numpy')
+    from diff.bitset_flips import diff_build_stream_bitset
+    stream = list(as_stream(make_history(products=2, builds=10)))
+    metrics.enable()
+    expected = list(diff_build_stream(stream))
+    counters = metrics.report()['counters']
+    metrics.enable()
+    assert list(diff_build_stream_bitset(stream)) == expected
+    assert metrics.report()['counters'] == counters
+    assert counters['builds_diffed'] == 20
+
+
+def test_diffeng_args():
+    args = diffeng.parse_args(['in.json', 'out.json', '--metrics-out', 'm.json',
+                               '--profile-out', 'p.out'])
+    assert args.metrics_out == 'm.json'
+    assert args.profile_out == 'p.out'
+
+
+def test_diffeng_print_counts_filtered(tmpdir, monkeypatch, capsys):
+    history = make_history(products=2, builds=10)
+    correlation = correlate(diff_builds(history))
+    filename = str(tmpdir.join('history.json'))
+    with open(filename, 'w') as fileh:
+        fileh.write(json_dumps(history))
+    metrics_out = str(tmpdir.join('metrics.json'))
+    monkeypatch.setattr('sys.argv', [
+        'diffeng', filename, str(tmpdir.join('out.json')), '--print',
+        '-c', '3', '--metrics-out', metrics_out])
+    try:
+        diffeng.main()
+    finally:
+        metrics.disable()
+    assert capsys.readouterr().out
+    with open(metrics_out) as fileh:
+        counters = json.load(fileh)['counters']
+    assert counters['entries_filtered'] == sum(
+        1 for tests in correlation.values() for weight in tests.values()
+        if weight < 3)
+    assert counters['entries_filtered'] > 0
@@ -0,0 +1,70 @@
+"""Tests for test name normalization"""
+import pytest
+
+from diff import difference_engine
+from diff import normalize
+from diff.normalize import NameNormalizer
+from diff.normalize import regex_rule
+from diff.normalize import strip_params
+from diff.normalize import strip_prefix_rule
+
+# pylint: disable=missing-docstring
+
+
+def test_strip_params():
+    assert strip_params('test(a, b(c))') == 'test'
+    assert strip_params('test') == 'test'
+    assert strip_params('(a)') == ''
+
+
+def test_rules():
+    assert regex_rule(r'\[\d+\]$')('test[12]') == 'test'
+    assert regex_rule(r'_v\d+', '_vN')('test_v2_v3') == 'test_vN_vN'
+    assert strip_prefix_rule('suite.')('suite.test') == 'test'
+    assert strip_prefix_rule('suite.')('other.suite.test') == \
+        'other.suite.test'
+
+
+def test_rules_applied_in_order():
+    normalizer = NameNormalizer([strip_prefix_rule('suite.'), strip_params,
+                                 regex_rule(r'_\d+$')])
+    assert normalizer.normalize_names(['suite.test_1(x)', 'test_2']) == \
+        ['test', 'test']
+
+
+def test_statistics():
+    normalizer = NameNormalizer()
+    assert normalizer.normalize_names(['a(1)', 'b', 'a(1)']) == ['a', 'b', 'a']
+    assert normalizer.normalize('b') == 'b'
+    assert normalizer.normalize('c(2)') == 'c'
+    assert normalizer.stats() == {'hits': 2, 'misses': 3, 'size': 3,
+                                  'maxsize': normalize.MAX_NAMES}
+    normalizer.clear()
+    assert normalizer.stats()['hits'] == normalizer.stats()['size'] == 0
+
+
+def test_bounded():
+    normalizer = NameNormalizer(maxsize=2)
+    assert normalizer.normalize_names(['a(1)', 'b(1)', 'c(1)', 'a(1)']) == \
+        ['a', 'b', 'c', 'a']
+    stats = normalizer.stats()
+    assert stats['size'] == 2
+    assert stats['misses'] == 4
+    with pytest.raises(ValueError):
+        NameNormalizer(maxsize=0)
+
+
+def test_shared_normalizer():
+    normalizer = NameNormalizer([strip_prefix_rule('x.'), strip_params])
+    previous = normalize.set_normalizer(normalizer)
+    try:
+        assert normalize.get_normalizer() is normalizer
+        assert difference_engine.rm_params_from_names(['x.a(1)', 'b']) == \
+            ['a', 'b']
+        build1 = {'tests': {'pass': ['x.A(1)'], 'fail': []}}
+        build2 = {'tests': {'pass': [], 'fail': ['A(2)']}}
+        assert difference_engine.flips(build1, build2) == ['A']
+        assert normalizer.stats()['misses'] == 4
+    finally:
+        normalize.set_normalizer(previous)
+    assert normalize.get_normalizer() is previous
@@ -0,0 +1,53 @@
+"""Tests for parallel diffing and correlation"""
+import pytest
+
+from diff import parallel
+from diff.difference_engine import correlate
+from diff.difference_engine import diff_build_stream
+from util.util import json_dumps
+
+from tests.helpers import as_stream
+from tests.helpers import make_history
+
+# pylint: disable=missing-docstring
+
+
+def test_iter_products():
+    builds = [('p1', 'b1', 1), ('p1', 'b2', 2), ('p2', 'b1', 3),
+              ('p1', 'b3', 4)]
+    runs = list(parallel.iter_products(builds))
+    assert runs == [('p1', builds[:2], None),
+                    ('p2', builds[2:3], None),
+                    ('p1', builds[3:], ('p1', 'b2', 2))]
+
+
+def test_diff_product_with_seed():
+    builds = list(as_stream(make_history(products=1)))
+    task = (builds[3:], builds[2], diff_build_stream, correlate, False, True)
+    _, diffs = parallel.diff_product(task)
+    assert diffs == list(diff_build_stream(builds))[3:]
+
+
+def test_correlate_parallel_same_as_sequential():
+    history = make_history(products=4)
+    diffs = list(diff_build_stream(as_stream(history)))
+    correlation, parallel_diffs = parallel.correlate_parallel(
+        as_stream(history), 2, keep_diffs=True)
+    assert json_dumps(correlation) == json_dumps(correlate(diffs))
+    assert parallel_diffs == diffs
+
+
+def test_correlate_parallel_interleaved_products():
+    pytest.importorskip('numpy')
+    from diff.bitset_flips import diff_build_stream_bitset
+    builds = list(as_stream(make_history(products=2)))
+    builds = builds[:3] + builds[6:] + builds[3:6]
+    correlation, diffs = parallel.correlate_parallel(
+        iter(builds), 3, diff_stream=diff_build_stream_bitset, intern=True)
+    assert json_dumps(correlation) == json_dumps(
+        correlate(diff_build_stream(builds)))
+    assert diffs is None
+
+
+def test_correlate_parallel_empty():
+    assert parallel.correlate_parallel([], 2) == ({}, None)
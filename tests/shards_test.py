@@ -0,0 +1,120 @@
+"""Tests for sharded correlation data"""
+import os
+
+import pytest
+
+from diff import shards
+from scripts import correlation_parser
+
+from tests import helpers
+from tests.helpers import make_args
+
+# pylint: disable=missing-docstring
+# pylint: disable=redefined-outer-name
+
+CORRELATION = dict(helpers.CORRELATION)
+CORRELATION.update({'libs/net/http': {'test_http': 2},
+                    'toplevel': {'test_top': 5}})
+
+
+@pytest.fixture
+def shard_dir(tmpdir):
+    directory = str(tmpdir.join('correlation'))
+    shards.write_shards(CORRELATION, directory, shards=4)
+    return directory
+
+
+def test_shard_key():
+    assert shards.shard_key('apps/scm', shards=4) in \
+        {'0000', '0001', '0002', '0003'}
+    assert shards.shard_key('apps/scm', shards=4) == \
+        shards.shard_key('apps/scm', shards=4)
+    assert shards.shard_key('apps/scm', scheme='prefix') == 'apps'
+    assert shards.shard_key('libs/net/http', scheme='prefix',
+                            depth=2) == 'libs/net'
+    assert shards.shard_key('toplevel', scheme='prefix') == ''
+    with pytest.raises(ValueError):
+        shards.shard_key('apps/scm', scheme='nope')
+
+
+def test_shard_filename():
+    assert shards.shard_filename('0003') == '0003.json'
+    assert shards.shard_filename('libs/net', 'prefix').startswith('libs_net-')
+    assert shards.shard_filename('', 'prefix').startswith('root-')
+
+
+def test_lookup_loads_only_needed_shards(shard_dir):
+    assert shards.is_sharded(shard_dir)
+    data = shards.ShardedCorrelation(shard_dir)
+    assert len(data) == len(CORRELATION)
+    assert data['apps/scm'] == CORRELATION['apps/scm']
+    assert data.loaded == [shards.shard_key('apps/scm', shards=4)]
+    assert 'apps' not in data
+    assert data.get('zzz') is None
+    with pytest.raises(KeyError):
+        data['aaa']  # pylint: disable=pointless-statement
+    assert dict(data.items()) == CORRELATION
+    assert sorted(data) == sorted(CORRELATION)
+
+
+@pytest.mark.parametrize('depth', [1, 2])
+def test_prefix_scheme(tmpdir, depth):
+    directory = str(tmpdir)
+    written = shards.write_shards(CORRELATION, directory, scheme='prefix',
+                                  depth=depth)
+    assert sorted(written) == sorted(
+        {shards.shard_key(module, 'prefix', depth=depth)
+         for module in CORRELATION})
+    data = shards.ShardedCorrelation(directory)
+    assert data['libs/åäö'] == CORRELATION['libs/åäö']
+    assert dict(data.items()) == CORRELATION
+
+
+def test_rewrite_changed_shards(shard_dir):
+    correlation = dict(CORRELATION)
+    correlation['apps/scm'] = {'test_syslog': 9}
+    key = shards.shard_key('apps/scm', shards=4)
+    files = [entry['file'] for entry in
+             shards.read_manifest(shard_dir)['files'].values()]
+    mtimes = {filename: os.stat(os.path.join(shard_dir, filename)).st_mtime_ns
+              for filename in files}
+
+    written = shards.write_shards(correlation, shard_dir, shards=4,
+                                  modules=['apps/scm'])
+    assert written == [key]
+    data = shards.ShardedCorrelation(shard_dir)
+    assert dict(data.items()) == correlation
+    for filename, mtime in mtimes.items():
+        if filename != shards.shard_filename(key):
+            assert os.stat(os.path.join(shard_dir, filename)).st_mtime_ns == \
+                mtime
+
+
+def test_rewrite_drops_empty_shards(tmpdir):
+    directory = str(tmpdir)
+    shards.write_shards(CORRELATION, directory, scheme='prefix')
+    correlation = {module: tests for module, tests in CORRELATION.items()
+                   if not module.startswith('libs/')}
+    shards.write_shards(correlation, directory, scheme='prefix',
+                        modules=['libs/åäö'])
+    assert 'libs' not in shards.read_manifest(directory)['files']
+    assert sorted(os.listdir(directory)) == sorted(
+        [shards.MANIFEST] + [shards.shard_filename(key, 'prefix')
+                             for key in ('apps', '')])
+
+
+def test_layout_change_rewrites_everything(shard_dir):
+    shards.write_shards(CORRELATION, shard_dir, shards=2, modules=['x'])
+    manifest = shards.read_manifest(shard_dir)
+    assert manifest['shards'] == 2
+    assert len(os.listdir(shard_dir)) == len(manifest['files']) + 1
+    assert dict(shards.ShardedCorrelation(shard_dir).items()) == CORRELATION
+
+
+def test_correlation_parser_reads_shards(shard_dir, capsys):
+    args = make_args(modules=['apps/scm', 'apps/recording_indexer'])
+    correlation_parser.narrow(shard_dir, args)
+    assert capsys.readouterr().out.split() == [
+        'test_syslog', 'ptz_tests', 'discovery_tests', 'test_the_rest']
+    correlation_parser.wide(shard_dir, args)
+    assert capsys.readouterr().out.split()[0] == 'test_syslog'
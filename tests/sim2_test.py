@@ -1,9 +1,15 @@
 # -*- coding: utf-8 -*-
 """Tests for sim2.py"""
+import importlib.util
 import unittest
 from collections import Counter
+from random import Random
+
+import pytest
 
 import diff.simulatron.sim2 as sim2
+from diff.simulatron import simulatron
+from util.util import json_dumps
 from util.util import json_loads
 
 # pylint: disable=missing-docstring
@@ -11,6 +17,9 @@ from util.util import json_loads
 # pylint: disable=too-many-public-methods
 # pylint: disable=no-self-use
 
+# The vectorized generator is an optional extra
+HAVE_NUMPY = importlib.util.find_spec('numpy') is not None
+
 # from unittest.mock import patch
 # from unittest.mock import MagicMock
 # mock_rand = MagicMock(side_effect=[num for num in range(10)])
@@ -75,9 +84,6 @@ def test_pkgmappings():
 class IntegrationTests(unittest.TestCase):
     """More complicated tests involving more parts of the sim2 functions"""
     def test_create_superset(self):
-        # NOTE This test fails for unknown reasons, but probably due to
-        # dict/set hashing being in a different order in Python3. This might
-        # lead to problems, so it can be worthwhile to get back to this later
         nbr_paks = 10
         superset = sim2.create_superset(packages=nbr_paks, pkg_noise=100,
                                         test_noise=100, seed=1, builds=2)
@@ -85,55 +91,74 @@ class IntegrationTests(unittest.TestCase):
         tests = [(name, 'pass') for name in testnames]
         # Check that modules are correct
         assert nbr_paks == len(superset['prod0']['0']['modules'])
-        assert set(superset['prod0']['0']['modules']) == set([('pak0', 'rev0'),
-                                                              ('pak1', 'Xrev1'),
-                                                              ('pak2', 'rev1'),
-                                                              ('pak3', 'rev1'),
-                                                              ('pak4', 'rev0'),
+        assert set(superset['prod0']['0']['modules']) == set([('pak0', 'Xrev1'),
+                                                              ('pak1', 'rev0'),
+                                                              ('pak2', 'rev0'),
+                                                              ('pak3', 'rev0'),
+                                                              ('pak4', 'rev1'),
                                                               ('pak5', 'rev0'),
                                                               ('pak6', 'rev0'),
-                                                              ('pak7', 'rev0'),
+                                                              ('pak7', 'rev1'),
                                                               ('pak8', 'rev0'),
                                                               ('pak9', 'rev0')]
                                                             )
 
-        assert superset['prod0']['1']['modules'] == [('pak0', 'rev0'),
-                                                     ('pak1', 'Xrev2'),
-                                                     ('pak2', 'rev2'),
-                                                     ('pak3', 'rev2'),
-                                                     ('pak4', 'rev0'),
+        # the builds of a product are drawn from one random generator, so the
+        # next build changes other packages than the first one
+        assert superset['prod0']['1']['modules'] == [('pak0', 'Xrev1'),
+                                                     ('pak1', 'rev1'),
+                                                     ('pak2', 'rev0'),
+                                                     ('pak3', 'rev0'),
+                                                     ('pak4', 'rev1'),
                                                      ('pak5', 'rev0'),
-                                                     ('pak6', 'rev0'),
-                                                     ('pak7', 'rev0'),
+                                                     ('pak6', 'rev1'),
+                                                     ('pak7', 'rev1'),
                                                      ('pak8', 'rev0'),
-                                                     ('pak9', 'rev0')]
+                                                     ('pak9', 'Xrev1')]
         # Check that tests are correct
         assert len(tests) == len(superset['prod0']['0']['tests'])
-        assert superset['prod0']['0']['tests'] == [('pak0.test', 'pass'),
-                                                   ('pak1.test', 'fail'),
-                                                   ('pak2.test', 'fail'),
-                                                   ('pak3.test', 'fail'),
+        assert superset['prod0']['0']['tests'] == [('pak0.test', 'fail'),
+                                                   ('pak1.test', 'pass'),
+                                                   ('pak2.test', 'pass'),
+                                                   ('pak3.test', 'pass'),
                                                    ('pak4.test', 'pass'),
                                                    ('pak5.test', 'pass'),
                                                    ('pak6.test', 'pass'),
                                                    ('pak7.test', 'pass'),
-                                                   ('pak8.test', 'pass'),
-                                                   ('pak9.test', 'pass')]
-
-        # the next test set will flip the same tests as in the first set, so
-        # that means that they will change back to pass, meaning that all tests
-        # will pass
-        assert superset['prod0']['1']['tests'] == [('pak0.test', 'pass'),
+                                                   ('pak8.test', 'fail'),
+                                                   ('pak9.test', 'fail')]
+        assert superset['prod0']['1']['tests'] == [('pak0.test', 'fail'),
                                                    ('pak1.test', 'pass'),
                                                    ('pak2.test', 'pass'),
-                                                   ('pak3.test', 'pass'),
-                                                   ('pak4.test', 'pass'),
+                                                   ('pak3.test', 'fail'),
+                                                   ('pak4.test', 'fail'),
                                                    ('pak5.test', 'pass'),
                                                    ('pak6.test', 'pass'),
                                                    ('pak7.test', 'pass'),
-                                                   ('pak8.test', 'pass'),
+                                                   ('pak8.test', 'fail'),
                                                    ('pak9.test', 'pass')]
 
+    def test_create_superset_is_reproducible(self):
+        kwargs = dict(products=3, packages=10, builds=20, pkg_noise=30,
+                      test_noise=30, seed=42)
+        superset = sim2.create_superset(**kwargs)
+        assert superset == sim2.create_superset(**kwargs)
+        assert superset['prod0'] != superset['prod1']
+        assert superset != sim2.create_superset(**dict(kwargs, seed=43))
+
+    def test_create_superset_parallel(self):
+        for vectorized in (False, True) if HAVE_NUMPY else (False,):
+            kwargs = dict(products=5, packages=10, builds=20, pkg_noise=30,
+                          test_noise=30, seed=7, vectorized=vectorized)
+            serial = sim2.create_superset(**kwargs)
+            assert sim2.create_superset(jobs=2, **kwargs) == serial
+            assert sim2.create_superset(jobs=3, **kwargs) == serial
+            lazy = list(sim2.iter_superset(jobs=2, **kwargs))
+            assert [(product, build.dict[build.name]) for product, build in
+                    lazy] == [(product, serial[product][name])
+                              for product in sorted(serial)
+                              for name in serial[product]]
+
     def test_several_supersets_differ(self):
         superset1 = sim2.create_superset()
         superset2 = sim2.create_superset()
@@ -176,6 +201,97 @@ class IntegrationTests(unittest.TestCase):
                 assert val < 2, "dupes found: {}".format(bid1_tests)
 
 
+def test_product_seed():
+    assert sim2.product_seed(1, 'prod0') == sim2.product_seed(1, 'prod0')
+    assert sim2.product_seed(1, 'prod0') != sim2.product_seed(1, 'prod1')
+    assert sim2.product_seed(1, 'prod0') != sim2.product_seed(2, 'prod0')
+
+
+def test_random_build_rng():
+    pkgs = [('pak{}'.format(num), 'rev0') for num in range(10)]
+    tests = [('pak{}.test'.format(num), 'pass') for num in range(10)]
+    first = sim2.random_build(pkgs, tests, 50, 50, rng=Random(3))
+    assert first == sim2.random_build(pkgs, tests, 50, 50, rng=Random(3))
+
+
+def test_generate_buildset_noise_varies_across_builds():
+    mappings = {'pak{}'.format(num): 'pak{}.test'.format(num)
+                for num in range(10)}
+    buildset = sim2.generate_buildset(40, mappings, pkg_noise=50,
+                                      test_noise=50, seed=3)
+    builds = [dict(buildset.dict[str(num)]['modules']) for num in range(40)]
+    # one correlated change per build, and two more in the noisy ones
+    changes = {sum(previous[pak] != build[pak] for pak in build)
+               for previous, build in zip(builds, builds[1:])}
+    assert changes == {1, 3}
+    assert buildset.dict == sim2.generate_buildset(
+        40, mappings, pkg_noise=50, test_noise=50, seed=3).dict
+
+
+# Test lazy generation and the line oriented format
+# ##################################################
+
+def test_iter_superset():
+    builds = list(sim2.iter_superset(products=2, packages=5, builds=3))
+    assert [(product, build.name) for product, build in builds] == [
+        ('prod0', '0'), ('prod0', '1'), ('prod0', '2'),
+        ('prod1', '0'), ('prod1', '1'), ('prod1', '2')]
+
+
+def test_iter_superset_vectorized():
+    pytest.importorskip('numpy')
+    builds = list(sim2.iter_superset(products=2, packages=5, builds=3,
+                                     seed=1, vectorized=True))
+    superset = sim2.create_superset(products=2, packages=5, builds=3,
+                                    seed=1, vectorized=True)
+    for product, build in builds:
+        assert build.dict[build.name] == superset[product][build.name]
+
+
+@pytest.mark.parametrize('pretty', [False, True])
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_iter_superset_json(pretty, jobs):
+    kwargs = dict(products=3, packages=5, builds=4, pkg_noise=20,
+                  test_noise=20, seed=5)
+    text = ''.join(sim2.iter_superset_json(jobs=jobs, pretty=pretty,
+                                           **kwargs))
+    assert text == json_dumps(sim2.create_superset(**kwargs), pretty=pretty)
+
+
+def test_iter_superset_json_no_products():
+    assert ''.join(sim2.iter_superset_json(products=0)) == '{}'
+
+
+@pytest.mark.parametrize('pretty', [[], ['--pretty']])
+def test_simulatron_json_output(tmpdir, pretty):
+    filename = str(tmpdir.join('history.json.gz'))
+    simulatron.main(['-f', filename, '--products', '2', '--packages', '4',
+                     '--builds', '3', '--seed', '9'] + pretty)
+    with sim2.util.open_file(filename) as fileh:
+        text = fileh.read()
+    assert text == json_dumps(sim2.create_superset(2, 4, 3, seed=9),
+                              pretty=bool(pretty))
+
+
+def test_engine_build():
+    build = {'modules': [['pak0', 'rev0']],
+             'tests': [['pak0.test', 'fail'], ['pak1.test', 'pass']]}
+    assert sim2.engine_build(build) == {
+        'modules': [['pak0', 'rev0']],
+        'tests': {'pass': ['pak1.test'], 'fail': ['pak0.test']}}
+
+
+def test_ndjson_record():
+    build = sim2.Build(7, [('pak1', 'rev1'), ('pak0', 'Xrev2')],
+                       [('pak0.test', 'fail'), ('pak1.test', 'pass')])
+    record = sim2.ndjson_record('prod3', build)
+    assert list(record) == ['product', 'build', 'modules', 'tests']
+    assert record['product'] == 'prod3'
+    assert record['build'] == '7'
+    assert record['modules'] == [('pak0', 'Xrev2'), ('pak1', 'rev1')]
+    assert record['tests'] == {'pass': ['pak1.test'], 'fail': ['pak0.test']}
+
+
 # test newrev
 # ===========
 
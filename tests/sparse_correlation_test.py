@@ -0,0 +1,66 @@
+"""Tests for the sparse correlation backend"""
+import sys
+
+import pytest
+
+pytest.importorskip('numpy')
+pytest.importorskip('scipy')
+
+# pylint: disable=wrong-import-position
+from diff import diffeng
+from diff.difference_engine import correlate
+from diff.sparse_correlation import correlate_sparse
+from diff.sparse_correlation import incidence_matrices
+
+# pylint: disable=missing-docstring
+
+DIFFS = [
+    {'modules': [], 'tests': []},
+    {'modules': ['mod1', 'mod2'], 'tests': ['testA', 'testB', 'testC']},
+    {'modules': ['mod1', 'mod3'], 'tests': ['testA', 'testC']},
+    {'modules': ['mod4'], 'tests': []},
+    {'modules': ['mod2', 'mod3'], 'tests': ['testA', 'testB']},
+    {'modules': ['mod1', 'mod2', 'mod3'], 'tests': ['testB', 'testC']},
+]
+
+
+def as_dict(correlation):
+    """Drop the ordering, which differs between the backends"""
+    return {module: dict(tests) for module, tests in correlation.items()}
+
+
+def test_incidence_matrices():
+    modules, tests, module_matrix, test_matrix = incidence_matrices(DIFFS)
+    assert modules == ['mod1', 'mod2', 'mod3']
+    assert tests == ['testA', 'testB', 'testC']
+    assert module_matrix.shape == (4, 3)
+    assert test_matrix.shape == (4, 3)
+    assert module_matrix.toarray().tolist() == [[1, 1, 0], [1, 0, 1],
+                                                [0, 1, 1], [1, 1, 1]]
+
+
+def test_correlate_sparse_same_as_correlate():
+    correlation = correlate_sparse(DIFFS)
+    assert as_dict(correlation) == as_dict(correlate(DIFFS))
+    assert list(correlation) == list(correlate(DIFFS))
+
+
+def test_correlate_sparse_duplicates_and_generators():
+    diffs = [{'modules': ['mod1', 'mod1'], 'tests': ['testA']},
+             {'modules': ['mod2'], 'tests': ['testA', 'testA']}]
+    assert as_dict(correlate_sparse(iter(diffs))) == as_dict(correlate(diffs))
+
+
+def test_correlate_sparse_empty():
+    assert correlate_sparse([]) == {}
+    assert correlate_sparse([{'modules': ['mod1'], 'tests': []}]) == {}
+
+
+def test_diffeng_without_scipy(monkeypatch):
+    monkeypatch.delitem(sys.modules, 'diff.sparse_correlation')
+    monkeypatch.setitem(sys.modules, 'scipy', None)
+    args = diffeng.parse_args(['in.json', 'out.json', '--backend', 'sparse'])
+    with pytest.raises(SystemExit) as error:
+        diffeng.engine_functions(args)
+    assert 'DifferenceEngine[sparse]' in str(error.value)
+    assert 'scipy' in str(error.value)
@@ -0,0 +1,123 @@
+"""Tests for the SQLite correlation store"""
+import os
+
+import pytest
+
+from diff import sqlstore
+from scripts import correlation_parser
+from util.util import json_dumps
+
+from tests import helpers
+from tests.helpers import make_args
+
+# pylint: disable=missing-docstring
+# pylint: disable=redefined-outer-name
+
+CORRELATION = dict(helpers.CORRELATION)
+CORRELATION['libs/åäö'] = {'test_ünicode': 1, 'test_decayed': 0.25}
+
+
+@pytest.fixture
+def store_file(tmpdir):
+    filename = str(tmpdir.join('correlation.db'))
+    sqlstore.write_store(CORRELATION, filename)
+    return filename
+
+
+def test_store_lookup(store_file):
+    with sqlstore.CorrelationStore(store_file) as store:
+        assert len(store) == 4
+        assert list(store) == sorted(CORRELATION)
+        for module in CORRELATION:
+            assert module in store
+            assert store[module] == CORRELATION[module]
+        assert isinstance(store['libs/åäö']['test_ünicode'], int)
+        assert 'apps' not in store
+        assert store.get('zzz') is None
+        with pytest.raises(KeyError):
+            store['aaa']  # pylint: disable=pointless-statement
+        assert dict(store.items()) == CORRELATION
+
+
+def test_is_store(store_file):
+    assert sqlstore.is_store(store_file)
+    assert not sqlstore.is_store(__file__)
+    assert not sqlstore.is_store('/tmp/no/such/file.db')
+    with pytest.raises(ValueError):
+        sqlstore.CorrelationStore(__file__)
+
+
+def test_overwrite(store_file):
+    with sqlstore.CorrelationStore(store_file) as old:
+        sqlstore.write_store({'mod': {'test': 1}}, store_file)
+        assert old['apps/scm'] == CORRELATION['apps/scm']
+    assert not os.path.exists(store_file + '.tmp')
+    with sqlstore.CorrelationStore(store_file) as store:
+        assert dict(store.items()) == {'mod': {'test': 1}}
+
+
+@pytest.mark.parametrize('order', sorted(sqlstore.ORDER_BY))
+@pytest.mark.parametrize('modules', [None, ['apps/scm', 'libs/åäö'],
+                                     ['apps/scm', 'apps/recording_indexer']])
+def test_select_sorts_like_sort_tests(store_file, order, modules):
+    selected = modules or list(CORRELATION)
+    tests = correlation_parser.sum_tests(
+        {module: CORRELATION[module] for module in selected})
+    with sqlstore.CorrelationStore(store_file) as store:
+        assert store.select(modules, order=order) == \
+            correlation_parser.sort_tests(tests, order)
+        assert store.select(modules, order=order, top=2) == \
+            correlation_parser.sort_tests(tests, order, top=2)
+        assert store.sum_weights(modules) == tests
+
+
+def test_select_cutoff(store_file):
+    with sqlstore.CorrelationStore(store_file) as store:
+        assert store.select(cutoff=11) == [('test_syslog', 31),
+                                           ('ptz_tests', 11)]
+        assert store.select(['nope']) == []
+        with pytest.raises(ValueError):
+            store.select(order='random')
+
+
+def test_select_repeated_module_same_as_json(store_file, tmpdir, capsys):
+    with sqlstore.CorrelationStore(store_file) as store:
+        assert store.sum_weights(['apps/scm', 'apps/scm']) == {
+            'test_syslog': 16, 'ptz_tests': 22, 'test_the_rest': 8}
+        assert store.select([]) == []
+    json_file = str(tmpdir.join('correlation.json'))
+    with open(json_file, 'w') as fileh:
+        fileh.write(json_dumps(CORRELATION))
+    args = make_args(verbose=True, modules=['apps/scm', 'apps/scm',
+                                            'apps/recording_indexer'])
+    correlation_parser.narrow(json_file, args)
+    expected = capsys.readouterr().out.replace(json_file, store_file)
+    correlation_parser.narrow(store_file, args)
+    assert capsys.readouterr().out == expected
+
+
+def test_correlation_parser_queries_store(store_file, capsys):
+    args = make_args(modules=['apps/scm', 'apps/recording_indexer'])
+    correlation_parser.narrow(store_file, args)
+    assert capsys.readouterr().out.split() == [
+        'test_syslog', 'ptz_tests', 'discovery_tests', 'test_the_rest']
+    correlation_parser.wide(store_file, make_args(modules=args.modules, top=1))
+    assert capsys.readouterr().out.split() == ['test_syslog']
+
+
+@pytest.mark.parametrize('mode', ['narrow', 'wide'])
+@pytest.mark.parametrize('budget', [None, 100])
+def test_correlation_parser_cutoff_same_as_json(store_file, tmpdir, capsys,
+                                                mode, budget):
+    json_file = str(tmpdir.join('correlation.json'))
+    with open(json_file, 'w') as fileh:
+        fileh.write(json_dumps(CORRELATION))
+    args = make_args(verbose=True,
+                     modules=['apps/scm', 'apps/recording_indexer'],
+                     cutoff=11, budget=budget, default_duration=1)
+    select = getattr(correlation_parser, mode)
+    select(json_file, args)
+    expected = capsys.readouterr().out.replace(json_file, store_file)
+    assert 'test_the_rest' not in expected
+    select(store_file, args)
+    assert capsys.readouterr().out == expected
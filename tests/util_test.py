@@ -6,6 +6,7 @@ from util.util import Build
 # pylint: disable=no-self-use
 # pylint: disable=missing-docstring
 # pylint: disable=too-many-public-methods
+import io
 import unittest
 import pytest
 from collections import OrderedDict
@@ -64,6 +65,115 @@ def test_json_loads():
             count += 1
 
 
+# Tests for iter_json_builds()
+HISTORY = """
+    {"prod1": {"bid1": {"modules": [["mod1", 1]], "tests": {"pass": ["t1"],
+                                                         "fail": []}},
+               "bid2": {"modules": [["mod1", 2]], "tests": {"pass": [],
+                                                         "fail": ["t1"]}}},
+     "prod2": {},
+     "prod3": {"bid1": 12345}}
+"""
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 7, 64, 100000])
+def test_iter_json_builds(chunk_size):
+    builds = list(util.iter_json_builds(io.StringIO(HISTORY),
+                                        chunk_size=chunk_size))
+    loaded = util.json_loads(HISTORY)
+    assert builds == [('prod1', 'bid1', loaded['prod1']['bid1']),
+                      ('prod1', 'bid2', loaded['prod1']['bid2']),
+                      ('prod3', 'bid1', 12345)]
+    assert isinstance(builds[0][2], OrderedDict)
+
+
+def test_iter_json_builds_empty_object():
+    assert list(util.iter_json_builds(io.StringIO(' { } '))) == []
+
+
+@pytest.mark.parametrize('text', ['', '[]', '{"prod": {"bid": 1}',
+                                  '{"prod": {"bid": 1} "x"}',
+                                  '{"prod": {"bid": {"modules": [}}}',
+                                  '{"prod": {}} {}'])
+def test_iter_json_builds_invalid(text):
+    with pytest.raises(ValueError):
+        list(util.iter_json_builds(io.StringIO(text), chunk_size=3))
+
+
+# Tests for iter_ndjson_builds()
+NDJSON_HISTORY = """\
+{"product": "prod1", "build": "bid1", "modules": [["mod1", 1]], "tests": {}}
+{"product": "prod2", "build": "bid1", "modules": [], "tests": {}}
+
+{"product": "prod1", "build": "bid2", "modules": [["mod1", 2]], "tests": {}}
+"""
+
+
+def test_iter_ndjson_builds():
+    builds = list(util.iter_ndjson_builds(io.StringIO(NDJSON_HISTORY)))
+    assert [build[:2] for build in builds] == [('prod1', 'bid1'),
+                                               ('prod2', 'bid1'),
+                                               ('prod1', 'bid2')]
+    assert builds[2][2] == {'modules': [['mod1', 2]], 'tests': {}}
+    assert isinstance(builds[0][2], OrderedDict)
+
+
+@pytest.mark.parametrize('line', ['{"product": "prod1", "modules": []}',
+                                  '[1, 2]', '{"product": "prod1", "build"'])
+def test_iter_ndjson_builds_invalid(line):
+    with pytest.raises(ValueError):
+        list(util.iter_ndjson_builds(io.StringIO(NDJSON_HISTORY + line)))
+
+
+def test_ndjson_and_json_histories_diff_the_same():
+    from diff.difference_engine import diff_build_stream
+    history = OrderedDict()
+    for product, buildname, build in util.iter_ndjson_builds(
+            io.StringIO(NDJSON_HISTORY)):
+        build['tests'] = {'pass': [], 'fail': []}
+        history.setdefault(product, OrderedDict())[buildname] = build
+    lines = [util.json_dumps(OrderedDict(
+        [('product', product), ('build', buildname)] + list(build.items())))
+             for product in history for buildname, build in
+             history[product].items()]
+    assert list(diff_build_stream(util.iter_ndjson_builds(
+        io.StringIO('\n'.join(lines))))) == list(diff_build_stream(
+            util.iter_json_builds(io.StringIO(util.json_dumps(history)))))
+
+
+# Tests for open_file()
+@pytest.mark.parametrize('extension', ['', '.gz', '.bz2', '.xz', '.lzma'])
+def test_open_file(tmpdir, extension):
+    filename = str(tmpdir.join('history.ndjson' + extension))
+    with util.open_file(filename, 'w') as fileh:
+        fileh.write(NDJSON_HISTORY)
+    with open(filename, 'rb') as fileh:
+        assert (fileh.read() == NDJSON_HISTORY.encode()) == (not extension)
+    with util.open_file(filename) as fileh:
+        builds = list(util.iter_ndjson_builds(fileh))
+    assert [build[:2] for build in builds] == [('prod1', 'bid1'),
+                                               ('prod2', 'bid1'),
+                                               ('prod1', 'bid2')]
+
+
+def test_open_file_streams_json(tmpdir):
+    filename = str(tmpdir.join('history.json.gz'))
+    history = OrderedDict([('prod1', OrderedDict(
+        ('bid{}'.format(num), {'modules': [], 'tests': {}})
+        for num in range(100)))])
+    with util.open_file(filename, 'w') as fileh:
+        fileh.write(util.json_dumps(history))
+    with util.open_file(filename) as fileh:
+        builds = list(util.iter_json_builds(fileh, chunk_size=16))
+    assert len(builds) == 100
+
+
+def test_uncompressed_name():
+    assert util.uncompressed_name('history.ndjson.gz') == 'history.ndjson'
+    assert util.uncompressed_name('history.json.xz') == 'history.json'
+    assert util.uncompressed_name('history.json') == 'history.json'
+
+
 # Tests for assert_is_ordered()
 def test_assert_is_ordered():
     container = OrderedDict()
@@ -108,6 +218,19 @@ def test_getnames_exception():
     assert names == []
 
 
+# Tests for SymbolTable
+def test_symbol_table():
+    symbols = util.SymbolTable()
+    assert symbols.intern('mod1') == 0
+    assert symbols.intern('test1') == 1
+    assert symbols.intern('mod1') == 0
+    assert symbols.name(1) == 'test1'
+    assert symbols.names == ['mod1', 'test1']
+    assert 'mod1' in symbols
+    assert 'mod2' not in symbols
+    assert len(symbols) == 2
+
+
 # Tests for increment()
 def test_increment():
     string = 'hej ladida204 10'
@@ -309,6 +432,26 @@ class TestBuild(unittest.TestCase):
         build = util.Build.build_from_dict(name, contents)
         assert build.dict == {name: {"modules": [pak1], "tests": [test1]}}
 
+    def test_build_sorted_contents_cached(self):
+        build = util.Build('b', [['pak2', 'r1'], ['pak1', 'r1']],
+                           [('test1', 'pass')])
+        assert build.packages == (('pak2', 'r1'), ('pak1', 'r1'))
+        sorted_contents = build.sorted_contents()
+        assert sorted_contents[0] == (('pak1', 'r1'), ('pak2', 'r1'))
+        assert build.sorted_contents() is sorted_contents
+
+        build.packages = [('pak0', 'r2')]
+        assert build.dict['b']['modules'] == [('pak0', 'r2')]
+
+    def test_build_is_slotted(self):
+        with self.assertRaises(AttributeError):
+            self.build.extra = 1
+
+    def test_build_from_build(self):
+        copy = util.Build('copy', self.build.packages, self.build.tests)
+        assert copy.packages is self.build.packages
+        assert copy - self.build == {'modules': set(), 'tests': set()}
+
     def test_build_from_dict_fail(self):
         pak1 = "p1"
         test1 = ("p1.test", "fail")
@@ -413,6 +556,14 @@ class TestBuildSet(unittest.TestCase):
         assert 'pak2.test' in [test[0] for test in
                                buildset.dict['build2']['tests']]
 
+    def test_BuildSet_json_matches_dict(self):
+        buildset = util.BuildSet([self.build1, self.build2, util.Build('b3'),
+                                  util.Build('b4', [()], [()])])
+        for indent in (None, 4):
+            assert buildset.json(indent=indent) == util.json_dumps(
+                buildset.dict, pretty=indent)
+        assert util.BuildSet().json(indent=4) == '{}'
+
 # Tests for validate_list_or_set()
 # ================================
 #  _   _       _ _     _       _       _     _     _
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""Tests for the vectorized Simulatron generator"""
+import pytest
+
+pytest.importorskip('numpy')
+
+# pylint: disable=wrong-import-position
+import diff.simulatron.sim2 as sim2
+from diff.simulatron import vectorized
+
+# pylint: disable=missing-docstring
+
+
+def mappings(nbr):
+    return sim2.pkgmappings(sim2.generate_pkg_names(nbr))
+
+
+def changes(buildset):
+    """The changed packages and flipped tests between consecutive builds,
+    starting from the initial state of all packages at rev0, all tests
+    passing"""
+    builds = buildset.builds
+    prev_pkgs = {name: 'rev0' for name, _ in builds[0].packages}
+    prev_tests = {name: 'pass' for name, _ in builds[0].tests}
+    for build in builds:
+        pkgs, tests = dict(build.packages), dict(build.tests)
+        yield ({name: rev for name, rev in pkgs.items()
+                if rev != prev_pkgs[name]},
+               {name for name in tests if tests[name] != prev_tests[name]})
+        prev_pkgs, prev_tests = pkgs, tests
+
+
+def test_generate_buildset_shape():
+    buildset = vectorized.generate_buildset(20, mappings(12), seed=1)
+    assert buildset.size == 20
+    build = buildset.dict['0']
+    assert [pkg[0] for pkg in build['modules']] == sorted(mappings(12))
+    assert [test[0] for test in build['tests']] == sorted(
+        mappings(12).values())
+    assert list(buildset.dict) == [str(num) for num in range(20)]
+
+
+def test_generate_buildset_seed():
+    first = vectorized.generate_buildset(50, mappings(10), 20, 20, seed=5)
+    second = vectorized.generate_buildset(50, mappings(10), 20, 20, seed=5)
+    third = vectorized.generate_buildset(50, mappings(10), 20, 20, seed=6)
+    assert first.dict == second.dict
+    assert first.dict != third.dict
+
+
+def test_generate_buildset_without_noise():
+    buildset = vectorized.generate_buildset(200, mappings(10), seed=2,
+                                            chunk_size=7)
+    for pkgs, tests in changes(buildset):
+        (name, rev), = pkgs.items()
+        assert rev.startswith('Xrev')
+        assert tests == {name + '.test'}
+
+
+def test_generate_buildset_with_noise():
+    buildset = vectorized.generate_buildset(200, mappings(10), 100, 100,
+                                            seed=3)
+    for pkgs, tests in changes(buildset):
+        marked = [name for name, rev in pkgs.items() if rev.startswith('X')]
+        assert len(marked) == 1
+        assert len(pkgs) == 3
+        assert len(tests) == 3
+        assert marked[0] + '.test' in tests
+
+
+def test_revisions_count_changes():
+    buildset = vectorized.generate_buildset(300, mappings(5), 50, 0, seed=4)
+    counts = dict.fromkeys(mappings(5), 0)
+    for pkgs, _ in changes(buildset):
+        for name in pkgs:
+            counts[name] += 1
+    last = dict(buildset.builds[-1].packages)
+    assert {name: int(rev.lstrip('Xrev')) for name, rev in last.items()} == \
+        counts
+
+
+@pytest.mark.parametrize('noise', [10, 50])
+def test_noise_rate(noise):
+    size = 4000
+    buildset = vectorized.generate_buildset(size, mappings(20), noise, noise,
+                                            seed=7)
+    noisy_pkgs = noisy_tests = 0
+    for pkgs, tests in changes(buildset):
+        noisy_pkgs += len(pkgs) == 3
+        noisy_tests += len(tests) == 3
+    assert abs(noisy_pkgs / float(size) - noise / 100.0) < 0.03
+    assert abs(noisy_tests / float(size) - noise / 100.0) < 0.03
+
+
+def test_noise_needs_three_packages():
+    with pytest.raises(ValueError):
+        vectorized.generate_buildset(10, mappings(2), pkg_noise=100)
+
+
+def test_create_superset_vectorized():
+    superset = sim2.create_superset(products=2, packages=10, builds=3,
+                                    pkg_noise=100, test_noise=100, seed=1,
+                                    vectorized=True)
+    assert sorted(superset) == ['prod0', 'prod1']
+    assert list(superset['prod0']) == ['0', '1', '2']
+    assert len(superset['prod0']['2']['modules']) == 10
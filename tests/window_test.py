@@ -0,0 +1,69 @@
+"""Tests for sliding window correlations"""
+from collections import OrderedDict
+
+import pytest
+
+from diff.difference_engine import correlate
+from diff.difference_engine import diff_builds
+from diff.difference_engine import resolve_correlation
+from diff.window import SlidingWindow
+from diff.window import correlate_window
+from diff.window import iter_windows
+from tests.helpers import as_dict
+from tests.helpers import as_stream
+from tests.helpers import make_history
+from util.util import SymbolTable
+
+# pylint: disable=missing-docstring
+
+
+def windowed(history, size):
+    """Correlate the last size builds of each product the slow way"""
+    diffs = []
+    for product in history:
+        diffs.extend(diff_builds(
+            OrderedDict([(product, history[product])]))[-size:])
+    return correlate(diffs)
+
+
+@pytest.mark.parametrize('size', [1, 2, 4, 6, 100])
+def test_correlate_window(size):
+    history = make_history(products=3, builds=8)
+    window = correlate_window(as_stream(history), size)
+    assert as_dict(window.correlation) == as_dict(windowed(history, size))
+    assert len(window.diffs()) == 3 * min(size, 8)
+
+
+def test_iter_windows_every_build():
+    history = make_history(products=2, builds=9)
+    seen = OrderedDict()
+    for product, buildname, window in iter_windows(as_stream(history), 3):
+        seen.setdefault(product, OrderedDict())[buildname] = \
+            history[product][buildname]
+        assert as_dict(window.correlation) == as_dict(windowed(seen, 3))
+
+
+def test_window_bitset_and_interned():
+    pytest.importorskip('numpy')
+    from diff.bitset_flips import diff_build_stream_bitset
+    history = make_history(products=2, builds=9)
+    symbols = SymbolTable()
+    window = correlate_window(as_stream(history), 4,
+                              diff_stream=diff_build_stream_bitset,
+                              symbols=symbols)
+    correlation = resolve_correlation(window.correlation, symbols)
+    assert as_dict(correlation) == as_dict(windowed(history, 4))
+
+
+def test_counts_that_leave_are_dropped():
+    window = SlidingWindow(1)
+    window.push('prod', {'modules': ['mod1'], 'tests': ['testA']})
+    window.push('prod', {'modules': ['mod2'], 'tests': ['testA']})
+    assert window.correlation == {'mod2': {'testA': 1}}
+    window.push('prod', {'modules': [], 'tests': []})
+    assert window.correlation == {}
+
+
+def test_invalid_size():
+    with pytest.raises(ValueError):
+        SlidingWindow(0)
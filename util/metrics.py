@@ -0,0 +1,223 @@
+"""Instrumentation of the Difference Engine pipeline.
+
+Named timers, counters, peak memory samples and an optional cProfile capture,
+collected in one process wide registry:
+
+    metrics.enable()
+    with metrics.timer('correlate'):
+        correlation = correlate(diffs)
+    metrics.count('pairs_emitted', 42)
+    metrics.write('/tmp/metrics.json')
+
+Metrics are disabled until `enable` is called. Until then `timer` returns a
+shared no-op context manager and `count` returns at once, so instrumented code
+costs next to nothing when nobody is looking. Hot loops can check `enabled`
+once instead of calling `count` per item.
+
+Peak memory is the peak resident set size of the process, sampled when each
+timer stops, so the sample of a stage is the peak up to and including it.
+Metrics of worker processes are not collected.
+
+The report written by `write` looks like:
+
+    {"timers": {"correlate": {"calls": 1, "seconds": 0.12}},
+     "counters": {"pairs_emitted": 42},
+     "peak_memory": {"correlate": 52428800},
+     "max_rss_bytes": 52428800,
+     "profile": [{"function": "difference_engine.py:317(correlate)",
+                  "calls": 1, "seconds": 0.1, "cumulative": 0.12}, ...]}
+
+where profile is only included if profiling was enabled.
+"""
+import cProfile
+import functools
+import json
+import pstats
+import sys
+import time
+from collections import OrderedDict
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+# Amount of functions listed in the profile part of the report
+PROFILE_TOP = 25
+
+_REGISTRY = None
+
+
+def max_rss():
+    """Returns the peak resident set size of the process in bytes, or None
+    if it can not be measured on this platform"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class Metrics(object):
+    """The collected metrics of a process, see the module documentation"""
+
+    def __init__(self, profile=False):
+        self.timers = OrderedDict()  # name -> [calls, seconds]
+        self.counters = OrderedDict()
+        self.peak_memory = OrderedDict()
+        self.profiler = cProfile.Profile() if profile else None
+
+    def add_time(self, name, seconds):
+        """Record one call of timer name that took seconds"""
+        try:
+            timing = self.timers[name]
+        except KeyError:
+            timing = self.timers[name] = [0, 0.0]
+        timing[0] += 1
+        timing[1] += seconds
+        self.peak_memory[name] = max_rss()
+
+    def count(self, name, amount=1):
+        """Add amount to counter name"""
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def profile_stats(self, top=PROFILE_TOP):
+        """Returns the top functions of the profile by cumulative time"""
+        if self.profiler is None:
+            return []
+        stats = pstats.Stats(self.profiler).stats
+        functions = sorted(stats.items(), key=lambda item: item[1][3],
+                           reverse=True)[:top]
+        return [OrderedDict([
+            ('function', '{}:{}({})'.format(*function)),
+            ('calls', calls), ('seconds', own), ('cumulative', cumulative)])
+                for function, (_, calls, own, cumulative, _) in functions]
+
+    def report(self):
+        """Returns the metrics as a json serializable dict"""
+        report = OrderedDict([
+            ('timers', OrderedDict(
+                (name, OrderedDict([('calls', calls), ('seconds', seconds)]))
+                for name, (calls, seconds) in self.timers.items())),
+            ('counters', OrderedDict(self.counters)),
+            ('peak_memory', OrderedDict(self.peak_memory)),
+            ('max_rss_bytes', max_rss()),
+        ])
+        if self.profiler is not None:
+            report['profile'] = self.profile_stats()
+        return report
+
+
+class _Timer(object):
+    """Context manager that adds the time it was entered to a timer"""
+
+    __slots__ = ('registry', 'name', 'start')
+
+    def __init__(self, registry, name):
+        self.registry = registry
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.registry.add_time(self.name, time.perf_counter() - self.start)
+
+
+class _NullTimer(object):
+    """Context manager that does nothing, used while metrics are disabled"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def enable(profile=False):
+    """Start collecting metrics, replacing any collected so far.
+
+    Args:
+        profile (bool): Also profile every function call with cProfile,
+            which slows the program down considerably
+
+    Returns:
+        (Metrics): The registry the metrics are collected in
+    """
+    global _REGISTRY  # pylint: disable=global-statement
+    disable()
+    _REGISTRY = Metrics(profile=profile)
+    if profile:
+        _REGISTRY.profiler.enable()
+    return _REGISTRY
+
+
+def disable():
+    """Stop collecting metrics.
+
+    Returns:
+        (Metrics): The registry with the collected metrics, or None if
+        metrics were not enabled
+    """
+    global _REGISTRY  # pylint: disable=global-statement
+    registry, _REGISTRY = _REGISTRY, None
+    if registry is not None and registry.profiler is not None:
+        registry.profiler.disable()
+    return registry
+
+
+def enabled():
+    """Returns True if metrics are being collected"""
+    return _REGISTRY is not None
+
+
+def timer(name):
+    """Returns a context manager that times its block as timer name"""
+    if _REGISTRY is None:
+        return _NULL_TIMER
+    return _Timer(_REGISTRY, name)
+
+
+def timed(name):
+    """Decorator that times every call of a function as timer name"""
+    def decorator(function):  # pylint: disable=missing-docstring
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):  # pylint: disable=missing-docstring
+            if _REGISTRY is None:
+                return function(*args, **kwargs)
+            with _Timer(_REGISTRY, name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(name, amount=1):
+    """Add amount to counter name"""
+    if _REGISTRY is not None:
+        _REGISTRY.count(name, amount)
+
+
+def report():
+    """Returns the collected metrics as a dict, empty if metrics are not
+    enabled"""
+    return _REGISTRY.report() if _REGISTRY is not None else {}
+
+
+def write(filename):
+    """Write the collected metrics to filename as json"""
+    with open(filename, 'w') as fileh:
+        json.dump(report(), fileh, indent=4, separators=(',', ': '))
+
+
+def write_profile(filename):
+    """Write the full cProfile statistics to filename, for use with pstats
+    or a profile viewer. Does nothing unless profiling is enabled."""
+    if _REGISTRY is not None and _REGISTRY.profiler is not None:
+        _REGISTRY.profiler.dump_stats(filename)
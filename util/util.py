@@ -1,13 +1,30 @@
 """Utility functions and stuff"""
-import time
-import logging
+import importlib
+import io
 import json
 import re
 from collections import OrderedDict
 
+from util import metrics
+
 # http://www.kammerl.de/ascii/AsciiSignature.php
 # http://www.network-science.de/ascii/
 
+# Amount of characters read at a time when streaming json from a file
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# File extensions of line oriented build histories, see `iter_ndjson_builds`
+NDJSON_EXTENSIONS = ('.ndjson', '.jsonl')
+
+# File extensions of compressed files, and the modules that open them, see
+# `open_file`
+COMPRESSION_MODULES = OrderedDict([
+    ('.gz', 'gzip'),
+    ('.bz2', 'bz2'),
+    ('.xz', 'lzma'),
+    ('.lzma', 'lzma'),
+])
+
 
 # util functions
 # ==============
@@ -18,16 +35,9 @@ from collections import OrderedDict
 # | |_| | |_| | | | | | |_| | | | | (__| |_| | (_) | | | \__ \
 #  \__,_|\__|_|_| |_|  \__,_|_| |_|\___|\__|_|\___/|_| |_|___/
 def timeit(method):
-    """Use to decorate functions/methods to log how long they take
-    TODO: Disable timed if logging info is not enabled"""
-    def timed(*args, **kwargs):  # pylint:disable=missing-docstring
-        start = time.time()
-        result = method(*args, **kwargs)
-        end = time.time()
-        logging.info("function %s took %.3f sec", method.__name__, end-start)
-        return result
-    # Only time if log level is high enough
-    return timed
+    """Use to decorate functions/methods to time them with a timer named after
+    them. Only timed while metrics are enabled, see `util.metrics`."""
+    return metrics.timed(method.__name__)(method)
 
 
 def set_default(obj):
@@ -55,6 +65,164 @@ def json_loads(string):
     return json.loads(string, object_pairs_hook=OrderedDict)
 
 
+class _StreamBuffer(object):
+    """A text buffer on top of a file object that lets a JSON document be
+    decoded one value at a time instead of all at once."""
+
+    whitespace = re.compile(r'[ \t\n\r]*')
+
+    def __init__(self, fileh, chunk_size):
+        self.fileh = fileh
+        self.chunk_size = chunk_size
+        self.buf = ''
+        self.pos = 0
+        self.decoder = json.JSONDecoder(object_pairs_hook=OrderedDict)
+
+    def fill(self):
+        """Read more text into the buffer, dropping what has been consumed.
+        Returns False if the end of the file has been reached."""
+        # Read at least as much as is already buffered so that a value larger
+        # than chunk_size is not rescanned once per chunk
+        chunk = self.fileh.read(max(self.chunk_size, len(self.buf) - self.pos))
+        if not chunk:
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Return the next non-whitespace character without consuming it, or
+        '' at the end of the file"""
+        while True:
+            self.pos = self.whitespace.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                return ''
+
+    def expect(self, char):
+        """Consume `char`, raising ValueError if it is not next in stream"""
+        found = self.peek()
+        if found != char:
+            raise ValueError("Expected '{}' but found '{}'".format(
+                char, found or 'EOF'))
+        self.pos += 1
+
+    def decode(self):
+        """Decode and return the next complete JSON value in the stream"""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except ValueError:
+                if not self.fill():
+                    raise
+                continue
+            # A number at the end of the buffer may continue in the next chunk
+            if end == len(self.buf) and self.fill():
+                continue
+            self.pos = end
+            return value
+
+    def iter_object(self):
+        """Iterate over the keys of a JSON object. The caller must consume the
+        value belonging to a key before asking for the next one."""
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.decode()
+            self.expect(':')
+            yield key
+            char = self.peek()
+            if char not in ',}':
+                raise ValueError("Expected ',' or '}}' but found '{}'".format(
+                    char or 'EOF'))
+            self.pos += 1
+            if char == '}':
+                return
+
+
+def iter_json_builds(fileh, chunk_size=STREAM_CHUNK_SIZE):
+    """Incrementally parse a build history, i.e. a json object of products,
+    each an object of builds, without reading the whole file into memory.
+
+    Args:
+        fileh (file): A file object opened for reading text
+        chunk_size (int): Amount of characters to read at a time
+
+    Yields:
+        (tuple): (product, buildname, build) in the order they appear in the
+        file. The build is an OrderedDict, just as with `json_loads`.
+    """
+    stream = _StreamBuffer(fileh, chunk_size)
+    for product in stream.iter_object():
+        for buildname in stream.iter_object():
+            yield product, buildname, stream.decode()
+    if stream.peek():
+        raise ValueError("Extra data after build history")
+
+
+def iter_ndjson_builds(fileh):
+    """Parse a line oriented build history, with one json object per build:
+
+        {"product": "prod0", "build": "bid1", "modules": [...], "tests": {...}}
+
+    Only one line is read at a time, and builds of different products may be
+    interleaved, as long as the builds of each product are in order.
+
+    Args:
+        fileh (file): A file object opened for reading text
+
+    Yields:
+        (tuple): (product, buildname, build) in the order they appear in the
+        file, where build is an OrderedDict of the remaining keys
+    """
+    for lineno, line in enumerate(fileh, 1):
+        if not line.strip():
+            continue
+        build = json_loads(line)
+        try:
+            product = build.pop('product')
+            buildname = build.pop('build')
+        except (KeyError, AttributeError, TypeError):
+            raise ValueError("Line {} is not a build with a product and a "
+                             "build name".format(lineno))
+        yield product, buildname, build
+
+
+def uncompressed_name(filename):
+    """Return filename without its compression extension, if it has one, e.g.
+    'history.ndjson.gz' -> 'history.ndjson'"""
+    for extension in COMPRESSION_MODULES:
+        if filename.endswith(extension):
+            return filename[:-len(extension)]
+    return filename
+
+
+def open_file(filename, mode='r', encoding='utf-8'):
+    """Open a text file, which is compressed or decompressed on the fly if its
+    extension is one of COMPRESSION_MODULES. Compressed files are streamed,
+    so reading them a chunk at a time, e.g. with `iter_json_builds`, never
+    holds more than that chunk decompressed in memory.
+
+    Args:
+        filename (str): The file to open, e.g. 'history.json.gz'
+        mode (str): 'r' to read, 'w' to write or 'a' to append
+        encoding (str): The encoding of the text
+
+    Returns:
+        (file): A file object for reading or writing text
+    """
+    for extension, module in COMPRESSION_MODULES.items():
+        if filename.endswith(extension):
+            # imported here since Python may be built without some of them
+            return importlib.import_module(module).open(
+                filename, mode + 't', encoding=encoding)
+    return io.open(filename, mode, encoding=encoding)
+
+
 def assert_is_ordered(container):
     """Make sure we are dumping ordered content"""
     if not isinstance(container, OrderedDict):
@@ -89,12 +257,12 @@ def is_tuple_or_list(item):
 
 
 def validate_list_or_set(iterable):
-    """Validate iterable to be either a list or set of tuples"""
-    if not is_list_or_set(iterable):
+    """Validate iterable to be either a list, set or tuple of tuples"""
+    if not (is_list_or_set(iterable) or isinstance(iterable, tuple)):
         raise TypeError("Iterable not valid list or set, was "
                         "{}".format(type(iterable)))
 
-    if iterable == []:  # If iterable is empty list it is also valid
+    if not iterable:  # If iterable is empty it is also valid
         return
 
     first_item = next(iter(iterable))
@@ -143,6 +311,57 @@ def get_names(list_of_tuples):
         names = []
     return list(names)
 
+
+class SymbolTable(object):
+    """Maps names to dense integer ids, and back again.
+
+    Interning names lets every build share one copy of each name, and makes
+    hashing and comparing them as cheap as for ints. Ids are handed out in the
+    order names are first seen, starting at 0.
+    """
+
+    def __init__(self):
+        self._ids = {}
+        self._names = []
+
+    def intern(self, name):
+        """Return the id of `name`, assigning a new one if it is unknown"""
+        try:
+            return self._ids[name]
+        except KeyError:
+            ident = self._ids[name] = len(self._names)
+            self._names.append(name)
+            return ident
+
+    def name(self, ident):
+        """Return the name that was interned as `ident`"""
+        return self._names[ident]
+
+    @property
+    def names(self):
+        """Return all names, indexed by their id"""
+        return self._names
+
+    def __contains__(self, name):
+        return name in self._ids
+
+    def __len__(self):
+        return len(self._names)
+
+
+def _compact(items):
+    """Convert the (name, value) items of a build to a tuple of tuples"""
+    if isinstance(items, tuple) and all(isinstance(item, tuple)
+                                        for item in items):
+        return items
+    return tuple(tuple(item) if isinstance(item, list) else item
+                 for item in items)
+
+
+def _pretty_json(content):
+    """json.dumps content the way json_dumps(pretty=True) does"""
+    return json.dumps(content, indent=4, separators=(',', ': '))
+
 # ______       _ _     _   _____ _
 # | ___ \     (_) |   | | /  __ \ |
 # | |_/ /_   _ _| | __| | | /  \/ | __ _ ___ ___  ___  ___
@@ -153,21 +372,58 @@ def get_names(list_of_tuples):
 
 
 class BaseBuild(object):
-    """A base class for a Build object"""
+    """A base class for a Build object.
+
+    Packages and tests are stored as tuples of (name, value) tuples. Their
+    sorted form, which `dict` and `json` output, is computed the first time
+    it is needed and kept until packages or tests are assigned again.
+    """
+
+    __slots__ = ('name', '_packages', '_tests', '_sorted')
 
     module_string = 'modules'
     test_string = 'tests'
 
     def __init__(self, name, packages, tests):
         self.name = str(name)
-        self.packages = list(packages)
-        self.tests = list(tests)
+        self._packages = _compact(packages)
+        self._tests = _compact(tests)
+        self._sorted = None
+
+    @property
+    def packages(self):
+        """Return the (name, revision) pairs of the build"""
+        return self._packages
+
+    @packages.setter
+    def packages(self, packages):
+        self._packages = _compact(packages)
+        self._sorted = None
+
+    @property
+    def tests(self):
+        """Return the (name, status) pairs of the build"""
+        return self._tests
+
+    @tests.setter
+    def tests(self, tests):
+        self._tests = _compact(tests)
+        self._sorted = None
+
+    def sorted_contents(self):
+        """Return the packages and tests of the build sorted, as a tuple
+        (packages, tests) of tuples"""
+        if self._sorted is None:
+            self._sorted = (tuple(sorted(self._packages)),
+                            tuple(sorted(self._tests)))
+        return self._sorted
 
     @property
     def dict(self):
         """Return Build as a dict"""
-        tup = ((self.module_string, sorted(self.packages)),
-               (self.test_string, sorted(self.tests)))
+        packages, tests = self.sorted_contents()
+        tup = ((self.module_string, list(packages)),
+               (self.test_string, list(tests)))
         ordered = OrderedDict(tup)
         mdict = OrderedDict()
         mdict[self.name] = ordered
@@ -181,6 +437,28 @@ class BaseBuild(object):
         else:
             return json.dumps(mdict, default=set_default)
 
+    def json_contents(self, pretty=False, depth=0):
+        """Return the contents of the build, i.e. the value of its name in
+        `dict`, as json text formatted like `json_dumps` does.
+
+        Args:
+            pretty (bool): Indent the text like `json_dumps(pretty=True)`
+            depth (int): Indentation level the contents are written at
+        """
+        packages, tests = self.sorted_contents()
+        if not pretty:
+            return '{{{}: {}, {}: {}}}'.format(
+                json.dumps(self.module_string), json.dumps(packages),
+                json.dumps(self.test_string), json.dumps(tests))
+        outer = '\n' + ' ' * 4 * depth
+        inner = outer + ' ' * 4
+        return '{{{inner}{}: {},{inner}{}: {}{outer}}}'.format(
+            json.dumps(self.module_string),
+            _pretty_json(packages).replace('\n', inner),
+            json.dumps(self.test_string),
+            _pretty_json(tests).replace('\n', inner),
+            inner=inner, outer=outer)
+
     def __str__(self):
         return self.json(indent=True)
 
@@ -199,6 +477,8 @@ class Build(BaseBuild):
     """A build object contains the packages that were changed in a build as
     well as the tests which failed (or perhaps flipped, to be decided)"""
 
+    __slots__ = ()
+
     def __init__(self, name, packages=None, tests=None):
         """Create a new build.
 
@@ -248,6 +528,8 @@ class Build(BaseBuild):
 class BuildSet(object):
     """An ordered set of Builds"""
 
+    __slots__ = ('product', '_builds')
+
     def __init__(self, builds=None, product='none'):
         self.product = product
         self._builds = builds or list()
@@ -285,10 +567,36 @@ class BuildSet(object):
             builds.append(Build.build_from_dict(build, mdict[build]))
         return BuildSet(builds=builds)
 
+    def iter_json(self, indent=None, depth=0):
+        """Convert buildset to json one build at a time, without creating
+        `dict`. Joined, the chunks are the same text as
+        `json_dumps(self.dict, pretty=indent)`, provided that build names
+        are unique.
+
+        Args:
+            indent (int): Indent the text like `json_dumps(pretty=True)`
+            depth (int): Indentation level the buildset is written at, e.g.
+                1 for the value of a product in a superset
+
+        Yields:
+            (str): Chunks of json text
+        """
+        if not self._builds:
+            yield '{}'
+            return
+        outer = '\n' + ' ' * 4 * depth
+        inner = outer + ' ' * 4
+        separator = ',' + inner if indent else ', '
+        yield '{' + inner if indent else '{'
+        for num, build in enumerate(self._builds):
+            yield '{}{}: {}'.format(
+                separator if num else '', json.dumps(build.name),
+                build.json_contents(pretty=bool(indent), depth=depth + 1))
+        yield outer + '}' if indent else '}'
+
     def json(self, indent=None):
         """Convert buildset to json"""
-        # return json.dumps(self.dict, indent=indent, separators=(',', ': '))
-        return json_dumps(self.dict, pretty=indent)
+        return ''.join(self.iter_json(indent=indent))
 
     def __str__(self):
         return self.json()